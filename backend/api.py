@@ -9,9 +9,9 @@ This application provides endpoints for:
 """
 
 # --- 1. IMPORTS ---
+import time
+_IMPORTS_STARTED = time.perf_counter()
 import os
-import faiss
-import numpy as np
 import psycopg2
 from dotenv import load_dotenv
 from flask import Flask, jsonify, request
@@ -19,16 +19,20 @@ from flask_cors import CORS
 from flask_bcrypt import Bcrypt
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity, JWTManager
 # from services.recommendation_service import get_user_vector, get_filtered_job_ids
-from sklearn.metrics.pairwise import cosine_similarity
-import joblib
 import random
 from datetime import datetime, timedelta, timezone
 import hmac
-from services.email_service import send_verification_email
+from concurrent.futures import ThreadPoolExecutor
+from services.email_service import queue_verification_email, get_email_dispatcher
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from services.recommendation_service import get_recommendations_for_user
-
+from services.recommendation_service import get_recommendations_for_user, invalidate_user_recommendations, recommendation_cache
+from services.db import get_db_connection, release_db_connection, check_db_health, get_pool_stats
+from services.user_embedding_store import refresh_user_embedding
+from services.relevance_service import relevance_cache
+from services.artifacts import get_artifacts, start_artifact_reloader, artifact_status
+from services import startup
+startup.record("api_imports", time.perf_counter() - _IMPORTS_STARTED)
 
 
 # --- 2. CONFIGURATION & INITIALIZATIONS ---
@@ -54,57 +58,25 @@ limiter = Limiter(
 app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY", "a-default-fallback-secret-key")
 jwt = JWTManager(app)
 
-# --- 3. LOAD MACHINE LEARNING ARTIFACTS AT STARTUP ---
-# This is crucial for performance, preventing file I/O on every request.
-FAISS_INDEX_PATH = os.path.join('data', 'job_index.faiss')
-JOB_ID_MAP_PATH = os.path.join('data', 'job_id_map.npy')
-faiss_index = None
-job_id_map = None
-
-TFIDF_VECTORIZER_PATH = os.path.join('data', 'tfidf_vectorizer.joblib')
-TFIDF_MATRIX_PATH = os.path.join('data', 'tfidf_matrix.joblib')
-TFIDF_JOB_ID_MAP_PATH = os.path.join('data', 'tfidf_job_id_map.joblib')
-tfidf_vectorizer = None
-tfidf_matrix = None
-
-
-try:
-    print("Loading FAISS index...")
-    faiss_index = faiss.read_index(FAISS_INDEX_PATH)
-    print(f"FAISS index loaded. Contains {faiss_index.ntotal} vectors.")
-    
-    print("Loading job ID map...")
-    job_id_map = np.load(JOB_ID_MAP_PATH)
-    print("Job ID map loaded successfully.")
-        
-    # Create a reverse map for quick lookups: DB Job ID -> FAISS Index Position
-    job_id_to_faiss_idx = {job_id: i for i, job_id in enumerate(job_id_map)}
-
-    print("Job ID map loaded and reverse map created.")
-    print("Loading TF-IDF artifacts for relevance sort...")
-    tfidf_vectorizer = joblib.load(TFIDF_VECTORIZER_PATH)
-    tfidf_matrix = joblib.load(TFIDF_MATRIX_PATH)
-    tfidf_job_ids = joblib.load(TFIDF_JOB_ID_MAP_PATH)
-    print("TF-IDF artifacts loaded successfully.")
-
-except FileNotFoundError:
-    print("CRITICAL WARNING: FAISS index or job ID map or TF-IDF artifacts not found. Recommendation endpoint will be disabled.")
-except Exception as e:
-    print(f"An error occurred while loading recommendation artifacts: {e}")
+# --- 3. LOAD MACHINE LEARNING ARTIFACTS IN THE BACKGROUND ---
+# The FAISS index, its job ID map and the TF-IDF relevance engine come from one
+# published artifact bundle (services/artifacts.py). Its arrays are memory-mapped,
+# so every worker process shares the same pages. Newly published versions are
+# picked up in the background, so deploying new jobs doesn't need a restart.
+# The bundle and the embedding model load lazily on first use; the warm-up
+# thread loads them right away without holding up the process, and
+# /api/health/ready reports when it is done.
+start_artifact_reloader()
+if startup.WARMUP_ON_START:
+    startup.warm_up(background=True)
 
 # --- 4. HELPER FUNCTIONS ---
+# Database connections come from the shared pool in services/db.py.
 
-def get_db_connection():
-    """Establishes a reusable connection to the PostgreSQL database."""
-    try:
-        return psycopg2.connect(
-            host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
-            dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-    except psycopg2.OperationalError as e:
-        print(f"Database connection error: {e}")
-        return None
+# Saving a profile doesn't wait for the model: one background thread
+# re-embeds the user afterwards (a recommendation request that comes first
+# embeds the new profile itself).
+_embedding_refresher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-embedding-refresh")
 
 
 # === PUBLIC ROUTES ===
@@ -131,7 +103,7 @@ def get_latest_jobs():
         print(f"Database error in get_latest_jobs: {e}")
         return jsonify({"error": "Could not retrieve jobs"}), 500
     finally:
-        conn.close()
+        release_db_connection(conn)
     return jsonify(jobs)
 
 # === AUTHENTICATION ROUTES ===
@@ -146,7 +118,7 @@ def check_email():
         with conn.cursor() as cur:
             cur.execute("SELECT id FROM users WHERE email = %s", (email,))
             return jsonify({"exists": cur.fetchone() is not None})
-    finally: conn.close()
+    finally: release_db_connection(conn)
 
 @app.route('/api/auth/register', methods=['POST'])
 def register():
@@ -178,7 +150,7 @@ def register():
         print(f"Register error: {e}")
         return jsonify({"error": "Registration failed"}), 500
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 @app.route('/api/auth/send-verification', methods=['POST'])
 @jwt_required()
@@ -220,22 +192,20 @@ def send_verification():
                     attempts = 0;
             """, (current_user_id, code, expires_at))
             
-            # 5. Send the email via our service
-            email_sent = send_verification_email(user_email, code)
-            
-            if email_sent:
-                conn.commit()
-                return jsonify({"message": "Verification code sent successfully"}), 200
-            else:
-                conn.rollback()
-                return jsonify({"error": "Failed to send verification email"}), 500
+        conn.commit()
+
+        # 5. Queue the email; the dispatcher sends it in the background and the
+        # request no longer waits on the provider. The code is already saved, so
+        # a failed delivery only means the user asks for a new one.
+        queue_verification_email(user_email, code)
+        return jsonify({"message": "Verification code sent successfully"}), 200
 
     except Exception as e:
         if conn: conn.rollback()
         print(f"Send verification error: {e}")
         return jsonify({"error": "An internal error occurred"}), 500
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 @app.route('/api/auth/verify-code', methods=['POST'])
 @jwt_required()
 def verify_code():
@@ -285,7 +255,7 @@ def verify_code():
         print(f"Verify code error: {e}")
         return jsonify({"error": "An internal error occurred"}), 500
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -333,7 +303,7 @@ def login():
         print(f"Login error: {e}")
         return jsonify({"error": "An internal error occurred"}), 500
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 @app.route('/api/profile', methods=['GET'])
 @jwt_required()
@@ -393,7 +363,7 @@ def get_profile():
         print(f"Get profile error: {e}")
         return jsonify({"error": "Could not retrieve profile"}), 500
     finally:
-        conn.close()
+        release_db_connection(conn)
         
     return jsonify(profile_data)            
 
@@ -472,13 +442,19 @@ def update_profile():
                     print(f"Warning: Could not find or create ID for skill '{skill_name}'")
             
             conn.commit()
-            return jsonify({"message": "Profile updated successfully"}), 200
+
+        # Cached recommendations are stale now; refresh the stored embedding in
+        # the background so the next recommendation request can skip the model.
+        invalidate_user_recommendations(current_user_id)
+        relevance_cache.invalidate_owner(int(current_user_id))
+        _embedding_refresher.submit(refresh_user_embedding, int(current_user_id))
+        return jsonify({"message": "Profile updated successfully"}), 200
     except Exception as e:
         conn.rollback()
         print(f"Update profile error: {e}")
         return jsonify({"error": "Failed to update profile"}), 500
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 
 @app.route('/api/categories', methods=['GET'])
@@ -495,7 +471,7 @@ def get_categories():
         print(f"Get categories error: {e}")
         return jsonify({"error": "Could not retrieve categories"}), 500
     finally:
-        conn.close()
+        release_db_connection(conn)
 
 @app.route('/api/recommendations', methods=['GET'])
 @jwt_required()
@@ -557,38 +533,44 @@ def get_jobs():
         count_query += where_sql
 
     # --- 3. Handle Sorting ---
-    if sort_by == 'relevance' and current_user_id and tfidf_vectorizer:
-        # ... (Relevance sort logic is unchanged) ...
-        conn = get_db_connection()
-        try:
-            with conn.cursor() as cur:
+    ranking = None
+    # Only a relevance sort needs the bundle; other listings never load it.
+    bundle = get_artifacts() if sort_by == 'relevance' and current_user_id else None
+    relevance_engine = bundle.relevance_engine if bundle is not None else None
+    if relevance_engine:
+        # The full ranking of this user's filtered job set is cached, so paging
+        # through it costs one lookup plus the detail query for the page.
+        cache_key = (search_query, province, category_id, bundle.version)
+        ranking = relevance_cache.get(int(current_user_id), cache_key)
+        if ranking is None:
+            conn = None
+            try:
                 from services.recommendation_service import _build_user_text
+                # Loads the profile on its own pooled connection, so take ours afterwards.
                 user_text = _build_user_text(current_user_id)
-                if user_text:
-                    cur.execute(base_query.replace("SELECT jp.id, ...", "SELECT jp.id"), params)
-                    filtered_job_ids = {row[0] for row in cur.fetchall()}
-                    matrix_indices = [i for i, job_id in enumerate(tfidf_job_ids) if job_id in filtered_job_ids]
-                    if matrix_indices:
-                        user_vector = tfidf_vectorizer.transform([user_text])
-                        similarities = cosine_similarity(user_vector, tfidf_matrix[matrix_indices])[0]
-                        ranked_job_ids = [tfidf_job_ids[matrix_indices[i]] for i in np.argsort(similarities)[::-1]]
-                        
-                        # Apply pagination with the new page size
-                        offset = (page - 1) * JOBS_PER_PAGE
-                        paginated_ids = ranked_job_ids[offset : offset + JOBS_PER_PAGE]
-                        
-                        base_query = base_query.replace(" WHERE " + " AND ".join(where_clauses), "")
-                        base_query += " WHERE jp.id = ANY(%(paginated_ids)s) ORDER BY array_position(%(paginated_ids)s, jp.id)"
-                        params = {'paginated_ids': paginated_ids}
-                        count_query = "SELECT COUNT(id) FROM job_postings WHERE id = ANY(%(ranked_job_ids)s)"
-                        count_params = {'ranked_job_ids': ranked_job_ids}
-        except Exception as e:
-            print(f"Relevance sort failed: {e}")
-            sort_by = 'newest'
-        finally:
-            if conn: conn.close()
-    
-    if sort_by != 'relevance':
+                conn = get_db_connection() if user_text else None
+                if conn:
+                    id_query = "SELECT jp.id FROM job_postings jp JOIN companies c ON jp.company_id = c.id" + where_sql
+                    with conn.cursor() as cur:
+                        cur.execute(id_query, params)
+                        filtered_job_ids = [row[0] for row in cur.fetchall()]
+                    ranking = relevance_engine.rank(user_text, filtered_job_ids)
+                    if ranking is not None:
+                        relevance_cache.set(int(current_user_id), cache_key, ranking)
+            except Exception as e:
+                print(f"Relevance sort failed: {e}")
+                ranking = None
+            finally:
+                if conn: release_db_connection(conn)
+
+    if ranking is not None:
+        paginated_ids = ranking.page((page - 1) * JOBS_PER_PAGE, JOBS_PER_PAGE)
+        base_query = base_query.replace(where_sql, "")
+        base_query += " WHERE jp.id = ANY(%(paginated_ids)s) ORDER BY array_position(%(paginated_ids)s, jp.id)"
+        params = {'paginated_ids': paginated_ids}
+        count_query = None
+    else:
+        # No profile text, no TF-IDF rows or a failed ranking: fall back to newest first.
         order_by_sql = {
             'newest': " ORDER BY jp.scraped_at DESC",
             'pay': " ORDER BY jp.salary::bigint DESC NULLS LAST"
@@ -605,8 +587,11 @@ def get_jobs():
     conn = get_db_connection()
     try:
         with conn.cursor() as cur:
-            cur.execute(count_query, count_params)
-            total_count = cur.fetchone()[0]
+            if count_query is None:
+                total_count = ranking.total
+            else:
+                cur.execute(count_query, count_params)
+                total_count = cur.fetchone()[0]
             
             cur.execute(base_query, params)
             columns = [desc[0] for desc in cur.description]
@@ -623,7 +608,7 @@ def get_jobs():
         print(f"Get jobs error: {e}")
         return jsonify({"error": "Failed to retrieve jobs"}), 500
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 @app.route('/api/interactions/click', methods=['POST'])
 @jwt_required() # This endpoint is protected; only logged-in users can log clicks.
@@ -658,10 +643,61 @@ def log_job_click():
         return jsonify({"status": "error"}), 200 
 
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
     
     return jsonify({"status": "logged"}), 200
 
+# === HEALTH ROUTES ===
+@app.route('/api/health/live', methods=['GET'])
+def liveness():
+    """The process is up and serving requests. Never touches models or the database."""
+    return jsonify({"status": "alive"}), 200
+
+@app.route('/api/health/ready', methods=['GET'])
+def readiness():
+    """
+    Ready once the warm-up has loaded the artifacts and the embedding model and
+    the database is reachable. Includes the startup timing report.
+    """
+    report = startup.startup_report()
+    # Only look at the bundle once it is loaded; the check itself must stay cheap.
+    bundle = get_artifacts() if startup.is_warm() else None
+    checks = {
+        # With WARMUP_ON_START off, models load on the first request that needs them.
+        "warm_up": not startup.WARMUP_ON_START or (startup.is_warm() and not report["warm_up_errors"]),
+        "database": check_db_health(),
+        "vector_index": bundle is not None and bundle.vector_search_engine is not None,
+        "relevance_engine": bundle is not None and bundle.relevance_engine is not None,
+    }
+    # Without artifacts the API still serves (recommendations are empty and the
+    # relevance sort falls back to newest first), so only the first two gate readiness.
+    ready = checks["warm_up"] and checks["database"]
+    return jsonify({"ready": ready, "checks": checks, "startup": report}), 200 if ready else 503
+
+@app.route('/api/health/db', methods=['GET'])
+def database_health():
+    """Reports database reachability and connection pool metrics."""
+    healthy = check_db_health()
+    return jsonify({"healthy": healthy, "pool": get_pool_stats()}), 200 if healthy else 503
+
+@app.route('/api/health/cache', methods=['GET'])
+def cache_health():
+    """Reports hit/miss/eviction counters of the recommendation and relevance caches."""
+    return jsonify({
+        "recommendations": recommendation_cache.stats(),
+        "relevance": relevance_cache.stats(),
+    })
+
+@app.route('/api/health/artifacts', methods=['GET'])
+def artifacts_health():
+    """Reports which artifact bundle version this worker is serving."""
+    return jsonify(artifact_status())
+
+@app.route('/api/health/email', methods=['GET'])
+def email_health():
+    """Reports email queue depth and sent/failed/retry counters."""
+    return jsonify(get_email_dispatcher().stats())
+
 # --- 6. MAIN EXECUTION BLOCK ---
 if __name__ == '__main__':
     # The debug=True setting enables auto-reloading when you save the file.
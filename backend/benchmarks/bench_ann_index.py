@@ -0,0 +1,82 @@
+# benchmarks/bench_ann_index.py
+"""
+Recall and query latency of the approximate job indexes (services/ann_index.py)
+against the exact flat index, on synthetic corpora of increasing size.
+
+The synthetic vectors are L2-normalized points around random cluster
+centres (jobs with the same title and category land close together), which
+is closer to real embeddings than uniform noise. Queries are perturbed
+corpus points. Every search goes through VectorSearchEngine exactly as the
+recommendation path does, unfiltered and with a random filter allowing
+--filter-fraction of the jobs; recall@k is measured against the exact
+results of the same filter.
+
+Run from the backend directory:
+    python -m benchmarks.bench_ann_index --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+import faiss
+import numpy as np
+
+from services.ann_index import build_ann_index
+from services.vector_search import VectorSearchEngine
+
+
+def _corpus(n: int, d: int, rng) -> np.ndarray:
+    centres = rng.standard_normal((max(1, n // 50), d)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), n)] + 0.35 * rng.standard_normal((n, d)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _run(engine, queries, k, masks):
+    results, timings = [], []
+    for query, mask in zip(queries, masks):
+        started = time.perf_counter()
+        rows, _ = engine.search(query, k, mask=mask)
+        timings.append((time.perf_counter() - started) * 1e3)
+        results.append(rows)
+    return results, np.percentile(timings, 50), np.percentile(timings, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark approximate vs exact job vector search.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--types", nargs="+", default=["hnsw", "ivf"])
+    parser.add_argument("--filter-fraction", type=float, default=0.3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'jobs':>9} {'index':>6} {'filter':>8} {'build s':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for n in args.sizes:
+        vectors = _corpus(n, args.dim, rng)
+        flat = faiss.IndexFlatIP(args.dim)
+        flat.add(vectors)
+        job_ids = np.arange(n, dtype=np.int64)
+        queries = vectors[rng.integers(0, n, args.queries)] + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+        filters = {"none": [None] * args.queries,
+                   f"{args.filter_fraction:.0%}": [rng.random(n) < args.filter_fraction for _ in range(args.queries)]}
+
+        exact_engine = VectorSearchEngine(flat, job_ids)
+        engines = {"flat": (exact_engine, 0.0)}
+        for index_type in args.types:
+            ann_index, meta = build_ann_index(flat, index_type)
+            engines[index_type] = (VectorSearchEngine(flat, job_ids, ann_index=ann_index), meta["build_seconds"])
+
+        for label, masks in filters.items():
+            masks = [np.ones(n, dtype=bool) if m is None else m for m in masks]
+            exact, _, _ = _run(exact_engine, queries, args.k, masks)
+            for index_type, (engine, build_seconds) in engines.items():
+                results, p50, p99 = _run(engine, queries, args.k, masks)
+                recall = np.mean([np.intersect1d(r, e).size / max(1, e.size) for r, e in zip(results, exact)])
+                print(f"{n:>9} {index_type:>6} {label:>8} {build_seconds:>8.1f} {recall:>9.3f} {p50:>8.2f} {p99:>8.2f}")
+        del vectors, flat, engines
+
+
+if __name__ == "__main__":
+    main()
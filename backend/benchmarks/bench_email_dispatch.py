@@ -0,0 +1,67 @@
+# benchmarks/bench_email_dispatch.py
+"""
+Throughput of sending job alert emails: one blocking provider call per
+recipient (the old send_recommendations_email path) versus the queued
+EmailDispatcher, which coalesces recipients into message-version batches and
+sends them from several worker threads. The provider is a StubTransport with
+a simulated per-call latency, so no email leaves the machine.
+
+Run from the backend directory:
+    python -m benchmarks.bench_email_dispatch
+"""
+import argparse
+import time
+
+from services.email_service import EmailDispatcher, StubTransport, recommendations_message
+
+SAMPLE_JOBS = [
+    {"title": f"Job {i}", "company_name": "Karbin", "city": "Tehran", "source_link": "https://example.com",
+     "reason": {"matched_skills": ["Python", "SQL"]}}
+    for i in range(7)
+]
+
+
+def run_sequential(messages, latency: float) -> tuple[float, int]:
+    transport = StubTransport(latency_seconds=latency)
+    started = time.perf_counter()
+    for message in messages:
+        transport.send([message])
+    return time.perf_counter() - started, transport.calls
+
+
+def run_dispatcher(messages, latency: float, workers: int, batch_size: int, failure_rate: float) -> tuple[float, dict]:
+    transport = StubTransport(latency_seconds=latency, failure_rate=failure_rate)
+    dispatcher = EmailDispatcher(transport=transport, workers=workers, batch_size=batch_size,
+                                 batch_wait=0.05, retry_backoff=0.01)
+    started = time.perf_counter()
+    futures = [dispatcher.enqueue(message) for message in messages]
+    delivered = sum(future.result() for future in futures)
+    elapsed = time.perf_counter() - started
+    stats = dispatcher.stats()
+    assert delivered == stats["sent"], "futures and dispatcher counters disagree"
+    return elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sequential email sends vs the dispatch queue.")
+    parser.add_argument("--emails", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per provider call.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--failure-rate", type=float, default=0.02, help="Share of provider calls that fail transiently.")
+    args = parser.parse_args()
+
+    messages = [recommendations_message(f"user{i}@example.com", f"User {i}", SAMPLE_JOBS) for i in range(args.emails)]
+
+    seq_seconds, seq_calls = run_sequential(messages, args.latency)
+    disp_seconds, stats = run_dispatcher(messages, args.latency, args.workers, args.batch_size, args.failure_rate)
+
+    print(f"{'mode':>12} {'seconds':>9} {'emails/s':>9} {'calls':>7} {'retries':>8} {'failed':>7}")
+    print(f"{'sequential':>12} {seq_seconds:>9.2f} {args.emails / seq_seconds:>9.1f} {seq_calls:>7} {0:>8} {0:>7}")
+    print(f"{'dispatcher':>12} {disp_seconds:>9.2f} {args.emails / disp_seconds:>9.1f} "
+          f"{stats['provider_calls']:>7} {stats['retries']:>8} {stats['failed']:>7}")
+    print(f"speedup: {seq_seconds / disp_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# benchmarks/bench_embedding_pool.py
+"""
+Offline embedding throughput against the number of worker processes
+(services/embedding_pool.py, embed_jobs.py --workers): a single-process
+`embed_texts` baseline, then a pool of each requested size over the same
+texts. Pool start-up (spawning the workers and loading one model each) is
+reported separately from the encoding time, and every pool's output is
+checked against the baseline so a speedup never hides misaligned rows.
+
+Run from the backend directory:
+    python -m benchmarks.bench_embedding_pool --workers 1 2 4 8 16
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from services.embedding_pool import EMBED_POOL_CHUNK_SIZE, EmbeddingPool
+from services.embedding_service import embed_texts, get_model
+from services.onnx_backend import CHECK_TEXTS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark multi-process embedding.")
+    parser.add_argument("--texts", type=int, default=8192, help="Texts to embed per run.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--threads-per-worker", type=int, default=0, help="0 = cores / workers.")
+    parser.add_argument("--chunk-size", type=int, default=EMBED_POOL_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    texts = [f"{CHECK_TEXTS[i % len(CHECK_TEXTS)]} {i}" for i in range(args.texts)]
+    print(f"{args.texts} texts, {os.cpu_count()} cores")
+
+    get_model()
+    embed_texts(texts[:8])
+    started = time.perf_counter()
+    baseline = embed_texts(texts)
+    baseline_seconds = time.perf_counter() - started
+
+    print(f"{'workers':>8} {'threads':>8} {'startup s':>10} {'encode s':>9} {'texts/s':>9} {'speedup':>8} {'max diff':>9}")
+    print(f"{'single':>8} {os.cpu_count():>8} {'':>10} {baseline_seconds:>9.2f} "
+          f"{args.texts / baseline_seconds:>9.1f} {1.0:>7.2f}x {0.0:>9.1e}")
+    for workers in args.workers:
+        started = time.perf_counter()
+        with EmbeddingPool(workers, args.threads_per_worker, args.chunk_size) as pool:
+            pool.warm_up()
+            startup_seconds = time.perf_counter() - started
+            started = time.perf_counter()
+            vectors = pool.embed(texts)
+            seconds = time.perf_counter() - started
+            threads = pool.threads_per_worker
+        max_diff = float(np.abs(vectors - baseline).max())
+        print(f"{workers:>8} {threads:>8} {startup_seconds:>10.2f} {seconds:>9.2f} "
+              f"{args.texts / seconds:>9.1f} {baseline_seconds / seconds:>7.2f}x {max_diff:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_embedding_server.py
+"""
+Embedding throughput and latency under concurrent single-text requests
+(what the API sees when many users open their recommendations at once):
+every request calling `encode` on a batch of one, versus the same requests
+sent to the shared embedding server, which coalesces them into micro-batches.
+
+The server runs in this process on a temporary Unix socket; the clients
+talk to it over the socket exactly as API workers would.
+
+Run from the backend directory:
+    python -m benchmarks.bench_embedding_server
+"""
+import argparse
+import os
+import resource
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from services.embedding_server import EmbeddingClient, make_server
+from services.embedding_service import EMBEDDING_MODEL_VERSION, get_model, normalize_persian_text
+from services.onnx_backend import CHECK_TEXTS
+
+
+def _run(concurrency: int, requests_per_client: int, embed_one) -> tuple[float, np.ndarray]:
+    latencies = [[] for _ in range(concurrency)]
+
+    def client(i):
+        for j in range(requests_per_client):
+            text = normalize_persian_text(CHECK_TEXTS[(i + j) % len(CHECK_TEXTS)])
+            started = time.perf_counter()
+            embed_one(text)
+            latencies[i].append((time.perf_counter() - started) * 1e3)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return concurrency * requests_per_client / elapsed, np.concatenate(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the shared embedding server.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client thread.")
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    model = get_model()
+    rss_model = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024
+    print(f"Model memory per process that loads it: ~{rss_model:.0f} MB (saved in every API worker using the server)")
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "embeddings.sock")
+    server = make_server(f"unix:{socket_path}", lambda texts: model.encode(texts, convert_to_numpy=True),
+                         EMBEDDING_MODEL_VERSION, max_wait_ms=args.max_wait_ms)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = EmbeddingClient(f"unix:{socket_path}", EMBEDDING_MODEL_VERSION)
+    model.encode(["warm-up"]); client.embed(["warm-up"])
+
+    print(f"{'clients':>8} {'mode':>10} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for concurrency in args.concurrency:
+        for mode, embed_one in (("in-process", lambda t: model.encode([t], convert_to_numpy=True)),
+                                ("server", lambda t: client.embed([t]))):
+            rate, latencies = _run(concurrency, args.requests, embed_one)
+            print(f"{concurrency:>8} {mode:>10} {rate:>8.1f} "
+                  f"{np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 99):>8.1f}")
+    stats = server.batcher.stats()
+    print(f"\nServer: {stats['requests']} requests in {stats['batches']} micro-batches "
+          f"(avg {stats['avg_batch_texts']:.1f} texts per batch)")
+    server.shutdown()
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# benchmarks/bench_inference_backends.py
+"""
+CPU latency and throughput of the two transformer models on PyTorch versus
+the int8-quantized ONNX Runtime export (services/onnx_backend.py): single
+request latency (p50/p99 of a batch of one, as on the web path) and bulk
+throughput (texts or pairs per second, as in embed_jobs and bulk alerts).
+
+Export the models first, then run from the backend directory:
+    python -m services.onnx_backend export
+    python -m benchmarks.bench_inference_backends
+"""
+import argparse
+import time
+
+import numpy as np
+from sentence_transformers import CrossEncoder, SentenceTransformer
+
+from services.onnx_backend import CHECK_TEXTS, load_cross_encoder, load_sentence_encoder
+from services.embedding_service import EMBEDDING_MODEL_NAME
+from services.reranker import CROSS_ENCODER_MODEL_NAME
+
+
+def _latency(fn, repeats: int) -> tuple[float, float]:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1e3)
+    return float(np.percentile(timings, 50)), float(np.percentile(timings, 99))
+
+
+def _throughput(fn, n: int) -> float:
+    started = time.perf_counter()
+    fn()
+    return n / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PyTorch vs ONNX int8 inference.")
+    parser.add_argument("--repeats", type=int, default=50, help="Single-request runs per backend.")
+    parser.add_argument("--bulk", type=int, default=512, help="Texts (or pairs) in the throughput run.")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args()
+
+    texts = [CHECK_TEXTS[i % len(CHECK_TEXTS)] + f" {i}" for i in range(args.bulk)]
+    pairs = [(texts[i], texts[(i * 7 + 3) % len(texts)]) for i in range(args.bulk)]
+
+    encoders = {"torch": SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu'),
+                "onnx-int8": load_sentence_encoder(EMBEDDING_MODEL_NAME)}
+    rerankers = {"torch": CrossEncoder(CROSS_ENCODER_MODEL_NAME, device='cpu'),
+                 "onnx-int8": load_cross_encoder(CROSS_ENCODER_MODEL_NAME)}
+
+    print(f"{'model':>14} {'backend':>10} {'p50 ms':>8} {'p99 ms':>8} {'items/s':>9}")
+    for label, models, single, bulk in (
+        ("embedding", encoders,
+         lambda m: m.encode([texts[0]], show_progress_bar=False),
+         lambda m: m.encode(texts, batch_size=args.batch_size, show_progress_bar=False)),
+        ("cross-encoder", rerankers,
+         lambda m: m.predict([pairs[0]], show_progress_bar=False),
+         lambda m: m.predict(pairs, batch_size=args.batch_size, show_progress_bar=False)),
+    ):
+        rates = {}
+        for backend, model in models.items():
+            single(model)  # warm-up
+            p50, p99 = _latency(lambda: single(model), args.repeats)
+            rates[backend] = _throughput(lambda: bulk(model), args.bulk)
+            print(f"{label:>14} {backend:>10} {p50:>8.2f} {p99:>8.2f} {rates[backend]:>9.1f}")
+        print(f"{'':>14} {'speedup':>10} {rates['onnx-int8'] / rates['torch']:>27.2f}x")
+
+
+if __name__ == "__main__":
+    main()
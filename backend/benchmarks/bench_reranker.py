@@ -0,0 +1,74 @@
+# benchmarks/bench_reranker.py
+"""
+Cross-encoder throughput (pairs/sec on CPU) for the re-ranking stage:
+full-length pairs in arrival order (the old predict call), pairs cut to the
+per-side token budget, and cut pairs bucketed by length, as done by
+services.reranker.score_texts. Job texts are synthetic, with lengths spread
+like scraped descriptions (a few lines to several paragraphs).
+
+Run from the backend directory:
+    python -m benchmarks.bench_reranker
+"""
+import argparse
+import time
+
+import numpy as np
+
+from services import reranker
+
+WORDS = ("python django react developer senior backend frontend data analyst tehran remote "
+         "experience team project api database cloud docker design marketing sales support "
+         "برنامه نویس توسعه دهنده تحلیلگر داده پشتیبانی فروش بازاریابی طراح ارشد کارشناس").split()
+
+
+def _synthetic_pairs(n_users: int, jobs_per_user: int, rng) -> list[tuple[str, str]]:
+    def text(n_words):
+        return " ".join(rng.choice(WORDS, n_words))
+    users = [text(int(rng.integers(20, 120))) for _ in range(n_users)]
+    jobs = [text(int(rng.lognormal(5.0, 0.8))) for _ in range(n_users * jobs_per_user)]
+    return [(users[i // jobs_per_user], job) for i, job in enumerate(jobs)]
+
+
+def _time(fn, pairs) -> tuple[float, np.ndarray]:
+    started = time.perf_counter()
+    scores = np.asarray(fn(pairs), dtype=np.float32).reshape(-1)
+    return len(pairs) / (time.perf_counter() - started), scores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cross-encoder re-ranking throughput.")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--jobs-per-user", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=reranker.CROSS_ENCODER_BATCH_SIZE)
+    args = parser.parse_args()
+
+    if not reranker.is_available():
+        raise SystemExit("Cross-Encoder model is not available.")
+    model = reranker.get_cross_encoder()
+    pairs = _synthetic_pairs(args.users, args.jobs_per_user, np.random.default_rng(7))
+
+    def full(p):
+        return model.predict(p, batch_size=args.batch_size, show_progress_bar=False)
+
+    def truncated(p):
+        queries, _ = reranker.truncate_texts([q for q, _ in p], reranker.RERANKER_MAX_QUERY_TOKENS)
+        docs, _ = reranker.truncate_texts([d for _, d in p], reranker.RERANKER_MAX_JOB_TOKENS)
+        return model.predict(list(zip(queries, docs)), batch_size=args.batch_size, show_progress_bar=False)
+
+    def bucketed(p):
+        return reranker.score_texts(p, batch_size=args.batch_size)
+
+    full(pairs[:args.batch_size])  # warm-up
+    print(f"{len(pairs)} pairs, budget q={reranker.RERANKER_MAX_QUERY_TOKENS} "
+          f"d={reranker.RERANKER_MAX_JOB_TOKENS} tokens, batch size {args.batch_size}")
+    print(f"{'mode':>22} {'pairs/s':>9} {'speedup':>8} {'spearman vs full':>17}")
+    base_rate, base_scores = _time(full, pairs)
+    for name, fn in (("full length", full), ("truncated", truncated), ("truncated + bucketed", bucketed)):
+        rate, scores = (base_rate, base_scores) if fn is full else _time(fn, pairs)
+        rank_a, rank_b = np.argsort(np.argsort(base_scores)), np.argsort(np.argsort(scores))
+        spearman = np.corrcoef(rank_a, rank_b)[0, 1]
+        print(f"{name:>22} {rate:>9.1f} {rate / base_rate:>7.2f}x {spearman:>17.4f}")
+
+
+if __name__ == "__main__":
+    main()
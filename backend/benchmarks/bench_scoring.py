@@ -0,0 +1,106 @@
+# benchmarks/bench_scoring.py
+"""
+Per-candidate cost of the weighted scoring stage: the old Python loop
+(dict + set intersection + datetime.now() per candidate) versus the NumPy
+column scoring in services.scoring, including the sparse skill-overlap
+mat-vec from services.job_skill_matrix.
+
+Run from the backend directory:
+    python -m benchmarks.bench_scoring
+"""
+import argparse
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from services.job_skill_matrix import JobSkillMatrix
+from services.scoring import score_and_select
+
+
+def legacy_scoring(user_skill_ids: set, candidates: list[dict], job_data_map: dict, top_k: int) -> list[dict]:
+    """The loop formerly in _calculate_scores_for_candidates, plus its final sort."""
+    enriched_candidates = []
+    for candidate in candidates:
+        job_info = job_data_map.get(candidate['job_id'])
+        if not job_info: continue
+        matched_skills = user_skill_ids.intersection(job_info['skills'])
+        required_skills_count = len(job_info['skills'])
+        skill_overlap_score = len(matched_skills) / required_skills_count if required_skills_count > 0 else 0
+        days_since_posted = (datetime.now(timezone.utc) - job_info['scraped_at']).days
+        recency_score = max(0, 1 - (days_since_posted / 45.0))
+        candidate['final_score'] = (0.6 * candidate['semantic_score']) + (0.3 * skill_overlap_score) + (0.1 * recency_score)
+        candidate['reasoning'] = {
+            "matched_skills_count": len(matched_skills),
+            "skill_score": skill_overlap_score,
+            "recency_score": recency_score
+        }
+        enriched_candidates.append(candidate)
+    return sorted(enriched_candidates, key=lambda x: x.get('final_score', 0), reverse=True)[:top_k]
+
+
+def _synthetic_corpus(n_jobs: int, n_skills: int, rng) -> tuple[JobSkillMatrix, np.ndarray]:
+    skills_per_job = rng.integers(1, 12, size=n_jobs)
+    indptr = np.concatenate([[0], np.cumsum(skills_per_job)])
+    indices = np.concatenate([np.sort(rng.choice(n_skills, k, replace=False)) for k in skills_per_job])
+    matrix = JobSkillMatrix(np.arange(n_jobs), np.arange(n_skills), indptr, indices)
+    now = datetime.now(timezone.utc).timestamp()
+    scraped_at = now - rng.uniform(0, 45 * 86400, size=n_jobs)
+    return matrix, scraped_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark weighted candidate scoring.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 50_000])
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--skills", type=int, default=2_000, help="Size of the skill vocabulary.")
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    n_jobs = max(args.sizes)
+    matrix, scraped_at = _synthetic_corpus(n_jobs, args.skills, rng)
+    user_skill_ids = rng.choice(args.skills, 15, replace=False).tolist()
+
+    print(f"{'candidates':>10} {'legacy us/cand':>15} {'vector us/cand':>15} {'speedup':>8}")
+    for n in args.sizes:
+        rows = rng.choice(n_jobs, n, replace=False)
+        semantic = rng.uniform(0, 1, size=n)
+
+        # The legacy loop consumed a dict built from the job_skill query rows.
+        job_data_map = {}
+        for row in rows:
+            lo, hi = matrix.matrix.indptr[row], matrix.matrix.indptr[row + 1]
+            job_data_map[int(row)] = {
+                'skills': set(matrix.matrix.indices[lo:hi].tolist()),
+                'scraped_at': datetime.fromtimestamp(scraped_at[row], tz=timezone.utc),
+            }
+
+        def run_legacy():
+            candidates = [{"job_id": int(r), "semantic_score": float(s)} for r, s in zip(rows, semantic)]
+            return legacy_scoring(set(user_skill_ids), candidates, job_data_map, args.top_k)
+
+        def run_vectorized():
+            return score_and_select(
+                job_ids=rows, semantic=semantic,
+                matched_counts=matrix.overlap_counts(user_skill_ids, rows),
+                required_counts=matrix.skill_counts[rows],
+                scraped_at=scraped_at[rows], top_k=args.top_k,
+            )
+
+        legacy_top = [c['job_id'] for c in run_legacy()]
+        vector_top = [c['job_id'] for c in run_vectorized()]
+        assert legacy_top == vector_top, "vectorized scoring disagrees with the legacy loop"
+
+        repeats = max(1, args.repeats if n <= 5_000 else args.repeats // 10)
+        timings = []
+        for fn in (run_legacy, run_vectorized):
+            started = time.perf_counter()
+            for _ in range(repeats):
+                fn()
+            timings.append((time.perf_counter() - started) / repeats / n * 1e6)
+        print(f"{n:>10} {timings[0]:>15.3f} {timings[1]:>15.3f} {timings[0] / timings[1]:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# benchmarks/bench_startup.py
+"""
+Cold-start cost of the API process: how long `import api` takes (the time
+before the process can serve /api/health/live and non-ML endpoints), and
+how long the background warm-up takes until /api/health/ready passes.
+Each measurement runs in a fresh interpreter so nothing is cached in-process.
+
+Run from the backend directory:
+    python -m benchmarks.bench_startup
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+_PROBE = """
+import json, time
+started = time.perf_counter()
+import api
+from services import startup
+imported = time.perf_counter() - started
+startup.warm_up()  # no-op if WARMUP_ON_START already started it
+startup._warmup["done"].wait()
+print(json.dumps({"import_seconds": imported, "ready_seconds": time.perf_counter() - started,
+                  "report": startup.startup_report()}))
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API import and warm-up time.")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'run':>4} {'import s':>9} {'ready s':>8}  load timings")
+    for run in range(1, args.runs + 1):
+        output = subprocess.run([sys.executable, "-c", _PROBE], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        timings = ", ".join(f"{k}={v:.2f}" for k, v in result["report"]["timings_seconds"].items())
+        print(f"{run:>4} {result['import_seconds']:>9.2f} {result['ready_seconds']:>8.2f}  {timings}")
+
+
+if __name__ == "__main__":
+    main()
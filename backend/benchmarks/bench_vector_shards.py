@@ -0,0 +1,85 @@
+# benchmarks/bench_vector_shards.py
+"""
+Filtered vector search with and without per-category shards
+(services/vector_shards.py, embed_jobs.py --shards category).
+
+A synthetic corpus gets Zipf-distributed category sizes (a few large
+categories, a long tail) and some uncategorized jobs. For a sample of
+categories, every query's candidate mask is the category filter combined
+with a random --other-filter fraction (province, experience, ...). The
+same query is answered by the global index with that mask and by the
+category's shard; the table reports the category's share of the corpus,
+p50 latency of both, the speedup and whether both return the same jobs.
+
+Run from the backend directory:
+    python -m benchmarks.bench_vector_shards --size 200000 --index-type flat
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from services.ann_index import build_ann_index
+from services.vector_search import VectorSearchEngine
+from services.vector_shards import ShardedSearch, build_shards, shard_key
+
+
+def _p50(fn, queries) -> tuple[float, list]:
+    timings, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(fn(query)[0])
+        timings.append((time.perf_counter() - started) * 1e3)
+    return float(np.percentile(timings, 50)), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark category-sharded vector search.")
+    parser.add_argument("--size", type=int, default=200_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--other-filter", type=float, default=0.5,
+                        help="Fraction of jobs passing the user's non-category filters.")
+    parser.add_argument("--index-type", default="flat")
+    parser.add_argument("--storage", default="float32")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.size, args.dim)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    job_ids = np.arange(1, args.size + 1, dtype=np.int64)
+    weights = 1.0 / np.arange(1, args.categories + 1)
+    category_ids = rng.choice(np.arange(1, args.categories + 1), args.size, p=weights / weights.sum())
+    category_ids[rng.random(args.size) < 0.05] = -1
+
+    flat = faiss.IndexIDMap2(faiss.IndexFlatIP(args.dim))
+    flat.add_with_ids(vectors, job_ids)
+    ann_index, meta = build_ann_index(flat, args.index_type, args.storage)
+    compact = meta.get("storage", "float32") != "float32"
+    directory = os.path.join(tempfile.mkdtemp(), "shards")
+    _, shards_meta = build_shards(flat, job_ids, category_ids, directory, args.index_type, args.storage)
+    shards = ShardedSearch.load(directory, shards_meta, job_ids, ann_index is not None, compact)
+    engine = VectorSearchEngine(flat, job_ids, ann_index=ann_index, vectors=vectors if compact else None,
+                                rescore=compact)
+
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    print(f"{args.size} jobs, {args.categories} categories, index {args.index_type}/{args.storage}, k={args.k}")
+    print(f"{'category':>13} {'share':>7} {'global ms':>10} {'shard ms':>9} {'speedup':>8} {'same jobs':>10}")
+    for category in (1, 2, 5, 10, args.categories, -1):
+        other = rng.random(args.size) < args.other_filter
+        mask = other & (category_ids == category)
+        key = shard_key(category)
+        global_ms, global_rows = _p50(lambda q: engine.search(q, args.k, mask=mask), queries)
+        shard_ms, shard_rows = _p50(lambda q: shards.search(q, args.k, [key], mask=mask), queries)
+        same = np.mean([np.intersect1d(a, b).size / max(1, a.size) for a, b in zip(global_rows, shard_rows)])
+        print(f"{key:>13} {np.mean(category_ids == category):>7.1%} {global_ms:>10.2f} {shard_ms:>9.2f} "
+              f"{global_ms / shard_ms:>7.1f}x {same:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
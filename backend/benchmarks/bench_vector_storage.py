@@ -0,0 +1,90 @@
+# benchmarks/bench_vector_storage.py
+"""
+Memory and quality of compact vector storage (services/ann_index.py,
+embed_jobs.py --storage): the float32 flat index against float16 and int8
+scalar-quantized codes, for each index type.
+
+For every combination it reports the in-memory size of the searched index
+(what each loaded bundle version costs a process; a hot reload briefly
+holds two), recall@k and the mean absolute error of the top score from the
+coarse pass alone,
+and recall@k and latency after exact re-scoring of the RESCORE_FACTOR x k
+shortlist against the memory-mapped float32 rows, as served.
+
+Run from the backend directory:
+    python -m benchmarks.bench_vector_storage --size 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import faiss
+import numpy as np
+
+from services.ann_index import RESCORE_FACTOR, build_ann_index, search_parameters
+from services.index_io import mmap_flat_id_index
+from services.vector_search import VectorSearchEngine
+
+
+def _corpus(n: int, d: int, rng) -> np.ndarray:
+    centres = rng.standard_normal((max(1, n // 50), d)).astype(np.float32)
+    vectors = centres[rng.integers(0, len(centres), n)] + 0.35 * rng.standard_normal((n, d)).astype(np.float32)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _recall(results, exact) -> float:
+    return float(np.mean([np.intersect1d(r, e).size / max(1, e.size) for r, e in zip(results, exact)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark float32 vs float16 / int8 vector storage.")
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--types", nargs="+", default=["flat", "hnsw", "ivf"])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = _corpus(args.size, args.dim, rng)
+    job_ids = np.arange(args.size, dtype=np.int64)
+    flat = faiss.IndexIDMap2(faiss.IndexFlatIP(args.dim))
+    flat.add_with_ids(vectors, job_ids)
+    path = os.path.join(tempfile.mkdtemp(), "job_index.faiss")
+    faiss.write_index(flat, path)
+    mapped, _ = mmap_flat_id_index(path)
+    queries = vectors[rng.integers(0, args.size, args.queries)] + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    faiss.normalize_L2(queries)
+    exact_scores, exact = flat.index.search(queries, args.k)
+
+    print(f"{args.size} x {args.dim} vectors, k={args.k}, re-scoring {RESCORE_FACTOR}x k")
+    print(f"{'index':>6} {'storage':>8} {'MB':>8} {'coarse recall':>14} {'top1 err':>10} "
+          f"{'recall':>7} {'p50 ms':>7} {'p99 ms':>7}")
+    for index_type in args.types:
+        for storage in ("float32", "float16", "int8"):
+            built, _ = build_ann_index(flat, index_type, storage)
+            search_index = built if built is not None else flat.index
+            megabytes = faiss.serialize_index(search_index).size / 2**20
+
+            # Coarse pass alone: what the compact codes rank and score by themselves.
+            coarse_scores, coarse = search_index.search(queries, args.k, params=search_parameters(search_index, args.k))
+            error = float(np.mean(np.abs(coarse_scores[:, 0] - exact_scores[:, 0])))
+
+            compact = storage != "float32"
+            engine = VectorSearchEngine(None if compact else flat, job_ids,
+                                        ann_index=built,
+                                        vectors=mapped if compact else None, rescore=compact)
+            results, timings = [], []
+            for query in queries:
+                started = time.perf_counter()
+                rows, _ = engine.search(query, args.k)
+                timings.append((time.perf_counter() - started) * 1e3)
+                results.append(rows)
+            print(f"{index_type:>6} {storage:>8} {megabytes:>8.1f} {_recall(coarse, exact):>14.3f} {error:>10.4f} "
+                  f"{_recall(results, exact):>7.3f} {np.percentile(timings, 50):>7.2f} {np.percentile(timings, 99):>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
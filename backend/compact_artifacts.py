@@ -0,0 +1,208 @@
+# compact_artifacts.py
+"""
+Retention and compaction of the recommendation artifacts.
+
+Postings older than the retention window are deactivated in Postgres, then
+the live bundle is pruned down to the jobs that are still active and
+published as a new version:
+
+- the vectors of surviving jobs are copied out of the live flat index
+  (memory-mapped, chunk by chunk) into a new one; nothing is re-embedded,
+  and the HNSW / IVF / compact search index and the category shards are
+  updated or rebuilt from them with the live bundle's settings,
+- the attribute snapshot and skill matrix are rebuilt for the surviving rows,
+- the TF-IDF matrix keeps only the surviving rows; the fitted vocabulary is
+  reused as is until precompute_tfidf.py refits it.
+
+If embed_jobs.py or precompute_tfidf.py publishes while the bundle is being
+pruned, the result is discarded and the new version is pruned instead.
+
+Run it from the backend directory, e.g. nightly after the scrapers:
+    python compact_artifacts.py [--retention-days 45] [--dry-run]
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import joblib
+import numpy as np
+from dotenv import load_dotenv
+from scipy import sparse
+from services.db import get_db_connection, release_db_connection, close_pool
+from services.cache import TTLCache, CACHE_REDIS_URL
+from services.job_attributes import JobAttributeIndex
+from services.job_skill_matrix import JobSkillMatrix
+from services.index_io import mmap_flat_id_index, write_flat_id_index
+from services.artifacts import (BundleWriter, StaleBundleError, ARTIFACTS_DIR, MANIFEST_NAME, VECTORS, TFIDF,
+                                current_version)
+
+load_dotenv()
+
+# --- 1. CONFIGURATION ---
+# Postings scraped longer ago than this are deactivated. The recommendation
+# sieve never shows jobs older than 45 days, so a shorter window hides jobs
+# users could still be recommended.
+JOB_RETENTION_DAYS = int(os.getenv('JOB_RETENTION_DAYS', 45))
+# Rows of the vector matrix copied per step while pruning.
+_COPY_ROWS = 65536
+# How often to prune again when another build publishes first.
+_PUBLISH_ATTEMPTS = 3
+
+
+# --- 2. POSTGRES ---
+def deactivate_expired_jobs(conn, retention_days: int, dry_run: bool = False) -> int:
+    """Sets is_active = FALSE on active postings older than the window; returns how many."""
+    with conn.cursor() as cur:
+        if dry_run:
+            cur.execute("""
+                SELECT COUNT(*) FROM job_postings
+                WHERE is_active = TRUE AND scraped_at < NOW() - make_interval(days => %s)
+            """, (retention_days,))
+            return cur.fetchone()[0]
+        cur.execute("""
+            UPDATE job_postings SET is_active = FALSE
+            WHERE is_active = TRUE AND scraped_at < NOW() - make_interval(days => %s)
+        """, (retention_days,))
+        count = cur.rowcount
+    conn.commit()
+    return count
+
+
+def fetch_active_job_ids(conn) -> np.ndarray:
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM job_postings WHERE is_active = TRUE")
+        return np.sort(np.array([row[0] for row in cur.fetchall()], dtype=np.int64))
+
+
+# --- 3. PRUNING ---
+def prune_vectors(path: str, meta: dict, active_ids: np.ndarray, writer: BundleWriter, conn) -> tuple[int, int]:
+    """Stages the live vectors component restricted to active jobs. Returns (kept, removed)."""
+    vectors, job_ids = mmap_flat_id_index(os.path.join(path, 'job_index.faiss'))
+    keep = np.flatnonzero(np.isin(job_ids, active_ids))
+    kept_ids = np.array(job_ids[keep], dtype=np.int64)
+    content_hashes = None
+    if 'content_hashes.npy' in meta["files"]:
+        content_hashes = np.load(os.path.join(path, 'content_hashes.npy'), mmap_mode='r')[keep]
+
+    work_dir = tempfile.mkdtemp(dir=writer.artifacts_dir, prefix='.compact-')
+    try:
+        vectors_path = os.path.join(work_dir, 'vectors.f32')
+        with open(vectors_path, 'wb') as f:
+            for start in range(0, keep.size, _COPY_ROWS):
+                f.write(np.ascontiguousarray(vectors[keep[start:start + _COPY_ROWS]]).tobytes())
+        index_path = os.path.join(work_dir, 'job_index.faiss')
+        write_flat_id_index(index_path, vectors_path, kept_ids, vectors.shape[1])
+
+        attributes = JobAttributeIndex.build(kept_ids, conn)
+        skill_matrix = JobSkillMatrix.build(kept_ids, conn)
+        ann_meta = meta.get("ann_index", {})
+        carried = {key: meta[key] for key in ("embedding_model",) if key in meta}
+        writer.add_vectors(index_path, kept_ids, attributes, skill_matrix, content_hashes=content_hashes,
+                           index_type=ann_meta.get("type", "flat"), storage=ann_meta.get("storage", "float32"),
+                           shards=(meta.get("shards") or {}).get("by", "none"),
+                           build_mode="compaction", embedded_jobs=0, embedded_texts=0, **carried)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return int(keep.size), int(job_ids.size - keep.size)
+
+
+def prune_tfidf(path: str, meta: dict, active_ids: np.ndarray, writer: BundleWriter) -> tuple[int, int]:
+    """Stages the live TF-IDF component restricted to active jobs. Returns (kept, removed)."""
+    job_ids = np.load(os.path.join(path, 'tfidf_job_ids.npy'))
+    matrix = sparse.csr_matrix(
+        (np.load(os.path.join(path, 'tfidf_data.npy'), mmap_mode='r'),
+         np.load(os.path.join(path, 'tfidf_indices.npy'), mmap_mode='r'),
+         np.load(os.path.join(path, 'tfidf_indptr.npy'), mmap_mode='r')),
+        shape=(job_ids.size, meta["vocabulary_size"]),
+    )
+    keep = np.flatnonzero(np.isin(job_ids, active_ids))
+    vectorizer = joblib.load(os.path.join(path, 'tfidf_vectorizer.joblib'))
+    writer.add_tfidf(vectorizer, matrix[keep], job_ids[keep])
+    return int(keep.size), int(job_ids.size - keep.size)
+
+
+# --- 4. MAIN ---
+def _live_components() -> tuple[str | None, str | None, dict]:
+    version = current_version()
+    if version is None:
+        return None, None, {}
+    path = os.path.join(ARTIFACTS_DIR, version)
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        return version, path, json.load(f)["components"]
+
+
+def main(retention_days: int = JOB_RETENTION_DAYS, dry_run: bool = False):
+    print(f"--- Starting Artifact Compaction (retention: {retention_days} days) ---")
+    conn = get_db_connection()
+    if not conn:
+        return
+
+    writer = None
+    try:
+        # --- Step 1: Deactivate Expired Postings ---
+        expired = deactivate_expired_jobs(conn, retention_days, dry_run)
+        print(f"{'Would deactivate' if dry_run else 'Deactivated'} {expired} postings older than {retention_days} days.")
+        active_ids = fetch_active_job_ids(conn)
+        print(f"{active_ids.size} postings remain active.")
+
+        version, path, components = _live_components()
+        if version is None:
+            print("No artifact bundle published yet; nothing to compact.")
+            return
+        if dry_run:
+            for name, filename in ((VECTORS, 'job_ids.npy'), (TFIDF, 'tfidf_job_ids.npy')):
+                if name in components:
+                    job_ids = np.load(os.path.join(path, filename), mmap_mode='r')
+                    stale = int(job_ids.size - np.count_nonzero(np.isin(job_ids, active_ids)))
+                    print(f"Would prune {stale} of {job_ids.size} rows from the {name} component of {version}.")
+            return
+
+        # --- Step 2: Prune the Live Components Down to the Active Jobs ---
+        start_time = time.time()
+        for attempt in range(1, _PUBLISH_ATTEMPTS + 1):
+            writer = BundleWriter(base_version=version)
+            if VECTORS in components:
+                kept, removed = prune_vectors(path, components[VECTORS], active_ids, writer, conn)
+                print(f"Vectors: kept {kept}, removed {removed} (no jobs re-embedded).")
+            if TFIDF in components:
+                kept, removed = prune_tfidf(path, components[TFIDF], active_ids, writer)
+                print(f"TF-IDF: kept {kept}, removed {removed}.")
+
+            # --- Step 3: Publish the Compacted Bundle ---
+            # publish() refuses if a pruned component was republished meanwhile.
+            try:
+                new_version = writer.publish()
+                writer = None
+                break
+            except StaleBundleError as e:
+                if attempt == _PUBLISH_ATTEMPTS:
+                    raise
+                writer.abort()
+                writer = None
+                print(f"Warning: {e}; pruning the live version instead.")
+                version, path, components = _live_components()
+        print(f"Published compacted bundle version {new_version} (from {version}) "
+              f"in {time.time() - start_time:.2f} seconds.")
+        if CACHE_REDIS_URL:
+            TTLCache("recommendations", redis_url=CACHE_REDIS_URL).clear()
+    except Exception as e:
+        conn.rollback()
+        if writer is not None:
+            writer.abort()
+        print(f"Fatal: Compaction failed: {e}")
+    finally:
+        release_db_connection(conn)
+        close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Deactivate expired postings and prune the artifacts to the live set.")
+    parser.add_argument("--retention-days", type=int, default=JOB_RETENTION_DAYS,
+                        help="Deactivate active postings scraped longer ago than this.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report what would be deactivated and pruned.")
+    args = parser.parse_args()
+
+    main(retention_days=args.retention_days, dry_run=args.dry_run)
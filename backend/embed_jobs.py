@@ -1,47 +1,72 @@
 # embed_jobs.py
 import os
+import json
 import time
-import psycopg2
+import shutil
+import argparse
+import hashlib
 import numpy as np
 import faiss
 from dotenv import load_dotenv
-from services.embedding_service import embed_texts
+from services.embedding_service import embed_texts, dedupe_texts, disable_embedding_server, EMBEDDING_MODEL_VERSION
+from services.embedding_pool import EmbeddingPool, EMBED_WORKERS
+from services.db import get_db_connection, release_db_connection, close_pool
+from services.cache import TTLCache, CACHE_REDIS_URL
+from services.job_attributes import JobAttributeIndex
+from services.job_skill_matrix import JobSkillMatrix
+from services.artifacts import BundleWriter, ARTIFACTS_DIR, StaleBundleError, load_live_vectors
+from services.index_io import write_flat_id_index
+from services.ann_index import INDEX_TYPES, VECTOR_INDEX_TYPE, STORAGE_TYPES, VECTOR_STORAGE
+from services.vector_shards import SHARD_MODES, VECTOR_SHARDS
 
 # --- 1. CONFIGURATION ---
 # As requested, you can control the number of jobs to process.
 # Set to None to process all active jobs.
 MAX_JOBS_TO_EMBED = None 
 
-# Create a directory to store our data artifacts if it doesn't exist
-os.makedirs('data', exist_ok=True)
-FAISS_INDEX_PATH = os.path.join('data', 'job_index.faiss')
-JOB_ID_MAP_PATH = os.path.join('data', 'job_id_map.npy')
+# Streaming mode (--stream): jobs read, embedded and written to disk per chunk.
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 2048))
+# Vectors and the checkpoint of an unfinished streaming build; kept until it is published.
+STREAM_WORK_DIR = os.getenv('STREAM_WORK_DIR', os.path.join('data', 'embed_jobs_stream'))
+
+# Create a directory to store our data artifacts if it doesn't exist.
+# Every run publishes a new version of the artifact bundle (services/artifacts.py).
+os.makedirs(ARTIFACTS_DIR, exist_ok=True)
 
 # Load database credentials from .env file
 load_dotenv()
 
 # --- 2. DATABASE CONNECTION ---
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        conn = psycopg2.connect(
-            host=os.getenv('DB_HOST'),
-            port=os.getenv('DB_PORT'),
-            dbname=os.getenv('DB_NAME'),
-            user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"Fatal: Could not connect to the database: {e}")
-        return None
+# Connections come from the shared pool in services/db.py.
+
+def content_hash(text: str) -> int:
+    """64-bit fingerprint of a job's embedding text; a changed hash means the job is re-embedded."""
+    return int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+
+def job_text(title: str | None, category: str | None) -> str:
+    """The text a job is embedded from."""
+    # full_text = f"{title}. {category} in {city}. Skills: {skills}. Description: {description}"
+    return f"{title or ''}. {category or ''}"
 
 # --- 3. MAIN PIPELINE LOGIC ---
-def main():
+def main(full_rebuild: bool = False, workers: int = EMBED_WORKERS, index_type: str = VECTOR_INDEX_TYPE,
+         storage: str = VECTOR_STORAGE, shards: str = VECTOR_SHARDS):
     """
     Main function to run the entire job embedding pipeline.
+
+    By default only new or changed postings are embedded and added to the live
+    ID-mapped index, and postings that are no longer active are removed from it.
+    `full_rebuild` (or a change of embedding model) re-embeds every job.
+    Jobs whose texts are identical after normalization share one embedding.
+    With `workers` > 1 the texts are embedded by a pool of worker processes.
+    `index_type` ("flat", "hnsw" or "ivf") and `storage` ("float32",
+    "float16" or "int8") pick the search index published next to the exact
+    one (services/ann_index.py); `shards` = "category" also publishes one
+    index per category (services/vector_shards.py).
     """
     print("--- Starting Day 2: Job Embedding Pipeline ---")
+    # Bulk encoding belongs in this process (or its pool), not in the API's shared embedding server.
+    disable_embedding_server()
     
     # --- Step 1: Fetch Active Job Postings ---
     print("Connecting to the database...")
@@ -104,8 +129,7 @@ def main():
                 skills = skills or ""
 
                 # Construct the comprehensive text as planned in the roadmap
-                # full_text = f"{title}. {category} in {city}. Skills: {skills}. Description: {description}"
-                full_text = f"{title}. {category}"
+                full_text = job_text(title, category)
                 
                 job_ids.append(job_id)
                 texts_to_embed.append(full_text)
@@ -114,38 +138,343 @@ def main():
         print(f"Fatal: Failed to fetch or process jobs from database: {e}")
         return
     finally:
-        conn.close()
+        release_db_connection(conn)
 
-    # --- Step 3: Batch-Embed Jobs ---
-    print(f"Generating embeddings for {len(texts_to_embed)} jobs. This may take a while on a CPU...")
-    start_time = time.time()
-    job_embeddings = embed_texts(texts_to_embed)
-    end_time = time.time()
-    print(f"Embedding completed in {end_time - start_time:.2f} seconds.")
+    # --- Step 3: Decide What Needs Embedding ---
+    content_hashes = np.array([content_hash(text) for text in texts_to_embed], dtype=np.uint64)
+    live = None if full_rebuild else load_live_vectors()
+    if live is not None and live["meta"].get("embedding_model") != EMBEDDING_MODEL_VERSION:
+        print(f"Embedding model changed ({live['meta'].get('embedding_model')} -> {EMBEDDING_MODEL_VERSION}); rebuilding from scratch.")
+        live = None
 
-    # --- Step 4: Build and Store FAISS Index ---
-    print("Building FAISS index...")
-    embedding_dimension = job_embeddings.shape[1]
-    
-    # We use IndexFlatIP for cosine similarity with normalized embeddings, which is what SentenceTransformer produces.
-    index = faiss.IndexFlatIP(embedding_dimension)
-    
-    # FAISS requires normalized vectors for IndexFlatIP to work correctly as a cosine similarity search
-    faiss.normalize_L2(job_embeddings)
-    index.add(job_embeddings)
-    
-    print(f"FAISS index built successfully. Total vectors in index: {index.ntotal}")
+    if live is not None:
+        index = live["index"]
+        previous = dict(zip(live["job_ids"].tolist(), live["content_hashes"].tolist()))
+        current = dict(zip(job_ids, content_hashes.tolist()))
+        # Inactive jobs and jobs whose text changed leave the index; new and changed jobs are (re-)added.
+        stale_ids = [job_id for job_id, h in previous.items() if current.get(job_id) != h]
+        pending = [i for i, job_id in enumerate(job_ids) if previous.get(job_id) != current[job_id]]
+        if stale_ids:
+            index.remove_ids(np.array(stale_ids, dtype=np.int64))
+        removed = sum(1 for job_id in previous if job_id not in current)
+        print(f"Incremental update of bundle {live['version']}: {len(pending)} new or changed jobs to embed, "
+              f"{removed} no longer active jobs removed.")
+    else:
+        print("Full rebuild: every active job will be embedded.")
+        index = None
+        pending = list(range(len(job_ids)))
+
+    # --- Step 4: Batch-Embed Jobs and Add Them to the ID-Mapped FAISS Index ---
+    if pending:
+        print(f"Generating embeddings for {len(pending)} jobs. This may take a while on a CPU...")
+        start_time = time.time()
+        # Jobs sharing a text (reposts, generic titles) are embedded once and fanned out.
+        unique_texts, inverse = dedupe_texts([texts_to_embed[i] for i in pending])
+        print(f"Dedup: {len(pending)} texts -> {len(unique_texts)} distinct "
+              f"({1 - len(unique_texts) / len(pending):.1%} of encoder calls saved).")
+        if workers > 1:
+            with EmbeddingPool(workers) as pool:
+                job_embeddings = pool.embed(unique_texts)[inverse]
+        else:
+            job_embeddings = embed_texts(unique_texts)[inverse]
+        end_time = time.time()
+        print(f"Embedding completed in {end_time - start_time:.2f} seconds.")
+
+        if index is None:
+            # We use IndexFlatIP for cosine similarity with normalized embeddings, wrapped in an
+            # IndexIDMap2 so later runs can add and remove vectors by job ID.
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(job_embeddings.shape[1]))
+
+        # FAISS requires normalized vectors for IndexFlatIP to work correctly as a cosine similarity search
+        job_embeddings = np.ascontiguousarray(job_embeddings, dtype=np.float32)
+        faiss.normalize_L2(job_embeddings)
+        index.add_with_ids(job_embeddings, np.array([job_ids[i] for i in pending], dtype=np.int64))
+    else:
+        print("No new or changed jobs to embed.")
+
+    print(f"FAISS index ready. Total vectors in index: {index.ntotal}")
 
-    # --- Step 5: Save Index and ID Mapping ---
-    print(f"Saving FAISS index to: {FAISS_INDEX_PATH}")
-    faiss.write_index(index, FAISS_INDEX_PATH)
+    # The index's row order is now the canonical job order for every aligned array.
+    hash_by_id = dict(zip(job_ids, content_hashes.tolist()))
+    job_ids = faiss.vector_to_array(index.id_map).astype(np.int64)
+    content_hashes = np.array([hash_by_id[job_id] for job_id in job_ids.tolist()], dtype=np.uint64)
 
-    print(f"Saving job ID to index map to: {JOB_ID_MAP_PATH}")
-    np.save(JOB_ID_MAP_PATH, np.array(job_ids, dtype=np.int32))
+    # --- Steps 5 & 6: Snapshot Attributes and Skills, Publish the Bundle ---
+    _publish_vectors(index, job_ids, content_hashes, index_type, storage, shards,
+                     base_version=live["version"] if live is not None else None,
+                     build_mode="incremental" if live is not None else "full", embedded_jobs=len(pending),
+                     embedded_texts=len(unique_texts) if pending else 0)
+
+
+def _publish_vectors(index, job_ids: np.ndarray, content_hashes: np.ndarray,
+                     index_type: str = VECTOR_INDEX_TYPE, storage: str = VECTOR_STORAGE,
+                     shards: str = VECTOR_SHARDS, base_version: str | None = None, **metadata):
+    """
+    Builds the attribute index and skill matrix in the index's row order and
+    publishes them with the index as a new bundle version. `index` is a FAISS
+    index or the path of an index file written by the streaming build.
+    `base_version` is the live bundle an incremental build started from; if
+    its vectors were republished in the meantime nothing is published.
+    """
+    # --- Step 5: Snapshot Filter Attributes and Skills in FAISS Row Order ---
+    # The recommendation service evaluates the Stage-1 sieve and the skill
+    # overlap against these arrays instead of querying Postgres on every request.
+    attributes, skill_matrix = None, None
+    conn = get_db_connection()
+    if conn:
+        try:
+            attributes = JobAttributeIndex.build(job_ids, conn)
+            skill_matrix = JobSkillMatrix.build(job_ids, conn)
+        except Exception as e:
+            print(f"Warning: Could not build the job attribute index or skill matrix: {e}")
+        finally:
+            release_db_connection(conn)
+    close_pool()
+
+    # --- Step 6: Publish Index, ID Mapping, Attributes and Skills as One Bundle ---
+    writer = BundleWriter(base_version=base_version)
+    try:
+        writer.add_vectors(index, job_ids, attributes, skill_matrix, content_hashes=content_hashes,
+                           index_type=index_type, storage=storage, shards=shards,
+                           embedding_model=EMBEDDING_MODEL_VERSION, **metadata)
+        version = writer.publish()
+    except StaleBundleError as e:
+        writer.abort()
+        print(f"Fatal: Not publishing, {e}. Run embed_jobs.py again to update the new version.")
+        return
+    except Exception:
+        writer.abort()
+        raise
+    print(f"Published artifact bundle version: {version}")
+
+    # Results computed against the previous index must not be served any more.
+    # API workers key their in-process caches by index version; a shared Redis
+    # cache is cleared explicitly here.
+    if CACHE_REDIS_URL:
+        TTLCache("recommendations", redis_url=CACHE_REDIS_URL).clear()
 
     print("\n--- Day 2 Deliverables Complete and Verified! ---")
-    print(f"Artifacts saved in the '{os.path.abspath('data')}' directory.")
+    print(f"Artifacts saved in the '{os.path.abspath(os.path.join(ARTIFACTS_DIR, version))}' directory.")
+
+
+# --- 4. STREAMING PIPELINE ---
+def _stream_paths() -> dict:
+    return {name: os.path.join(STREAM_WORK_DIR, filename) for name, filename in (
+        ("vectors", "vectors.f32"), ("job_ids", "job_ids.i64"),
+        ("hashes", "hashes.u64"), ("checkpoint", "checkpoint.json"))}
+
+
+def _save_checkpoint(paths: dict, files: dict, checkpoint: dict):
+    """Makes the appended rows durable, then records them; a crash resumes from the last checkpoint."""
+    for f in files.values():
+        f.flush()
+        os.fsync(f.fileno())
+    tmp_path = paths["checkpoint"] + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, paths["checkpoint"])
+
+
+def _load_checkpoint(paths: dict, base_version: str | None) -> dict | None:
+    """The checkpoint of an unfinished build with the same model and base bundle, or None."""
+    if not os.path.exists(paths["checkpoint"]):
+        return None
+    with open(paths["checkpoint"]) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get("embedding_model") != EMBEDDING_MODEL_VERSION or checkpoint.get("base_version") != base_version:
+        print("Warning: The unfinished streaming build used another model or base bundle; starting over.")
+        return None
+    return checkpoint
+
+
+def main_streaming(full_rebuild: bool = False, chunk_size: int = STREAM_CHUNK_SIZE, resume: bool = False,
+                   workers: int = EMBED_WORKERS, index_type: str = VECTOR_INDEX_TYPE,
+                   storage: str = VECTOR_STORAGE, shards: str = VECTOR_SHARDS):
+    """
+    Embeds active jobs in job-ID order, `chunk_size` at a time, through a
+    server-side cursor. Each chunk's vectors are appended to a raw file on
+    disk and a checkpoint is written, so memory stays flat however many jobs
+    there are, and `resume` continues an interrupted build after its last
+    checkpoint. Unchanged jobs reuse their vectors from the live bundle
+    (memory-mapped) unless `full_rebuild` is set. The finished file is turned
+    into the FAISS index and published like any other build. Each distinct
+    normalized text is embedded once per run; repeats reuse the vector
+    already written to disk. With `workers`
+    > 1 each chunk is split across a pool of worker processes.
+    """
+    print(f"--- Starting Day 2: Job Embedding Pipeline (streaming, {chunk_size} jobs per chunk) ---")
+    disable_embedding_server()
+
+    live = None if full_rebuild else load_live_vectors(mmap=True)
+    if live is not None and live["meta"].get("embedding_model") != EMBEDDING_MODEL_VERSION:
+        print(f"Embedding model changed ({live['meta'].get('embedding_model')} -> {EMBEDDING_MODEL_VERSION}); rebuilding from scratch.")
+        live = None
+    base_version = live["version"] if live is not None else None
+    if live is not None:
+        # Sorted live IDs let each chunk look up its previous rows with one searchsorted.
+        live_order = np.argsort(live["job_ids"], kind='stable')
+        live_sorted_ids = np.asarray(live["job_ids"])[live_order]
+        live_flat = faiss.downcast_index(live["index"].index)
+
+    paths = _stream_paths()
+    os.makedirs(STREAM_WORK_DIR, exist_ok=True)
+    checkpoint = _load_checkpoint(paths, base_version) if resume else None
+    if checkpoint is None:
+        checkpoint = {"embedding_model": EMBEDDING_MODEL_VERSION, "base_version": base_version,
+                      "dimension": None, "rows": 0, "last_job_id": 0, "embedded": 0, "reused": 0, "encoded": 0}
+        for name in ("vectors", "job_ids", "hashes"):
+            open(paths[name], 'wb').close()
+    else:
+        print(f"Resuming after job ID {checkpoint['last_job_id']} ({checkpoint['rows']} jobs already written).")
+        # Rows appended after the last checkpoint may be partial; drop them.
+        rows, dimension = checkpoint["rows"], checkpoint["dimension"] or 0
+        for name, row_bytes in (("vectors", dimension * 4), ("job_ids", 8), ("hashes", 8)):
+            with open(paths[name], 'r+b') as f:
+                f.truncate(rows * row_bytes)
+
+    conn = get_db_connection()
+    if not conn:
+        return
+    files = {name: open(paths[name], 'ab') for name in ("vectors", "job_ids", "hashes")}
+    # Earlier chunks' vectors are read back from disk for texts already embedded in this run,
+    # so only a fingerprint -> row map of the distinct texts is kept in memory.
+    written = open(paths["vectors"], 'rb')
+    seen = {}
+    checkpoint.setdefault("encoded", checkpoint["embedded"])
+    pool = EmbeddingPool(workers) if workers > 1 else None
+    embed = pool.embed if pool is not None else embed_texts
+    start_time = time.time()
+    try:
+        # A named cursor keeps the result set on the server; only one chunk is in memory at a time.
+        with conn.cursor(name='embed_jobs_stream') as cur:
+            cur.itersize = chunk_size
+            cur.execute("""
+                SELECT jp.id, jp.title, jp.category
+                FROM job_postings jp
+                WHERE jp.is_active = TRUE AND jp.id > %s
+                ORDER BY jp.id
+            """, (checkpoint["last_job_id"],))
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                chunk_ids = np.array([row[0] for row in rows], dtype=np.int64)
+                texts = [job_text(row[1], row[2]) for row in rows]
+                hashes = np.array([content_hash(text) for text in texts], dtype=np.uint64)
+
+                # Unchanged jobs keep their live vector; the rest are embedded.
+                vectors = None
+                pending = np.arange(len(rows))
+                if live is not None and live_sorted_ids.size:
+                    pos = np.minimum(np.searchsorted(live_sorted_ids, chunk_ids), live_sorted_ids.size - 1)
+                    rows_in_live = live_order[pos]
+                    unchanged = (live_sorted_ids[pos] == chunk_ids) & \
+                                (np.asarray(live["content_hashes"])[rows_in_live] == hashes)
+                    if unchanged.any():
+                        vectors = np.empty((len(rows), live_flat.d), dtype=np.float32)
+                        for i in np.flatnonzero(unchanged):
+                            vectors[i] = live_flat.reconstruct(int(rows_in_live[i]))
+                        pending = np.flatnonzero(~unchanged)
+
+                if pending.size:
+                    # Each distinct text is embedded once: within the chunk, and across chunks via `seen`.
+                    unique_texts, inverse = dedupe_texts([texts[i] for i in pending])
+                    keys = [content_hash(text) for text in unique_texts]
+                    new = [j for j, key in enumerate(keys) if key not in seen]
+                    if new:
+                        encoded = np.ascontiguousarray(embed([unique_texts[j] for j in new]), dtype=np.float32)
+                        faiss.normalize_L2(encoded)
+                        checkpoint["dimension"] = checkpoint["dimension"] or int(encoded.shape[1])
+                    dimension = checkpoint["dimension"]
+                    unique = np.empty((len(unique_texts), dimension), dtype=np.float32)
+                    for j, key in enumerate(keys):
+                        if key in seen:
+                            written.seek(seen[key] * dimension * 4)
+                            unique[j] = np.frombuffer(written.read(dimension * 4), dtype=np.float32)
+                    if new:
+                        unique[new] = encoded
+                    first_rows = np.empty(len(unique_texts), dtype=np.int64)
+                    first_rows[inverse[::-1]] = pending[::-1]
+                    for j in new:
+                        seen[keys[j]] = checkpoint["rows"] + int(first_rows[j])
+                    checkpoint["encoded"] += len(new)
+                    embeddings = unique[inverse]
+                    if vectors is None:
+                        vectors = embeddings
+                    else:
+                        vectors[pending] = embeddings
+
+                if checkpoint["dimension"] is None:
+                    checkpoint["dimension"] = int(vectors.shape[1])
+                files["vectors"].write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                files["job_ids"].write(chunk_ids.tobytes())
+                files["hashes"].write(hashes.tobytes())
+                checkpoint["rows"] += len(rows)
+                checkpoint["last_job_id"] = int(chunk_ids[-1])
+                checkpoint["embedded"] += int(pending.size)
+                checkpoint["reused"] += len(rows) - int(pending.size)
+                _save_checkpoint(paths, files, checkpoint)
+                print(f"  {checkpoint['rows']} jobs written ({checkpoint['embedded']} embedded from "
+                      f"{checkpoint['encoded']} distinct texts, {checkpoint['reused']} reused), "
+                      f"{time.time() - start_time:.1f}s")
+    except Exception as e:
+        print(f"Fatal: Streaming embedding failed after job ID {checkpoint['last_job_id']}: {e}")
+        print("Run again with --stream --resume to continue from the last checkpoint.")
+        return
+    finally:
+        for f in files.values():
+            f.close()
+        written.close()
+        if pool is not None:
+            pool.close()
+        release_db_connection(conn)
+
+    if not checkpoint["rows"]:
+        print("No active job postings found to embed. Exiting.")
+        return
+    print(f"Embedding completed in {time.time() - start_time:.2f} seconds.")
+    if checkpoint["embedded"]:
+        print(f"Dedup: {checkpoint['embedded']} texts -> {checkpoint['encoded']} distinct "
+              f"({1 - checkpoint['encoded'] / checkpoint['embedded']:.1%} of encoder calls saved).")
+
+    # --- Turn the Vector File into the ID-Mapped FAISS Index ---
+    job_ids = np.fromfile(paths["job_ids"], dtype=np.int64)
+    content_hashes = np.fromfile(paths["hashes"], dtype=np.uint64)
+    index_path = os.path.join(STREAM_WORK_DIR, "job_index.faiss")
+    write_flat_id_index(index_path, paths["vectors"], job_ids, checkpoint["dimension"])
+    print(f"FAISS index ready. Total vectors in index: {job_ids.size}")
+
+    _publish_vectors(index_path, job_ids, content_hashes, index_type, storage, shards,
+                     base_version=base_version, build_mode="stream",
+                     embedded_jobs=checkpoint["embedded"], embedded_texts=checkpoint["encoded"])
+    shutil.rmtree(STREAM_WORK_DIR, ignore_errors=True)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Embed active job postings and publish the vector index.")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embed every active job instead of only new or changed ones.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Read, embed and write jobs in chunks so memory stays flat.")
+    parser.add_argument("--chunk-size", type=int, default=STREAM_CHUNK_SIZE,
+                        help="Jobs per chunk in streaming mode.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted streaming build from its last checkpoint.")
+    parser.add_argument("--workers", type=int, default=EMBED_WORKERS,
+                        help="Embedding worker processes (1 = embed in this process).")
+    parser.add_argument("--index-type", choices=INDEX_TYPES, default=VECTOR_INDEX_TYPE,
+                        help="Search index to publish next to the exact one.")
+    parser.add_argument("--storage", choices=list(STORAGE_TYPES), default=VECTOR_STORAGE,
+                        help="How the search index stores vectors (compact codes are re-scored exactly).")
+    parser.add_argument("--shards", choices=SHARD_MODES, default=VECTOR_SHARDS,
+                        help="Also publish one index per job category.")
+    args = parser.parse_args()
+
+    options = dict(full_rebuild=args.full, workers=args.workers, index_type=args.index_type,
+                   storage=args.storage, shards=args.shards)
+    if args.stream:
+        main_streaming(chunk_size=args.chunk_size, resume=args.resume, **options)
+    else:
+        main(**options)
@@ -1,5 +1,3 @@
-import os
-import psycopg2
 import numpy as np
 import math
 from dotenv import load_dotenv
@@ -7,7 +5,10 @@ from sklearn.metrics.pairwise import cosine_similarity
 import pandas as pd
 
 # --- 1. IMPORTS & CONFIGURATION ---
-from services.recommendation_service import get_recommendations_for_user, faiss_index, job_id_to_faiss_idx
+from services.recommendation_service import get_recommendations_for_user
+from services.artifacts import get_artifacts
+from services.db import get_db_connection, release_db_connection
+from services.user_context import load_user_contexts
 
 load_dotenv()
 PERSONA_USER_IDS = [1, 10, 11]
@@ -19,17 +20,7 @@ GROUND_TRUTH_SKILL_OVERLAP_THRESHOLD = 1
 # --- 2. DATABASE & METRIC FUNCTIONS ---
 
 # --- 3. DATABASE HELPER ---
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        return psycopg2.connect(
-            host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
-            dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-    except psycopg2.OperationalError as e:
-        print(f"FATAL: Could not connect to the database: {e}")
-        return None
+# Connections come from the shared pool in services/db.py.
 
 # --- 4. METRIC IMPLEMENTATION ---
 
@@ -66,7 +57,7 @@ def get_job_popularity_map() -> dict:
         print(f"Error calculating job popularity: {e}")
         return {}
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 
 def calculate_diversity(recommended_job_vectors: np.ndarray) -> float:
@@ -133,7 +124,7 @@ def get_ground_truth(user_id: int, relevance_threshold: int) -> set:
     except Exception as e:
         print(f"Error getting ground truth for user {user_id}: {e}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
     return ground_truth_ids
 
 def calculate_precision_at_k(recommended_ids: list[int], ground_truth_ids: set) -> float:
@@ -150,7 +141,7 @@ def calculate_recall_at_k(recommended_ids: list[int], ground_truth_ids: set) ->
     return relevant_in_recommendations / len(ground_truth_ids)
 
 # --- 3. REVISED EVALUATION PIPELINE ---
-def evaluate_persona(user_id: int, job_popularity_map: dict, ground_truth_ids: set, use_reranker: bool):
+def evaluate_persona(user_id: int, job_popularity_map: dict, ground_truth_ids: set, use_reranker: bool, context=None):
     """
     A helper function to run the full evaluation pipeline for a single mode.
     """
@@ -160,7 +151,8 @@ def evaluate_persona(user_id: int, job_popularity_map: dict, ground_truth_ids: s
         user_id,
         top_k=RECOMMENDATIONS_TO_EVALUATE,
         retrieval_k=CANDIDATES_FOR_RERANKING,
-        use_reranker=use_reranker
+        use_reranker=use_reranker,
+        context=context
     )
     
     results = {
@@ -178,10 +170,11 @@ def evaluate_persona(user_id: int, job_popularity_map: dict, ground_truth_ids: s
     results["precision"] = calculate_precision_at_k(recommended_ids, ground_truth_ids)
     results["recall"] = calculate_recall_at_k(recommended_ids, ground_truth_ids)
     
-    rec_faiss_indices = [job_id_to_faiss_idx[job_id] for job_id in recommended_ids if job_id in job_id_to_faiss_idx]
+    vector_search_engine = get_artifacts().vector_search_engine
+    rec_rows = vector_search_engine.rows_for_ids(recommended_ids)
     
-    if rec_faiss_indices:
-        recommended_vectors = faiss_index.reconstruct_batch(np.array(rec_faiss_indices, dtype=np.int64))
+    if rec_rows.size:
+        recommended_vectors = vector_search_engine.vectors[rec_rows]
         results["diversity"] = calculate_diversity(recommended_vectors)
         results["novelty"] = calculate_novelty(recommended_ids, job_popularity_map)
         
@@ -191,15 +184,15 @@ def evaluate_persona(user_id: int, job_popularity_map: dict, ground_truth_ids: s
 def main():
     print("--- Starting A/B Evaluation Script: Bi-Encoder vs. Cross-Encoder ---")
     
-    if faiss_index is None:
+    if get_artifacts().vector_search_engine is None:
         print("FATAL: FAISS index not loaded. Cannot run evaluation. Exiting.")
         return
         
     print("Pre-calculating job popularity map...")
     job_popularity_map = get_job_popularity_map()
     
-    conn = get_db_connection()
-    if not conn: return
+    # Load every persona's profile, skills and preferences in one query
+    persona_contexts = load_user_contexts(PERSONA_USER_IDS)
     
     for user_id in PERSONA_USER_IDS:
         print("\n" + "="*70)
@@ -207,13 +200,11 @@ def main():
         print("="*70)
 
         try:
-            with conn.cursor() as cur:
-                cur.execute("SELECT first_name, last_name, professional_title FROM user_profiles WHERE user_id = %s", (user_id,))
-                user_info = cur.fetchone()
-                if not user_info:
-                    print(f"SKIPPING: No profile found for user_id {user_id}.")
-                    continue
-                print(f"Persona Profile: {user_info[0] or ''} {user_info[1] or ''} - {user_info[2] or 'N/A'}")
+            context = persona_contexts.get(user_id)
+            if not context or not context.has_profile:
+                print(f"SKIPPING: No profile found for user_id {user_id}.")
+                continue
+            print(f"Persona Profile: {context.first_name or ''} {context.last_name or ''} - {context.professional_title or 'N/A'}")
 
             # --- NEW: Get ground truth for this persona ONCE ---
             print(f"Generating ground truth for user {user_id} (threshold: {GROUND_TRUTH_SKILL_OVERLAP_THRESHOLD} skills)...")
@@ -221,8 +212,8 @@ def main():
             print(f"   - Found {len(ground_truth_ids)} highly relevant jobs for this user.")
 
             # --- Run both evaluation modes ---
-            bi_encoder_results = evaluate_persona(user_id, job_popularity_map, ground_truth_ids, use_reranker=False)
-            cross_encoder_results = evaluate_persona(user_id, job_popularity_map, ground_truth_ids, use_reranker=True)
+            bi_encoder_results = evaluate_persona(user_id, job_popularity_map, ground_truth_ids, use_reranker=False, context=context)
+            cross_encoder_results = evaluate_persona(user_id, job_popularity_map, ground_truth_ids, use_reranker=True, context=context)
 
             # --- REVISED: Print the comparative report with new metrics ---
             print("\n--- Comparative Report ---")
@@ -260,7 +251,7 @@ def main():
 
         except Exception as e:
             print(f"An error occurred while evaluating user {user_id}: {e}")
-    
+
     print("\n--- Evaluation Complete ---")
 
 if __name__ == "__main__":
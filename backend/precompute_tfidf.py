@@ -1,25 +1,14 @@
-import os
-import joblib
-import psycopg2
 from dotenv import load_dotenv
 from sklearn.feature_extraction.text import TfidfVectorizer
+from services.db import get_db_connection, release_db_connection, close_pool
+from services.artifacts import BundleWriter
 
 # Load environment variables
 load_dotenv()
 
 # --- Configuration ---
-os.makedirs('data', exist_ok=True)
-TFIDF_VECTORIZER_PATH = os.path.join('data', 'tfidf_vectorizer.joblib')
-TFIDF_MATRIX_PATH = os.path.join('data', 'tfidf_matrix.joblib')
-# We also need to save the order of job_ids for mapping
-TFIDF_JOB_ID_MAP_PATH = os.path.join('data', 'tfidf_job_id_map.joblib')
-
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
-        dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD')
-    )
+# The vectorizer, the matrix and the order of job_ids are published together as
+# the "tfidf" component of the artifact bundle (services/artifacts.py).
 
 def main():
     print("--- Starting TF-IDF Pre-computation ---")
@@ -51,21 +40,22 @@ def main():
             tfidf_matrix = vectorizer.fit_transform(job_texts)
             
             # Save the artifacts
-            print(f"Saving vectorizer to {TFIDF_VECTORIZER_PATH}")
-            joblib.dump(vectorizer, TFIDF_VECTORIZER_PATH)
-            
-            print(f"Saving TF-IDF matrix to {TFIDF_MATRIX_PATH}")
-            joblib.dump(tfidf_matrix, TFIDF_MATRIX_PATH)
-            
-            print(f"Saving job ID map to {TFIDF_JOB_ID_MAP_PATH}")
-            joblib.dump(job_ids, TFIDF_JOB_ID_MAP_PATH)
+            writer = BundleWriter()
+            try:
+                writer.add_tfidf(vectorizer, tfidf_matrix, job_ids)
+                version = writer.publish()
+            except Exception:
+                writer.abort()
+                raise
+            print(f"Published artifact bundle version: {version}")
             
             print("\n--- TF-IDF Pre-computation Complete! ---")
 
     except Exception as e:
         print(f"An error occurred: {e}")
     finally:
-        conn.close()
+        release_db_connection(conn)
+        close_pool()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
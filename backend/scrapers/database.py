@@ -1,7 +1,6 @@
 # scrapers/database.py
-import psycopg2
-import os
 from dotenv import load_dotenv
+from services.db import get_db_connection, release_db_connection
 
 load_dotenv()
 
@@ -9,17 +8,8 @@ load_dotenv()
 _category_map = None
 
 def get_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        conn = psycopg2.connect(
-            host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
-            dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"Could not connect to the database: {e}")
-        return None
+    """Checks a connection out of the shared pool (see services/db.py)."""
+    return get_db_connection()
 
 def _load_category_map(cursor):
     """
@@ -110,4 +100,4 @@ def save_job_posting(job_data):
             conn.rollback()
     finally:
         if conn:
-            conn.close()
\ No newline at end of file
+            release_db_connection(conn)
\ No newline at end of file
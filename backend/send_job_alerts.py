@@ -1,88 +1,64 @@
 import os
+import json
+import time
 import argparse
-import psycopg2
-import numpy as np
-import faiss
-from sklearn.metrics.pairwise import cosine_similarity
+from datetime import datetime, timezone
 from dotenv import load_dotenv
-from services.recommendation_service import get_recommendations_for_user
-from services.email_service import send_recommendations_email
+from services.recommendation_service import get_recommendations_for_user, get_recommendations_for_users
+from services.email_service import send_recommendations_email, queue_recommendations_email, get_email_dispatcher
+from services.user_context import load_user_context, load_user_contexts
+from services.db import get_db_connection, release_db_connection
 
 
-# --- IMPORTANT: These globals must be loaded for the service to work ---
+# The FAISS index and ID map are loaded by the recommendation service from the artifact bundle.
 load_dotenv()
-FAISS_INDEX_PATH = os.path.join('data', 'job_index.faiss')
-JOB_ID_MAP_PATH = os.path.join('data', 'job_id_map.npy')
-faiss_index = faiss.read_index(FAISS_INDEX_PATH)
-job_id_map = np.load(JOB_ID_MAP_PATH)
-job_id_to_faiss_idx = {job_id: i for i, job_id in enumerate(job_id_map)}
 
 
 # --- NEW: Define constants for clarity ---
 CANDIDATES_FOR_RERANKING = 50  # Retrieve 50 candidates for the cross-encoder to re-rank
 FINAL_RECOMMENDATIONS_COUNT = 7 # Send the top 7 most accurate results in the email
 
+# Bulk mode: users per pipeline batch and where progress is saved. Sending
+# concurrency is the email dispatcher's (EMAIL_WORKERS / EMAIL_BATCH_SIZE).
+BULK_BATCH_SIZE = 64
+CHECKPOINT_PATH = os.path.join('data', 'send_job_alerts_checkpoint.json')
+
+
+def _user_name(context) -> str:
+    return context.first_name or "کاربر گرامی" # A more polite default name
+
 
 def main(user_id: int, count: int):
     """
     Generates and emails job recommendations for a specific user.
     """
     print(f"--- Starting Recommendation Email Sender for User ID: {user_id} ---")
-    
-    # 1. Fetch user's email and name from the database using a JOIN
-    conn = psycopg2.connect(
-        host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
-        dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'),
-        password=os.getenv('DB_PASSWORD')
-    )
-    user_email, user_name = None, "کاربر گرامی" # A more polite default name
-    try:
-        with conn.cursor() as cur:
-            # --- THE FIX IS HERE ---
-            # We use a LEFT JOIN to get the email from 'users' and the first_name
-            # from 'user_profiles'. This handles users who haven't created a profile yet.
-            cur.execute("""
-                SELECT u.email, up.first_name
-                FROM users u
-                LEFT JOIN user_profiles up ON u.id = up.user_id
-                WHERE u.id = %s
-            """, (user_id,))
-            
-            user_record = cur.fetchone()
-            if not user_record:
-                print(f"Error: User with ID {user_id} not found.")
-                return
-            
-            # Unpack the results and provide a fallback for the name
-            user_email = user_record[0]
-            fetched_name = user_record[1]
-            if fetched_name:
-                user_name = fetched_name
-
-    except Exception as e:
-        print(f"Database error fetching user info: {e}")
+
+    # 1. Load the user's email, name, profile and skills in a single query
+    context = load_user_context(user_id)
+    if not context:
+        print(f"Error: User with ID {user_id} not found.")
         return
-    finally:
-        if conn:
-            conn.close()
- # 2. Get Recommendations with Re-ranking Enabled
+
+    # 2. Get Recommendations with Re-ranking Enabled
     print("Generating high-accuracy recommendations...")
     recommendations = get_recommendations_for_user(
         user_id,
         top_k=count,
         retrieval_k=CANDIDATES_FOR_RERANKING,
-        use_reranker=True  # <-- THE KEY CHANGE IS HERE
+        use_reranker=True,  # <-- THE KEY CHANGE IS HERE
+        context=context
     )
-    
+
     if not recommendations:
         print(f"No suitable recommendations found for user {user_id}. No email will be sent.")
-        return    
+        return
 
     # 3. Send the email
     print(f"Found {len(recommendations)} recommendations. Preparing to send email...")
     success = send_recommendations_email(
-        recipient_email=user_email,
-        user_name=user_name,
+        recipient_email=context.email,
+        user_name=_user_name(context),
         jobs=recommendations
     )
 
@@ -91,10 +67,163 @@ def main(user_id: int, count: int):
     else:
         print("--- Process Failed. Check Brevo API logs. ---")
 
+
+# --- BULK MODE ---
+def _eligible_users_sql(segment: int | None) -> tuple[str, list]:
+    """Verified users with a profile, optionally only those preferring one job category."""
+    sql = """
+        FROM users u JOIN user_profiles up ON up.user_id = u.id
+        WHERE u.is_verified = TRUE
+    """
+    params = []
+    if segment is not None:
+        sql += " AND up.preferred_category_id = %s"
+        params.append(segment)
+    return sql, params
+
+
+def count_eligible_users(segment: int | None, after_user_id: int = 0) -> int:
+    conn = get_db_connection()
+    if not conn: return 0
+    try:
+        sql, params = _eligible_users_sql(segment)
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) " + sql + " AND u.id > %s", params + [after_user_id])
+            return cur.fetchone()[0]
+    finally:
+        release_db_connection(conn)
+
+
+def stream_eligible_user_ids(segment: int | None, batch_size: int, after_user_id: int = 0):
+    """
+    Yields eligible user IDs in ascending batches (keyset pagination), so the
+    whole user table is never held in memory and each page is a cheap index scan.
+    """
+    sql, params = _eligible_users_sql(segment)
+    while True:
+        conn = get_db_connection()
+        if not conn:
+            raise RuntimeError("Database connection failed while streaming users.")
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT u.id " + sql + " AND u.id > %s ORDER BY u.id LIMIT %s",
+                            params + [after_user_id, batch_size])
+                user_ids = [row[0] for row in cur.fetchall()]
+        finally:
+            release_db_connection(conn)
+        if not user_ids:
+            return
+        yield user_ids
+        after_user_id = user_ids[-1]
+
+
+def load_checkpoint(path: str, segment: int | None) -> dict:
+    """The saved progress of a previous run for the same segment, or a fresh state."""
+    fresh = {"segment": segment, "last_user_id": 0, "sent": 0, "skipped": 0, "failed": 0}
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return fresh
+    if state.get("segment") != segment:
+        print(f"Warning: Checkpoint {path} belongs to segment {state.get('segment')}; starting from the beginning.")
+        return fresh
+    return state
+
+
+def save_checkpoint(path: str, state: dict):
+    """Writes the checkpoint atomically, so a crash never leaves a half-written file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    state["updated_at"] = datetime.now(timezone.utc).isoformat()
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def send_bulk_alerts(count: int, segment: int | None = None, batch_size: int = BULK_BATCH_SIZE,
+                     checkpoint_path: str = CHECKPOINT_PATH, resume: bool = False):
+    """
+    Emails recommendations to every eligible user (or one segment of them).
+
+    Users are streamed in batches; each batch goes through the batched pipeline
+    (one embedding call, one retrieval matrix product, one cross-encoder call)
+    while the previous batch's emails are still being sent by the email
+    dispatcher, which coalesces them into batched provider calls.
+    Progress is checkpointed after every batch, and `resume` continues after
+    the last completed batch. A crash can re-send at most the two batches in flight.
+    """
+    state = load_checkpoint(checkpoint_path, segment) if resume else \
+        {"segment": segment, "last_user_id": 0, "sent": 0, "skipped": 0, "failed": 0}
+    if state["last_user_id"]:
+        print(f"Resuming after user {state['last_user_id']} "
+              f"({state['sent']} sent, {state['skipped']} skipped, {state['failed']} failed so far).")
+
+    total = count_eligible_users(segment, state["last_user_id"])
+    label = f"segment (category {segment})" if segment is not None else "all verified users"
+    print(f"--- Bulk job alerts for {label}: {total} users to process ---")
+
+    progress = {"processed": 0}
+    started = time.time()
+
+    def finish_batch(last_user_id: int, batch_size_done: int, skipped: int, futures: list):
+        """Waits for a batch's emails, then records it in the checkpoint."""
+        state["skipped"] += skipped
+        for future in futures:
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"Warning: Sending an alert failed: {e}")
+                ok = False
+            state["sent" if ok else "failed"] += 1
+        state["last_user_id"] = last_user_id
+        save_checkpoint(checkpoint_path, state)
+
+        progress["processed"] += batch_size_done
+        elapsed = max(time.time() - started, 1e-9)
+        print(f"[{progress['processed']}/{total}] sent={state['sent']} skipped={state['skipped']} "
+              f"failed={state['failed']} ({progress['processed'] / elapsed:.1f} users/s)")
+
+    in_flight = None
+    for user_ids in stream_eligible_user_ids(segment, batch_size, state["last_user_id"]):
+        contexts = load_user_contexts(user_ids)
+        batch = [contexts[uid] for uid in user_ids if uid in contexts and contexts[uid].email]
+        recommendations = get_recommendations_for_users(
+            batch, top_k=count, retrieval_k=CANDIDATES_FOR_RERANKING, use_reranker=True)
+
+        futures = [queue_recommendations_email(context.email, _user_name(context), recommendations[context.user_id])
+                   for context in batch if recommendations.get(context.user_id)]
+        skipped = len(user_ids) - len(futures)
+
+        # The previous batch's emails were sending while this batch was scored.
+        if in_flight is not None:
+            finish_batch(*in_flight)
+        in_flight = (user_ids[-1], len(user_ids), skipped, futures)
+    if in_flight is not None:
+        finish_batch(*in_flight)
+
+    email_stats = get_email_dispatcher().stats()
+    print(f"Email dispatch: {email_stats['provider_calls']} provider calls, "
+          f"{email_stats['retries']} retries, {email_stats['avg_batch_seconds']:.2f}s per batch")
+    print(f"--- Bulk job alerts finished in {time.time() - started:.1f}s: "
+          f"{state['sent']} sent, {state['skipped']} skipped, {state['failed']} failed ---")
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Send job recommendations to a user.")
-    parser.add_argument("--user-id", type=int, required=True, help="The ID of the user to send recommendations to.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--user-id", type=int, help="The ID of the user to send recommendations to.")
+    target.add_argument("--all", action="store_true", help="Send to every verified user with a profile.")
+    target.add_argument("--segment", type=int, metavar="CATEGORY_ID",
+                        help="Send to verified users whose preferred category is CATEGORY_ID.")
     parser.add_argument("--count", type=int, default=4, help="The number of recommendations to send.")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="Users per pipeline batch (bulk mode).")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Progress file for bulk mode.")
+    parser.add_argument("--resume", action="store_true", help="Continue a bulk run from its checkpoint.")
     args = parser.parse_args()
-    
-    main(args.user_id, args.count)
\ No newline at end of file
+
+    if args.user_id is not None:
+        main(args.user_id, args.count)
+    else:
+        send_bulk_alerts(args.count, segment=args.segment, batch_size=args.batch_size,
+                         checkpoint_path=args.checkpoint, resume=args.resume)
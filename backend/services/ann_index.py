@@ -0,0 +1,253 @@
+# services/ann_index.py
+"""
+Approximate nearest-neighbour indexes for the job vectors.
+
+The exact `IndexFlatIP` scores every allowed job for every request, so its
+cost grows linearly with the corpus. A bundle can additionally carry an
+approximate index, chosen at build time (embed_jobs.py --index-type or
+VECTOR_INDEX_TYPE) and recorded in the manifest:
+
+- "hnsw": `IndexHNSWFlat`, a navigable small-world graph. No training;
+  efSearch trades recall for latency at query time.
+- "ivf":  `IndexIVFFlat` with a flat inner-product quantizer trained on a
+  sample of the vectors. nprobe (inverted lists visited) trades recall
+  for latency.
+- "flat": no approximate index; every search is exact.
+
+The exact flat index is always kept next to it: incremental builds add and
+remove jobs there, and `VectorSearchEngine` falls back to it for selective
+filters (where a graph or list walk finds too few allowed rows) and
+whenever the approximate search returns fewer than k results. Row i of the
+approximate index is row i of the flat index, so both return row positions.
+
+Independently, VECTOR_STORAGE (embed_jobs.py --storage) picks how the
+searched vectors are held in memory:
+
+- "float32": the vectors as embedded (1536 bytes per job at 384 dims).
+- "float16": `ScalarQuantizer.QT_fp16`, half the memory, near-lossless.
+- "int8":    `ScalarQuantizer.QT_8bit`, a quarter, with per-dimension ranges
+  trained on the vectors.
+
+With compact storage the coarse pass (flat, HNSW or IVF) runs on the codes,
+fetches RESCORE_FACTOR times the requested results, and only that shortlist
+is re-scored exactly against the float32 vectors, which stay in the bundle
+and are memory-mapped, so only the shortlisted rows are ever paged in.
+
+Building the approximate index costs time proportional to the corpus (an
+HNSW graph over 1M jobs takes minutes), so a publish first tries to bring the
+live bundle's index up to date (`update_ann_index`) instead:
+
+- IVF: the rows of jobs that left or changed are removed, the survivors are
+  relabelled with their new row positions, and only new or changed jobs are
+  assigned to lists. The quantizer (and int8 ranges) are kept until more than
+  ANN_RETRAIN_FRACTION of the corpus was added since they were trained.
+- HNSW and compact flat storage label rows by insertion order and cannot
+  remove any, so they are only updated when the build appended jobs without
+  removing or changing one; anything else rebuilds them.
+
+The manifest records which happened ("update": "updated" or "rebuilt") and
+how long it took.
+"""
+import os
+import time
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INDEX_TYPES = ('flat', 'hnsw', 'ivf')
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'flat').lower()
+STORAGE_TYPES = {'float32': None, 'float16': faiss.ScalarQuantizer.QT_fp16, 'int8': faiss.ScalarQuantizer.QT_8bit}
+BYTES_PER_DIMENSION = {'float32': 4, 'float16': 2, 'int8': 1}
+VECTOR_STORAGE = os.getenv('VECTOR_STORAGE', 'float32').lower()
+# With compact storage, candidates fetched from the codes per requested result before exact re-scoring.
+RESCORE_FACTOR = int(os.getenv('RESCORE_FACTOR', 4))
+# Build-time parameters
+HNSW_M = int(os.getenv('HNSW_M', 32))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 200))
+IVF_NLIST = int(os.getenv('IVF_NLIST', 0))  # 0 = 4 * sqrt(number of jobs)
+IVF_TRAIN_POINTS_PER_LIST = 64
+# Vectors sampled to train the int8 per-dimension ranges of flat and HNSW storage.
+SQ_TRAIN_SIZE = 100_000
+# Query-time parameters
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', 128))
+IVF_NPROBE = int(os.getenv('IVF_NPROBE', 16))
+# Filters that allow less than this fraction of the jobs are searched exactly.
+ANN_MIN_ALLOWED_FRACTION = float(os.getenv('ANN_MIN_ALLOWED_FRACTION', 0.05))
+# Trained indexes (IVF, int8 / float16 storage) are rebuilt once more than this
+# fraction of the corpus was added since their training.
+ANN_RETRAIN_FRACTION = float(os.getenv('ANN_RETRAIN_FRACTION', 0.2))
+
+_ADD_BATCH = 65536
+
+
+def _storage(index):
+    """The flat storage index of a (possibly ID-mapped) flat index."""
+    return faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+
+
+def _vectors(flat, start: int, stop: int) -> np.ndarray:
+    return np.ascontiguousarray(flat.reconstruct_n(start, stop - start), dtype=np.float32)
+
+
+def default_nlist(ntotal: int) -> int:
+    # FAISS wants at least 39 training points per list.
+    return max(1, min(int(4 * np.sqrt(ntotal)), ntotal // 39))
+
+
+def _training_sample(flat, size: int) -> np.ndarray:
+    size = min(flat.ntotal, size)
+    sample = np.sort(np.random.default_rng(0).choice(flat.ntotal, size, replace=False))
+    return np.ascontiguousarray(flat.reconstruct_batch(sample), dtype=np.float32)
+
+
+def build_ann_index(flat_index, index_type: str = VECTOR_INDEX_TYPE,
+                    storage: str = VECTOR_STORAGE) -> tuple[object | None, dict]:
+    """
+    Builds the index of `index_type` that searches hold in memory, over the
+    vectors of `flat_index` row for row, storing them as `storage`.
+    Returns (index, manifest metadata); the index is None for a flat index
+    with float32 storage, which is `flat_index` itself.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type {index_type!r}; expected one of {', '.join(INDEX_TYPES)}")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown vector storage {storage!r}; expected one of {', '.join(STORAGE_TYPES)}")
+    if index_type == 'flat' and storage == 'float32':
+        return None, {"type": "flat", "storage": storage}
+
+    flat = _storage(flat_index)
+    d, ntotal = flat.d, flat.ntotal
+    qtype = STORAGE_TYPES[storage]
+    started = time.perf_counter()
+    if index_type == 'flat':
+        index = faiss.IndexScalarQuantizer(d, qtype, faiss.METRIC_INNER_PRODUCT)
+        meta = {"type": "flat", "train_size": min(ntotal, SQ_TRAIN_SIZE)}
+    elif index_type == 'hnsw':
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(d, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWSQ(d, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        meta = {"type": "hnsw", "M": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION,
+                "train_size": min(ntotal, SQ_TRAIN_SIZE)}
+    else:
+        nlist = IVF_NLIST or default_nlist(ntotal)
+        quantizer = faiss.IndexFlatIP(d)
+        if qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, d, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, d, nlist, qtype, faiss.METRIC_INNER_PRODUCT)
+        meta = {"type": "ivf", "nlist": nlist, "train_size": int(min(ntotal, nlist * IVF_TRAIN_POINTS_PER_LIST))}
+    meta["storage"] = storage
+    if not index.is_trained:
+        index.train(_training_sample(flat, meta["train_size"]))
+
+    # Sequential adds label row i with i, so results are row positions like the flat index's.
+    for start in range(0, ntotal, _ADD_BATCH):
+        index.add(_vectors(flat, start, min(start + _ADD_BATCH, ntotal)))
+    meta["build_seconds"] = round(time.perf_counter() - started, 2)
+    meta["bytes_per_vector"] = d * BYTES_PER_DIMENSION[storage]
+    meta["update"] = "rebuilt"
+    meta["rows_since_training"] = 0
+    print(f"Built {index_type} index ({storage}) over {ntotal} vectors in {meta['build_seconds']}s.")
+    return index, meta
+
+
+def unchanged_rows(live_ids: np.ndarray, live_hashes: np.ndarray, job_ids: np.ndarray,
+                   content_hashes: np.ndarray) -> np.ndarray:
+    """
+    For every (job ID, content hash) pair, the row of the live arrays holding
+    the same job with the same hash, or -1 for a new or changed job.
+    """
+    job_ids = np.asarray(job_ids, dtype=np.int64)
+    live_ids = np.asarray(live_ids, dtype=np.int64)
+    if live_ids.size == 0:
+        return np.full(job_ids.size, -1, dtype=np.int64)
+    order = np.argsort(live_ids, kind='stable')
+    sorted_ids = live_ids[order]
+    pos = np.minimum(np.searchsorted(sorted_ids, job_ids), sorted_ids.size - 1)
+    unchanged = (sorted_ids[pos] == job_ids) & \
+                (np.asarray(live_hashes, dtype=np.uint64)[order[pos]] == np.asarray(content_hashes, dtype=np.uint64))
+    return np.where(unchanged, order[pos], -1).astype(np.int64)
+
+
+def update_ann_index(previous, previous_meta: dict, source_rows: np.ndarray,
+                     flat_index) -> tuple[object, dict] | None:
+    """
+    Brings `previous`, an index built here over an earlier version of the
+    corpus, up to date with `flat_index` instead of rebuilding it.
+    `source_rows[i]` is the row of `previous` that holds new row i's vector
+    unchanged, or -1 for a new or changed job. Returns (index, manifest
+    metadata), or None if the index has to be rebuilt.
+    """
+    flat = _storage(flat_index)
+    source_rows = np.asarray(source_rows, dtype=np.int64)
+    if previous.d != flat.d or source_rows.size != flat.ntotal:
+        return None
+    if previous_meta.get("type") == "hnsw" and previous_meta.get("M") != HNSW_M:
+        return None
+    if previous_meta.get("type") == "ivf" and IVF_NLIST and previous_meta.get("nlist") != IVF_NLIST:
+        return None
+    fresh = np.flatnonzero(source_rows < 0)
+    rows_since_training = previous_meta.get("rows_since_training", 0) + int(fresh.size)
+    trained = isinstance(previous, faiss.IndexIVF) or previous_meta.get("storage") != "float32"
+    if trained and rows_since_training > ANN_RETRAIN_FRACTION * flat.ntotal:
+        return None
+
+    started = time.perf_counter()
+    if isinstance(previous, faiss.IndexIVF):
+        kept = np.flatnonzero(source_rows >= 0)
+        new_rows = np.full(previous.ntotal, -1, dtype=np.int64)
+        new_rows[source_rows[kept]] = kept
+        removed = np.flatnonzero(new_rows < 0)
+        if removed.size:
+            previous.remove_ids(removed)
+        # IVF stores every vector's label in its list; relabel the survivors in place.
+        invlists = previous.invlists
+        for list_no in range(previous.nlist):
+            size = invlists.list_size(list_no)
+            if size:
+                labels = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+                labels[:] = new_rows[labels]
+        for start in range(0, fresh.size, _ADD_BATCH):
+            batch = fresh[start:start + _ADD_BATCH]
+            previous.add_with_ids(np.ascontiguousarray(flat.reconstruct_batch(batch), dtype=np.float32), batch)
+    else:
+        # Labels are insertion positions: only appending to an unchanged prefix keeps them valid.
+        ntotal = previous.ntotal
+        if ntotal > flat.ntotal or not np.array_equal(source_rows[:ntotal], np.arange(ntotal)):
+            return None
+        for start in range(ntotal, flat.ntotal, _ADD_BATCH):
+            previous.add(_vectors(flat, start, min(start + _ADD_BATCH, flat.ntotal)))
+    if previous.ntotal != flat.ntotal:
+        return None
+
+    meta = {key: value for key, value in previous_meta.items() if key != "build_seconds"}
+    meta.update({"update": "updated", "rows_since_training": rows_since_training,
+                 "update_seconds": round(time.perf_counter() - started, 2)})
+    print(f"Updated the {meta['type']} index ({meta['storage']}): {fresh.size} rows added, "
+          f"{flat.ntotal - fresh.size} kept, in {meta['update_seconds']}s.")
+    return previous, meta
+
+
+def search_parameters(index, k: int, selector=None, allowed_fraction: float = 1.0):
+    """
+    FAISS search parameters for an index built here, with an optional row
+    selector. A filter hides part of every neighbourhood an HNSW or IVF
+    search walks, so it is widened in proportion to the fraction it hides.
+    """
+    widen = 1.0 / max(allowed_fraction, 1e-6)
+    if isinstance(index, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = max(k, int(HNSW_EF_SEARCH * widen))
+    elif isinstance(index, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = min(index.nlist, int(np.ceil(IVF_NPROBE * widen)))
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
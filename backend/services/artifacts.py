@@ -0,0 +1,581 @@
+# services/artifacts.py
+"""
+Versioned, memory-mapped bundle of the recommendation artifacts.
+
+The FAISS index, its job ID map and the TF-IDF objects used to be loaded
+separately by `api.py`, `services/recommendation_service.py` and
+`send_job_alerts.py`, each from its own loose file, with nothing tying an index
+to the ID map it was built with. Every build now publishes one bundle:
+
+    data/artifacts/
+        CURRENT                      <- name of the live version, swapped atomically
+        20261016-120304-123456/
+            manifest.json            <- format, version, per-component metadata
+            job_ids.npy              \
+            job_index.faiss           |  "vectors" component (embed_jobs.py)
+            job_index_ann.faiss       |  (only with an HNSW / IVF index type or compact storage)
+            content_hashes.npy        |
+            attributes/*.npy          |
+            skills/*.npy              |
+            shards/<category>/*      /   (only with VECTOR_SHARDS=category)
+            tfidf_job_ids.npy        \
+            tfidf_data.npy            |  "tfidf" component (precompute_tfidf.py)
+            tfidf_indices.npy         |
+            tfidf_indptr.npy          |
+            tfidf_vectorizer.joblib  /
+
+A bundle directory is never modified after it is published. A build that only
+produces one component carries the other one forward from the live bundle
+(hard links, no copies). Arrays are raw `.npy` and are opened with
+`mmap_mode='r'`, and flat FAISS indexes are read with FAISS' mmap flag, so all
+API workers on a machine share the same pages through the OS page cache
+instead of each holding a private copy.
+
+Running API processes pick up new versions without a restart: with
+`start_artifact_reloader()` a background thread polls CURRENT every
+`ARTIFACT_RELOAD_INTERVAL` seconds, loads the new bundle off the request path
+and swaps the process-wide reference.
+"""
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import faiss
+import joblib
+import numpy as np
+from dotenv import load_dotenv
+from scipy import sparse
+
+from services.ann_index import VECTOR_INDEX_TYPE, VECTOR_STORAGE, build_ann_index, unchanged_rows, update_ann_index
+from services.index_io import read_index_mmap
+from services.job_attributes import JobAttributeIndex
+from services.job_skill_matrix import JobSkillMatrix
+from services.relevance_service import RelevanceEngine
+from services.startup import timed
+from services.vector_search import VectorSearchEngine
+from services.vector_shards import VECTOR_SHARDS, ShardedSearch, build_shards
+
+load_dotenv()
+
+ARTIFACTS_DIR = os.getenv('ARTIFACTS_DIR', os.path.join('data', 'artifacts'))
+CURRENT_POINTER = 'CURRENT'
+MANIFEST_NAME = 'manifest.json'
+BUNDLE_FORMAT = 1
+
+VECTORS = 'vectors'
+TFIDF = 'tfidf'
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _new_version() -> str:
+    return datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S-%f')
+
+
+# --- 1. READING ---
+def current_version(artifacts_dir: str = ARTIFACTS_DIR) -> str | None:
+    """The version named by the CURRENT pointer, or None if nothing was published yet."""
+    try:
+        with open(os.path.join(artifacts_dir, CURRENT_POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class ArtifactBundle:
+    """
+    Everything loaded from one published bundle. Attributes of a component
+    that is missing (or failed to load) are None.
+    """
+
+    def __init__(self, version: str | None = None, path: str | None = None, manifest: dict | None = None):
+        self.version = version
+        self.path = path
+        self.manifest = manifest or {"components": {}}
+        # "vectors" component
+        self.job_ids = None
+        self.faiss_index = None
+        self.vector_search_engine = None
+        self.vector_shards = None
+        self.job_attribute_index = None
+        self.job_skill_matrix = None
+        # "tfidf" component
+        self.tfidf_vectorizer = None
+        self.relevance_engine = None
+
+    def component(self, name: str) -> dict | None:
+        return self.manifest["components"].get(name)
+
+    @classmethod
+    def load(cls, version: str, artifacts_dir: str = ARTIFACTS_DIR) -> "ArtifactBundle":
+        path = os.path.join(artifacts_dir, version)
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError(f"Unsupported artifact bundle format {manifest.get('format')} in {path}")
+
+        bundle = cls(version, path, manifest)
+        if bundle.component(VECTORS):
+            try:
+                bundle._load_vectors()
+            except Exception as e:
+                print(f"CRITICAL WARNING (artifacts): Could not load the vector index of bundle {version}: {e}")
+        if bundle.component(TFIDF):
+            try:
+                bundle._load_tfidf()
+            except Exception as e:
+                print(f"WARNING (artifacts): Could not load the TF-IDF artifacts of bundle {version}: {e}")
+        return bundle
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load_vectors(self):
+        meta = self.component(VECTORS)
+        ann_meta = meta.get("ann_index", {})
+        # With compact storage searches run on the codes; the float32 rows are only
+        # read for re-scoring, straight from the file's pages, never copied to the heap.
+        compact = ann_meta.get("storage", "float32") != "float32"
+        has_ann = ann_meta.get("type", "flat") != "flat" or compact
+        job_ids = np.load(self._file('job_ids.npy'), mmap_mode='r')
+        if job_ids.size != meta["count"]:
+            raise ValueError(f"the manifest lists {meta['count']} vectors but the ID map has {job_ids.size} entries")
+        engine = VectorSearchEngine.from_files(self._file('job_index.faiss'), job_ids,
+                                               self._file('job_index_ann.faiss') if has_ann else None, compact)
+
+        self.job_ids = job_ids
+        self.faiss_index = engine.index if engine.index is not None else engine.ann_index
+        self.vector_search_engine = engine
+        if meta.get("shards"):
+            # Shards only make filtered searches cheaper; the global index serves without them.
+            try:
+                self.vector_shards = ShardedSearch.load(self._file('shards'), meta["shards"], job_ids,
+                                                        has_ann, compact)
+            except Exception as e:
+                print(f"WARNING (artifacts): Could not load the vector shards of bundle {self.version}: {e}")
+        if os.path.isdir(self._file('attributes')):
+            self.job_attribute_index = JobAttributeIndex.load(self._file('attributes'), job_ids)
+        if os.path.isdir(self._file('skills')):
+            self.job_skill_matrix = JobSkillMatrix.load(self._file('skills'), job_ids)
+
+    def _load_tfidf(self):
+        meta = self.component(TFIDF)
+        job_ids = np.load(self._file('tfidf_job_ids.npy'), mmap_mode='r')
+        matrix = sparse.csr_matrix(
+            (np.load(self._file('tfidf_data.npy'), mmap_mode='r'),
+             np.load(self._file('tfidf_indices.npy'), mmap_mode='r'),
+             np.load(self._file('tfidf_indptr.npy'), mmap_mode='r')),
+            shape=(job_ids.size, meta["vocabulary_size"]),
+        )
+        self.tfidf_vectorizer = joblib.load(self._file('tfidf_vectorizer.joblib'))
+        # Rows are normalized before they are written, so the mmapped matrix is used as is.
+        self.relevance_engine = RelevanceEngine(self.tfidf_vectorizer, matrix, job_ids, normalized=True)
+
+
+def load_live_vectors(artifacts_dir: str = ARTIFACTS_DIR, mmap: bool = False) -> dict | None:
+    """
+    The live "vectors" component, read fully into memory so a build can modify
+    it (incremental embedding), or memory-mapped read-only with `mmap` so a
+    streaming build can copy unchanged vectors out of it.
+    Returns None if there is nothing to build on.
+    """
+    version = current_version(artifacts_dir)
+    if version is None:
+        return None
+    path = os.path.join(artifacts_dir, version)
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        meta = json.load(f)["components"].get(VECTORS)
+    if meta is None or 'content_hashes.npy' not in meta["files"]:
+        return None
+    return {
+        "version": version,
+        "meta": meta,
+        "index": (read_index_mmap if mmap else faiss.read_index)(os.path.join(path, 'job_index.faiss')),
+        "job_ids": np.load(os.path.join(path, 'job_ids.npy'), mmap_mode='r' if mmap else None),
+        "content_hashes": np.load(os.path.join(path, 'content_hashes.npy'), mmap_mode='r' if mmap else None),
+    }
+
+
+_bundle = None
+_bundle_lock = threading.Lock()
+# What the status endpoint reports about the bundle this process serves.
+_status = {"loaded_at": None, "last_checked_at": None, "last_error": None, "failed_version": None, "reloads": 0}
+
+
+def _is_usable(bundle: ArtifactBundle) -> bool:
+    """A bundle is only swapped in if every component its manifest lists actually loaded."""
+    if bundle.component(VECTORS) and bundle.vector_search_engine is None:
+        return False
+    if bundle.component(TFIDF) and bundle.relevance_engine is None:
+        return False
+    return True
+
+
+def get_artifacts() -> ArtifactBundle:
+    """
+    The process-wide artifact bundle, loaded from the CURRENT version on first use.
+    Returns an empty bundle (every component None) if nothing has been published.
+
+    Callers should fetch it once per request and use that object throughout:
+    a reload replaces the process-wide reference, but a request holding the old
+    bundle keeps working on it until it finishes.
+    """
+    global _bundle
+    _ensure_reloader()
+    if _bundle is None:
+        with _bundle_lock:
+            if _bundle is None:
+                version = current_version()
+                if version is None:
+                    print("CRITICAL WARNING (artifacts): No artifact bundle published yet. "
+                          "Run embed_jobs.py and precompute_tfidf.py.")
+                    _bundle = ArtifactBundle()
+                else:
+                    with timed("artifacts"):
+                        _bundle = ArtifactBundle.load(version)
+                    print(f"Artifact bundle {version} loaded.")
+                _status["loaded_at"] = _now_iso()
+    return _bundle
+
+
+# --- 2. HOT RELOAD ---
+# A daemon thread polls the CURRENT pointer. Threads don't survive fork(), so
+# the reloader is (re)started lazily in whichever process calls get_artifacts().
+ARTIFACT_RELOAD_INTERVAL = float(os.getenv('ARTIFACT_RELOAD_INTERVAL', 30))
+_reloader_pid = None
+_reloader_enabled = False
+_reload_lock = threading.Lock()
+
+
+def reload_artifacts() -> bool:
+    """
+    Loads the CURRENT version if it differs from the one being served and swaps
+    it in. The new bundle is loaded before the swap, so requests never wait on
+    it; if it fails to load, the old bundle stays in service.
+    Returns True if a new version was swapped in.
+    """
+    global _bundle
+    with _reload_lock:
+        _status["last_checked_at"] = _now_iso()
+        version = current_version()
+        served = _bundle.version if _bundle is not None else None
+        # A version that failed to load is not retried until a newer one is published.
+        if version is None or version in (served, _status["failed_version"]):
+            return False
+
+        try:
+            candidate = ArtifactBundle.load(version)
+        except Exception as e:
+            candidate, error = None, str(e)
+        else:
+            error = None if _is_usable(candidate) else "one or more components failed to load"
+        if error:
+            _status["last_error"] = f"{version}: {error}"
+            _status["failed_version"] = version
+            print(f"WARNING (artifacts): Keeping bundle {served}; could not load {version}: {error}")
+            return False
+
+        # A single reference assignment: requests that already hold the old bundle
+        # finish on it, and it is freed (and its files unmapped) after the last one.
+        with _bundle_lock:
+            _bundle = candidate
+            _status["loaded_at"] = _now_iso()
+            _status["last_error"] = None
+            _status["failed_version"] = None
+            _status["reloads"] += 1
+        print(f"Artifact bundle {served} -> {version} swapped in.")
+        return True
+
+
+def artifact_status() -> dict:
+    """The served version and its components, for the status endpoint."""
+    bundle = _bundle
+    return {
+        "active_version": bundle.version if bundle is not None else None,
+        "published_version": current_version(),
+        "components": {
+            name: {key: meta.get(key) for key in ("built_at", "built_in", "count")}
+            for name, meta in (bundle.manifest["components"].items() if bundle is not None else [])
+        },
+        "reload_interval_seconds": ARTIFACT_RELOAD_INTERVAL,
+        **_status,
+    }
+
+
+def start_artifact_reloader():
+    """Enables background reloading for this process (and any worker forked from it)."""
+    global _reloader_enabled
+    _reloader_enabled = ARTIFACT_RELOAD_INTERVAL > 0
+    _ensure_reloader()
+
+
+def _ensure_reloader():
+    global _reloader_pid
+    if not _reloader_enabled or _reloader_pid == os.getpid():
+        return
+    with _bundle_lock:
+        if _reloader_pid == os.getpid():
+            return
+        _reloader_pid = os.getpid()
+    threading.Thread(target=_reload_loop, name="artifact-reloader", daemon=True).start()
+
+
+def _reload_loop():
+    while True:
+        time.sleep(ARTIFACT_RELOAD_INTERVAL)
+        try:
+            reload_artifacts()
+        except Exception as e:
+            _status["last_error"] = str(e)
+            print(f"WARNING (artifacts): Reload check failed: {e}")
+
+
+# --- 3. PUBLISHING ---
+@contextmanager
+def _publish_lock(artifacts_dir: str):
+    """Serializes publishers (e.g. embed_jobs.py and precompute_tfidf.py running at once)."""
+    with open(os.path.join(artifacts_dir, '.publish.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class StaleBundleError(RuntimeError):
+    """A component this build derived from the base version was republished before it could publish."""
+
+
+def _link_or_copy(src: str, dst: str):
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class BundleWriter:
+    """
+    Stages the components produced by one build and publishes them as a new version.
+
+        writer = BundleWriter()
+        writer.add_vectors(index, job_ids, attributes, skill_matrix, embedding_model=...)
+        version = writer.publish()
+
+    `base_version` is the live version the staged components were derived
+    from (e.g. the bundle compact_artifacts.py pruned). `publish()` then
+    refuses to replace a component that has been republished since, instead
+    of silently reverting it; the caller rebuilds from the new version.
+    """
+
+    def __init__(self, artifacts_dir: str = ARTIFACTS_DIR, base_version: str | None = None):
+        self.artifacts_dir = artifacts_dir
+        self.base_version = base_version
+        self.version = _new_version()
+        self.staging = os.path.join(artifacts_dir, f".staging-{self.version}")
+        os.makedirs(self.staging)
+        self.components = {}
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.staging, name)
+
+    def add_vectors(self, index, job_ids, attributes: JobAttributeIndex | None = None,
+                    skill_matrix: JobSkillMatrix | None = None, content_hashes=None,
+                    index_type: str = VECTOR_INDEX_TYPE, storage: str = VECTOR_STORAGE,
+                    shards: str = VECTOR_SHARDS, **metadata):
+        """
+        The FAISS index with the job ID of every row, plus the arrays aligned with it.
+        `index` may also be the path of an index file that is already written
+        (a streaming build); it is moved into the bundle instead of rewritten.
+        `content_hashes` (one uint64 per row) lets the next build skip unchanged jobs.
+        With an `index_type` other than "flat", or a compact `storage`, the
+        index searches use is built from the same vectors and stored next to
+        the exact one; when the live bundle has one of the same kind it is
+        updated instead where possible (services/ann_index.py). `shards` =
+        "category" also writes one shard per category
+        (services/vector_shards.py), carrying over or updating the live
+        bundle's shards the same way; it needs `attributes`.
+        """
+        job_ids = np.asarray(job_ids, dtype=np.int64)
+        if isinstance(index, str):
+            shutil.move(index, self._file('job_index.faiss'))
+            index = read_index_mmap(self._file('job_index.faiss'))
+        if index.ntotal != job_ids.size:
+            raise ValueError(f"index has {index.ntotal} vectors but {job_ids.size} job IDs were given")
+        np.save(self._file('job_ids.npy'), job_ids)
+        if not os.path.exists(self._file('job_index.faiss')):
+            faiss.write_index(index, self._file('job_index.faiss'))
+        files = ['job_ids.npy', 'job_index.faiss']
+        if content_hashes is not None:
+            np.save(self._file('content_hashes.npy'), np.asarray(content_hashes, dtype=np.uint64))
+            files.append('content_hashes.npy')
+        if attributes is not None:
+            files += attributes.save(self._file('attributes'))
+        if skill_matrix is not None:
+            files += skill_matrix.save(self._file('skills'))
+        live = self._reusable_live_vectors(content_hashes, index_type, storage, metadata)
+        updated = self._update_live_ann_index(index, job_ids, content_hashes, live)
+        ann_index, ann_meta = updated or build_ann_index(index, index_type, storage)
+        if ann_index is not None:
+            faiss.write_index(ann_index, self._file('job_index_ann.faiss'))
+            files.append('job_index_ann.faiss')
+        shards_meta = None
+        if shards == 'category':
+            if attributes is None:
+                print("WARNING (artifacts): Category shards need the job attributes; publishing without shards.")
+            else:
+                shard_files, shards_meta = build_shards(index, job_ids, attributes.category_ids, self._file('shards'),
+                                                        index_type, storage, content_hashes, live)
+                files += shard_files
+
+        self.components[VECTORS] = {
+            "built_at": _now_iso(),
+            "built_in": self.version,
+            "count": int(job_ids.size),
+            "dimension": int(index.d),
+            "index_type": type(index).__name__,
+            "ann_index": ann_meta,
+            "shards": shards_meta,
+            "files": files,
+            **metadata,
+        }
+
+    def _reusable_live_vectors(self, content_hashes, index_type: str, storage: str, metadata: dict) -> dict | None:
+        """
+        The live "vectors" component, if its search index and shards can be
+        updated to this build instead of rebuilt: same embedding model, index
+        type and storage, with content hashes on both sides. Otherwise None.
+        """
+        if content_hashes is None or metadata.get("build_mode") == "full":
+            return None
+        version = self.base_version or current_version(self.artifacts_dir)
+        if version is None:
+            return None
+        # The update is a diff against this version, so publish() must find it still live.
+        self.base_version = version
+        path = os.path.join(self.artifacts_dir, version)
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            live = json.load(f)["components"].get(VECTORS)
+        if live is None or live.get("embedding_model") != metadata.get("embedding_model") or \
+                'content_hashes.npy' not in live["files"]:
+            return None
+        live_ann = live.get("ann_index") or {}
+        if live_ann.get("type") != index_type or live_ann.get("storage") != storage:
+            return None
+        return {
+            "path": path,
+            "meta": live,
+            "job_ids": np.load(os.path.join(path, 'job_ids.npy'), mmap_mode='r'),
+            "content_hashes": np.load(os.path.join(path, 'content_hashes.npy'), mmap_mode='r'),
+        }
+
+    def _update_live_ann_index(self, index, job_ids: np.ndarray, content_hashes, live: dict | None):
+        """
+        The live bundle's approximate index updated to `index` (see
+        `update_ann_index`), or None if there is none of this kind to update.
+        Rows are matched by job ID and content hash, so changed jobs count as new.
+        """
+        if live is None or 'job_index_ann.faiss' not in live["meta"]["files"]:
+            return None
+        source_rows = unchanged_rows(live["job_ids"], live["content_hashes"], job_ids, content_hashes)
+        live_ann = live["meta"]["ann_index"]
+        try:
+            return update_ann_index(faiss.read_index(os.path.join(live["path"], 'job_index_ann.faiss')), live_ann,
+                                    source_rows, index)
+        except Exception as e:
+            print(f"WARNING (artifacts): Could not update the live {live_ann['type']} index, rebuilding it: {e}")
+            return None
+
+    def add_tfidf(self, vectorizer, matrix, job_ids):
+        """The fitted vectorizer and its L2-normalized CSR matrix, one row per job."""
+        from sklearn.preprocessing import normalize
+        matrix = normalize(sparse.csr_matrix(matrix, dtype=np.float32), norm='l2')
+        matrix.sort_indices()
+        np.save(self._file('tfidf_job_ids.npy'), np.asarray(job_ids, dtype=np.int64))
+        np.save(self._file('tfidf_data.npy'), matrix.data)
+        np.save(self._file('tfidf_indices.npy'), matrix.indices)
+        np.save(self._file('tfidf_indptr.npy'), matrix.indptr)
+        joblib.dump(vectorizer, self._file('tfidf_vectorizer.joblib'))
+
+        self.components[TFIDF] = {
+            "built_at": _now_iso(),
+            "built_in": self.version,
+            "count": int(matrix.shape[0]),
+            "vocabulary_size": int(matrix.shape[1]),
+            "files": ['tfidf_job_ids.npy', 'tfidf_data.npy', 'tfidf_indices.npy',
+                      'tfidf_indptr.npy', 'tfidf_vectorizer.joblib'],
+        }
+
+    def publish(self) -> str:
+        """
+        Completes the bundle with the live version's other components, moves it
+        into place and points CURRENT at it. Returns the new version.
+        Raises StaleBundleError if a staged component was republished after
+        `base_version`; the staging directory is left for `abort()`.
+        """
+        with _publish_lock(self.artifacts_dir):
+            live = current_version(self.artifacts_dir)
+            live_manifest = {"components": {}}
+            if live is not None:
+                live_path = os.path.join(self.artifacts_dir, live)
+                with open(os.path.join(live_path, MANIFEST_NAME)) as f:
+                    live_manifest = json.load(f)
+            self._check_base(live, live_manifest["components"])
+            if live is not None:
+                for name, meta in live_manifest["components"].items():
+                    if name in self.components:
+                        continue
+                    for rel in meta["files"]:
+                        _link_or_copy(os.path.join(live_path, rel), self._file(rel))
+                    self.components[name] = meta
+
+            manifest = {
+                "format": BUNDLE_FORMAT,
+                "version": self.version,
+                "created_at": _now_iso(),
+                "previous_version": live,
+                "components": self.components,
+            }
+            with open(self._file(MANIFEST_NAME), 'w') as f:
+                json.dump(manifest, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.rename(self.staging, os.path.join(self.artifacts_dir, self.version))
+            pointer_tmp = os.path.join(self.artifacts_dir, f".{CURRENT_POINTER}.tmp")
+            with open(pointer_tmp, 'w') as f:
+                f.write(self.version)
+                f.flush()
+                os.fsync(f.fileno())
+            # os.replace is atomic: readers see either the old or the new version, never a mix.
+            os.replace(pointer_tmp, os.path.join(self.artifacts_dir, CURRENT_POINTER))
+        return self.version
+
+    def _check_base(self, live: str | None, live_components: dict):
+        if self.base_version is None or live == self.base_version:
+            return
+        with open(os.path.join(self.artifacts_dir, self.base_version, MANIFEST_NAME)) as f:
+            base_components = json.load(f)["components"]
+        stale = [name for name in self.components
+                 if (live_components.get(name) or {}).get("built_in") != (base_components.get(name) or {}).get("built_in")]
+        if stale:
+            raise StaleBundleError(f"{', '.join(stale)} republished since {self.base_version} (live: {live})")
+
+    def abort(self):
+        shutil.rmtree(self.staging, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    version = current_version()
+    if version is None:
+        print(f"No artifact bundle published in '{os.path.abspath(ARTIFACTS_DIR)}'.")
+    else:
+        with open(os.path.join(ARTIFACTS_DIR, version, MANIFEST_NAME)) as f:
+            print(json.dumps(json.load(f), indent=2))
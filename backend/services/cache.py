@@ -0,0 +1,197 @@
+# services/cache.py
+"""
+Small caching primitives shared by the API services.
+
+`TTLCache` is a thread-safe, bounded LRU cache whose entries also expire after
+a fixed time-to-live. It keeps hit/miss/eviction counters so the API can
+report how well it is doing. Entries are grouped by an "owner" (usually a
+user ID) so that everything cached for one user can be dropped at once when
+their profile changes.
+
+A cache can optionally be backed by Redis (`CACHE_REDIS_URL`), which lets
+several API workers share results and invalidations. The in-process LRU
+always sits in front of it, so every worker holds its own copies; to keep
+them from outliving an invalidation made by another worker, Redis also holds
+a generation counter for the whole cache and one per owner. `clear` and
+`invalidate_owner` bump them, every entry is stamped with the generations it
+was stored under, and a lookup (one MGET) discards entries with older ones.
+"""
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+
+
+class _RedisBackend:
+    """Shared second-level store. Values are pickled; Redis enforces the TTL."""
+
+    def __init__(self, url: str, namespace: str, ttl_seconds: float):
+        import redis  # Optional dependency, only needed when CACHE_REDIS_URL is set.
+        self._client = redis.Redis.from_url(url)
+        self._namespace = namespace
+        self._ttl = max(1, int(ttl_seconds))
+
+    def _key(self, owner, key) -> str:
+        return f"{self._namespace}:{owner}:{key!r}"
+
+    def _generation_keys(self, owner) -> tuple[str, str]:
+        return f"{self._namespace}#generation", f"{self._namespace}#generation:{owner}"
+
+    def generations(self, owner) -> tuple[int, int]:
+        """The (whole cache, owner) generations; entries stamped with older ones are stale."""
+        return tuple(int(raw or 0) for raw in self._client.mget(*self._generation_keys(owner)))
+
+    def get(self, owner, key):
+        """Returns (generations, value) as stored, or None."""
+        raw = self._client.get(self._key(owner, key))
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, owner, key, value, generations: tuple[int, int]):
+        self._client.setex(self._key(owner, key), self._ttl, pickle.dumps((generations, value)))
+
+    def invalidate_owner(self, owner):
+        owner_key = self._generation_keys(owner)[1]
+        # Once the TTL has passed no entry stamped before this bump survives, so the counter may expire.
+        self._client.pipeline().incr(owner_key).expire(owner_key, 2 * self._ttl).execute()
+        keys = list(self._client.scan_iter(match=f"{self._namespace}:{owner}:*"))
+        if keys:
+            self._client.delete(*keys)
+
+    def clear(self):
+        self._client.incr(self._generation_keys(None)[0])
+        keys = list(self._client.scan_iter(match=f"{self._namespace}:*"))
+        if keys:
+            self._client.delete(*keys)
+
+
+class TTLCache:
+    """
+    A bounded LRU cache with per-entry expiry.
+
+    Args:
+        name: Used in log lines, in metrics and as the Redis key namespace.
+        max_entries: Least-recently-used entries are evicted beyond this size.
+        ttl_seconds: Entries older than this are treated as misses.
+        redis_url: Optional Redis URL for a shared second-level store.
+    """
+
+    def __init__(self, name: str, max_entries: int = 1024, ttl_seconds: float = 300, redis_url: str | None = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (owner, key) -> (expires_at, generations, value)
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+        self._shared = None
+        if redis_url:
+            try:
+                self._shared = _RedisBackend(redis_url, f"karbin:{name}", ttl_seconds)
+            except Exception as e:
+                print(f"Warning: {name} cache could not use Redis ({e}); using the in-process cache only.")
+
+    def _generations(self, owner):
+        """The owner's current generations in Redis, or None without a (reachable) shared store."""
+        if self._shared is None:
+            return None
+        try:
+            return self._shared.generations(owner)
+        except Exception as e:
+            print(f"Warning: {self.name} cache Redis generation lookup failed: {e}")
+            return None
+
+    def get(self, owner, key):
+        """Returns the cached value, or None on a miss."""
+        generations = self._generations(owner)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((owner, key))
+            if entry is not None:
+                expires_at, stored_generations, value = entry
+                if expires_at <= now:
+                    del self._entries[(owner, key)]
+                    self._counters["expirations"] += 1
+                elif generations is not None and stored_generations != generations:
+                    # Invalidated by another worker since it was stored here.
+                    del self._entries[(owner, key)]
+                    self._counters["invalidations"] += 1
+                else:
+                    self._entries.move_to_end((owner, key))
+                    self._counters["hits"] += 1
+                    return value
+
+        if generations is not None:
+            try:
+                stored = self._shared.get(owner, key)
+            except Exception as e:
+                print(f"Warning: {self.name} cache Redis lookup failed: {e}")
+                stored = None
+            if isinstance(stored, tuple) and stored[0] == generations:
+                self._store_local(owner, key, stored[1], generations)
+                with self._lock:
+                    self._counters["hits"] += 1
+                return stored[1]
+
+        with self._lock:
+            self._counters["misses"] += 1
+        return None
+
+    def set(self, owner, key, value):
+        generations = self._generations(owner)
+        self._store_local(owner, key, value, generations)
+        if generations is not None:
+            try:
+                self._shared.set(owner, key, value, generations)
+            except Exception as e:
+                print(f"Warning: {self.name} cache Redis write failed: {e}")
+
+    def _store_local(self, owner, key, value, generations=None):
+        with self._lock:
+            self._entries[(owner, key)] = (time.monotonic() + self.ttl_seconds, generations, value)
+            self._entries.move_to_end((owner, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def invalidate_owner(self, owner):
+        """Drops every entry cached for one owner (e.g. after a profile update)."""
+        with self._lock:
+            stale = [k for k in self._entries if k[0] == owner]
+            for k in stale:
+                del self._entries[k]
+            self._counters["invalidations"] += len(stale)
+        if self._shared is not None:
+            try:
+                self._shared.invalidate_owner(owner)
+            except Exception as e:
+                print(f"Warning: {self.name} cache Redis invalidation failed: {e}")
+
+    def clear(self):
+        """Drops everything (e.g. after new recommendation artifacts are published)."""
+        with self._lock:
+            self._counters["invalidations"] += len(self._entries)
+            self._entries.clear()
+        if self._shared is not None:
+            try:
+                self._shared.clear()
+            except Exception as e:
+                print(f"Warning: {self.name} cache Redis clear failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats.update({
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_rate": stats["hits"] / lookups if lookups else 0.0,
+            "shared_backend": self._shared is not None,
+        })
+        return stats
@@ -0,0 +1,260 @@
+# services/db.py
+"""
+Shared PostgreSQL connection pool for the API, the recommendation service,
+the scrapers and the offline scripts.
+
+Every caller used to open its own psycopg2 connection, so a single
+recommendation request paid for five or six TCP + auth handshakes. This module
+keeps a per-process pool of open connections instead. Callers check a
+connection out, use it, and hand it back:
+
+    conn = get_db_connection()
+    try:
+        ...
+    finally:
+        release_db_connection(conn)
+
+or, equivalently, `with db_connection() as conn: ...`.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions, pool
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- 1. CONFIGURATION ---
+# Connections opened when the pool starts. Up to DB_POOL_MAX_SIZE are kept open
+# once created, whatever this is set to.
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 10))
+# How long a caller waits for a free connection before giving up (seconds).
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+# Run a cheap `SELECT 1` on checkout to weed out connections the server dropped.
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'True').lower() == 'true'
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = None
+
+_stats_lock = threading.Lock()
+_stats = {
+    "checkouts": 0,
+    "releases": 0,
+    "connect_failures": 0,
+    "timeouts": 0,
+    "discarded": 0,
+    "connections_opened": 0,
+    "connections_closed": 0,
+    "total_wait_ms": 0.0,
+}
+
+
+def _bump(key: str, amount=1):
+    with _stats_lock:
+        _stats[key] += amount
+
+
+# --- 2. POOL LIFECYCLE ---
+class _CountedConnection(extensions.connection):
+    """A psycopg2 connection that records its opening and closing in the pool stats."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._counted_open = True
+        _bump("connections_opened")
+
+    def close(self):
+        super().close()
+        if self._counted_open:
+            self._counted_open = False
+            _bump("connections_closed")
+
+
+class _KeepAlivePool(pool.ThreadedConnectionPool):
+    """
+    Opens `minconn` connections up front but keeps every returned connection,
+    up to `maxconn`. ThreadedConnectionPool closes a returned connection as
+    soon as `minconn` are idle, so under concurrent load most checkouts would
+    pay for a new TCP + auth handshake.
+    """
+
+    def __init__(self, minconn: int, maxconn: int, *args, **kwargs):
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # Only consulted by putconn from here on: the number of idle connections kept.
+        self.minconn = maxconn
+
+
+def _get_pool():
+    """
+    Returns the process-wide pool, creating it on first use.
+    The pool is re-created after a fork (e.g. gunicorn workers) because
+    psycopg2 connections must never be shared between processes.
+    """
+    global _pool, _pool_pid, _slots
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if _pool_pid is not None and _pool_pid != os.getpid():
+                # Counters inherited from the parent describe the parent's connections.
+                with _stats_lock:
+                    for key in _stats:
+                        _stats[key] = type(_stats[key])()
+            _pool = _KeepAlivePool(
+                min(DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE), DB_POOL_MAX_SIZE,
+                host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
+                dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'),
+                password=os.getenv('DB_PASSWORD'), connection_factory=_CountedConnection
+            )
+            # ThreadedConnectionPool raises instead of blocking when it is
+            # exhausted, so a semaphore makes callers queue for a free slot.
+            _slots = threading.BoundedSemaphore(DB_POOL_MAX_SIZE)
+            _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool():
+    """Closes every pooled connection. Mainly useful at the end of offline scripts."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+
+
+def _is_usable(conn) -> bool:
+    """Health check run on every checkout."""
+    if conn.closed:
+        return False
+    if not DB_POOL_PRE_PING:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        # The ping opened a transaction; end it so the caller starts clean.
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+# --- 3. CHECKOUT / RELEASE ---
+def get_db_connection():
+    """
+    Checks a healthy connection out of the pool.
+
+    Returns:
+        A psycopg2 connection, or None if the database is unreachable or no
+        connection became free within DB_POOL_TIMEOUT seconds. Every non-None
+        connection must be handed back with `release_db_connection`.
+    """
+    try:
+        db_pool = _get_pool()
+    except psycopg2.OperationalError as e:
+        _bump("connect_failures")
+        print(f"Fatal: Could not connect to the database: {e}")
+        return None
+
+    started = time.perf_counter()
+    if not _slots.acquire(timeout=DB_POOL_TIMEOUT):
+        _bump("timeouts")
+        print(f"Database pool exhausted: no connection free after {DB_POOL_TIMEOUT}s.")
+        return None
+    _bump("total_wait_ms", (time.perf_counter() - started) * 1000)
+
+    # A stale connection is discarded and replaced; give up after a few tries
+    # so a database outage doesn't turn into a busy loop.
+    for _ in range(3):
+        try:
+            conn = db_pool.getconn()
+        except (psycopg2.OperationalError, pool.PoolError) as e:
+            _bump("connect_failures")
+            print(f"Fatal: Could not connect to the database: {e}")
+            break
+        if _is_usable(conn):
+            _bump("checkouts")
+            return conn
+        _bump("discarded")
+        db_pool.putconn(conn, close=True)
+
+    _slots.release()
+    return None
+
+
+def release_db_connection(conn, discard: bool = False):
+    """
+    Returns a connection to the pool. Any open transaction is rolled back by
+    the pool, so callers must commit before releasing. Pass `discard=True`
+    for connections that should not be reused (e.g. after a fatal error).
+    """
+    if conn is None:
+        return
+    db_pool = _pool
+    if db_pool is None or _pool_pid != os.getpid():
+        conn.close()
+        return
+    broken = conn.closed or conn.info.transaction_status == extensions.TRANSACTION_STATUS_UNKNOWN
+    try:
+        db_pool.putconn(conn, close=discard or broken)
+    except pool.PoolError:
+        # Not one of ours (or already returned); just close it.
+        conn.close()
+        return
+    _bump("releases")
+    if discard or broken:
+        _bump("discarded")
+    _slots.release()
+
+
+@contextmanager
+def db_connection():
+    """
+    Context-manager form of checkout/release. Yields None when no connection
+    is available, mirroring `get_db_connection`.
+    """
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        release_db_connection(conn)
+
+
+# --- 4. HEALTH & METRICS ---
+def check_db_health() -> bool:
+    """Checks out a connection and runs a trivial query against it."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+            cur.fetchone()
+        return True
+    except psycopg2.Error as e:
+        print(f"Database health check failed: {e}")
+        return False
+    finally:
+        release_db_connection(conn)
+
+
+def get_pool_stats() -> dict:
+    """Returns a snapshot of the pool's size and usage counters."""
+    with _stats_lock:
+        stats = dict(_stats)
+    in_use = stats["checkouts"] - stats["releases"]
+    stats.update({
+        "min_size": DB_POOL_MIN_SIZE,
+        "max_size": DB_POOL_MAX_SIZE,
+        "in_use": in_use,
+        "idle": max(0, stats["connections_opened"] - stats["connections_closed"] - in_use),
+        "avg_wait_ms": stats["total_wait_ms"] / stats["checkouts"] if stats["checkouts"] else 0.0,
+    })
+    return stats
@@ -1,4 +1,11 @@
 import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
 import sib_api_v3_sdk
 from sib_api_v3_sdk.rest import ApiException
 
@@ -10,36 +17,44 @@ api_instance = sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(co
 SENDER_EMAIL = os.getenv('BREVO_SENDER_EMAIL')
 SENDER_NAME = os.getenv('BREVO_SENDER_NAME')
 
-def send_verification_email(recipient_email: str, verification_code: str) -> bool:
-    """
-    Sends a verification email using the Brevo API, now with a Persian template.
+# Dispatch queue: "brevo" sends for real, "stub" only records messages (tests, benchmarks, local dev).
+EMAIL_TRANSPORT = os.getenv('EMAIL_TRANSPORT', 'brevo')
+EMAIL_WORKERS = int(os.getenv('EMAIL_WORKERS', 4))
+EMAIL_QUEUE_SIZE = int(os.getenv('EMAIL_QUEUE_SIZE', 10000))
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', 50))         # message versions per Brevo call
+EMAIL_BATCH_WAIT = float(os.getenv('EMAIL_BATCH_WAIT', 0.2))      # seconds a worker waits to fill a batch
+EMAIL_MAX_RETRIES = int(os.getenv('EMAIL_MAX_RETRIES', 3))
+EMAIL_RETRY_BACKOFF = float(os.getenv('EMAIL_RETRY_BACKOFF', 1.0))
 
-    Returns:
-        bool: True if the email was sent successfully, False otherwise.
-    """
-    # --- REVISED: Persian Subject Line ---
-    subject = f"کاربین | کد تایید ایمیل شما"
-    
-    # --- REVISED: Persian HTML Content with RTL support ---
-    # We add `dir="rtl"` and font styling for a professional look.
-    html_content = f"""
+
+# --- 1. TEMPLATES ---
+# Each template is rendered once, at import. Per-recipient values are Brevo
+# template params ({{ params.x }}), so one provider call can carry many
+# recipients as message versions of the same email.
+
+# --- REVISED: Persian Subject Line ---
+VERIFICATION_SUBJECT = "کاربین | کد تایید ایمیل شما"
+
+# --- REVISED: Persian HTML Content with RTL support ---
+# We add `dir="rtl"` and font styling for a professional look.
+VERIFICATION_HTML = f"""
     <!DOCTYPE html>
     <html lang="fa" dir="rtl">
     <head>
         <meta charset="UTF-8">
         <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>{subject}</title>
+        <title>{VERIFICATION_SUBJECT}</title>
     </head>
     <body style="font-family: 'Vazirmatn', sans-serif; text-align: right; color: #333;">
         <h1>به کاربین خوش آمدید!</h1>
         <p>از ثبت‌نام شما سپاسگزاریم. لطفاً برای تایید آدرس ایمیل خود از کد زیر استفاده کنید:</p>
-        
+
         <div style="background-color: #f2f2f2; border-radius: 8px; padding: 10px 20px; margin: 20px 0;">
             <h2 style="font-size: 28px; letter-spacing: 4px; text-align: center; color: #000; margin: 0;">
-                {verification_code}
+                {{{{ params.code }}}}
             </h2>
         </div>
-        
+
         <p>این کد تا ۱۵ دقیقه دیگر معتبر است.</p>
         <p>اگر شما در کاربین ثبت‌نام نکرده‌اید، می‌توانید این ایمیل را نادیده بگیرید.</p>
         <br>
@@ -47,67 +62,28 @@ def send_verification_email(recipient_email: str, verification_code: str) -> boo
     </body>
     </html>
     """
-    
-    sender = {"name": SENDER_NAME, "email": SENDER_EMAIL}
-    to = [{"email": recipient_email}]
-    
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-        to=to,
-        sender=sender,
-        subject=subject,
-        html_content=html_content
-    )
-
-    try:
-        api_response = api_instance.send_transac_email(send_smtp_email)
-        print(f"Brevo API response: {api_response}")
-        return True
-    except ApiException as e:
-        print(f"Exception when calling Brevo API: {e}\n")
-        return False
-
-# ... (keep the existing send_verification_email function) ...
 
-def send_recommendations_email(recipient_email: str, user_name: str, jobs: list[dict]) -> bool:
-    """
-    Sends a curated list of job recommendations to a user.
-    """
-    subject = f"{user_name} این فرصتهای شغلی مناسب شما هستند."
-
-    # --- Build the HTML for the list of jobs ---
-    jobs_html = ""
-    for job in jobs:
-        reason_data = job.get('reason', {})
-        matched_skills = reason_data.get('matched_skills', [])
-        
-        reason_parts = []
-        if matched_skills:
-            reason_parts.append(f"متناسب با مهارت‌های شما در: {', '.join(matched_skills)}")
-        else:
-            reason_parts.append("شباهت بالا با رزومه شما")
-
-        reason_text = " | ".join(reason_parts)
-
-        jobs_html += f"""
-        <div style="...">
-            <h3 style="...">_build_job_texts_for_reranking</h3>
-            <p style="...">🏢 {job['company_name']}</p>
-            <p style="...">📍 {job.get('city', 'N/A')}</p>
-            <p style="margin: 0 0 15px 0; color: #007bff; font-size: 14px;">✨ {reason_text}</p>
-            <a href="{job['source_link']}" ...>مشاهده جزئیات</a>
-        </div>
-        """
+RECOMMENDATIONS_SUBJECT = "{{ params.user_name }} این فرصتهای شغلی مناسب شما هستند."
 
-    html_content = f"""
+# --- Build the HTML for the list of jobs ---
+RECOMMENDATIONS_HTML = """
     <!DOCTYPE html>
     <html lang="fa" dir="rtl">
     <head><meta charset="UTF-8"></head>
     <body style="font-family: 'Vazirmatn', sans-serif; text-align: right; color: #333; background-color: #f9f9f9; padding: 20px;">
         <div style="max-width: 600px; margin: auto; background-color: #fff; border-radius: 12px; padding: 30px;">
-            <h1>سلام {user_name}</h1>
+            <h1>سلام {{ params.user_name }}</h1>
             <p>بر اساس پروفایل و مهارت‌های شما، این فرصت‌های شغلی جدید را برایتان پیدا کرده‌ایم:</p>
             <hr style="border: 0; border-top: 1px solid #eee; margin: 20px 0;">
-            {jobs_html}
+            {% for job in params.jobs %}
+            <div style="...">
+                <h3 style="...">{{ job.title }}</h3>
+                <p style="...">🏢 {{ job.company_name }}</p>
+                <p style="...">📍 {{ job.city }}</p>
+                <p style="margin: 0 0 15px 0; color: #007bff; font-size: 14px;">✨ {{ job.reason }}</p>
+                <a href="{{ job.source_link }}" ...>مشاهده جزئیات</a>
+            </div>
+            {% endfor %}
             <p style="text-align: center; margin-top: 30px;">
                 <a href="http://localhost:3000/recommendations" target="_blank" style="font-size: 16px;">
                     مشاهده همه پیشنهادات
@@ -117,15 +93,308 @@ def send_recommendations_email(recipient_email: str, user_name: str, jobs: list[
     </body>
     </html>
     """
-    
-    sender = {"name": SENDER_NAME, "email": SENDER_EMAIL}
-    to = [{"email": recipient_email}]
-    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(to=to, sender=sender, subject=subject, html_content=html_content)
 
-    try:
-        api_instance.send_transac_email(send_smtp_email)
-        print(f"Recommendations email sent successfully to {recipient_email}.")
+
+def _job_params(job: dict) -> dict:
+    """The per-job template values, including the human-readable reason."""
+    reason_data = job.get('reason', {})
+    matched_skills = reason_data.get('matched_skills', [])
+
+    reason_parts = []
+    if matched_skills:
+        reason_parts.append(f"متناسب با مهارت‌های شما در: {', '.join(matched_skills)}")
+    else:
+        reason_parts.append("شباهت بالا با رزومه شما")
+
+    return {
+        "title": job.get('title') or "",
+        "company_name": job.get('company_name') or "",
+        "city": job.get('city') or 'N/A',
+        "reason": " | ".join(reason_parts),
+        "source_link": job.get('source_link') or "",
+    }
+
+
+@dataclass
+class EmailMessage:
+    """One recipient's email: a shared template plus that recipient's params."""
+    recipient_email: str
+    subject: str
+    html_content: str
+    params: dict = field(default_factory=dict)
+
+    @property
+    def template_key(self) -> tuple:
+        return (self.subject, self.html_content)
+
+
+def verification_message(recipient_email: str, verification_code: str) -> EmailMessage:
+    return EmailMessage(recipient_email, VERIFICATION_SUBJECT, VERIFICATION_HTML, {"code": verification_code})
+
+
+def recommendations_message(recipient_email: str, user_name: str, jobs: list[dict]) -> EmailMessage:
+    return EmailMessage(recipient_email, RECOMMENDATIONS_SUBJECT, RECOMMENDATIONS_HTML,
+                        {"user_name": user_name, "jobs": [_job_params(job) for job in jobs]})
+
+
+# --- 2. TRANSPORTS ---
+class PermanentEmailError(Exception):
+    """A provider error that retrying won't fix (e.g. an invalid recipient)."""
+
+
+class BrevoTransport:
+    """
+    Sends through Brevo's transactional API. Messages that share a template go
+    out in one call as message versions; a lone message is a plain send.
+    """
+
+    def send(self, messages: list[EmailMessage]) -> int:
+        """Sends messages that all share one template. Returns the number of provider calls."""
+        sender = {"name": SENDER_NAME, "email": SENDER_EMAIL}
+        first = messages[0]
+        if len(messages) == 1:
+            email = sib_api_v3_sdk.SendSmtpEmail(
+                to=[{"email": first.recipient_email}], sender=sender,
+                subject=first.subject, html_content=first.html_content, params=first.params or None,
+            )
+        else:
+            email = sib_api_v3_sdk.SendSmtpEmail(
+                sender=sender, subject=first.subject, html_content=first.html_content,
+                message_versions=[
+                    sib_api_v3_sdk.SendSmtpEmailMessageVersions(
+                        to=[sib_api_v3_sdk.SendSmtpEmailTo1(email=m.recipient_email)], params=m.params or None)
+                    for m in messages
+                ],
+            )
+        try:
+            api_instance.send_transac_email(email)
+        except ApiException as e:
+            # 4xx other than rate limiting means the request itself is wrong.
+            if e.status and 400 <= e.status < 500 and e.status != 429:
+                raise PermanentEmailError(str(e)) from e
+            raise
+        return 1
+
+
+class StubTransport:
+    """
+    Records messages instead of sending them, optionally with a simulated
+    per-call latency and failure rate, for tests and offline benchmarks.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, failure_rate: float = 0.0):
+        self.latency_seconds = latency_seconds
+        self.failure_rate = failure_rate
+        self.sent = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def send(self, messages: list[EmailMessage]) -> int:
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+        with self._lock:
+            self.calls += 1
+            if random.random() < self.failure_rate:
+                raise ConnectionError("stub transport: simulated provider failure")
+            self.sent.extend(messages)
+        return 1
+
+
+def _default_transport():
+    if EMAIL_TRANSPORT == 'stub':
+        return StubTransport()
+    return BrevoTransport()
+
+
+# --- 3. DISPATCH QUEUE ---
+class EmailDispatcher:
+    """
+    A bounded queue drained by a fixed pool of worker threads. Each worker
+    collects up to `batch_size` queued messages (waiting at most `batch_wait`),
+    groups them by template, and sends each group with retries and exponential
+    backoff. `enqueue` returns a Future that resolves to True once the message
+    is accepted by the provider, or False when it finally failed.
+    """
+
+    def __init__(self, transport=None, workers: int = EMAIL_WORKERS, queue_size: int = EMAIL_QUEUE_SIZE,
+                 batch_size: int = EMAIL_BATCH_SIZE, batch_wait: float = EMAIL_BATCH_WAIT,
+                 max_retries: int = EMAIL_MAX_RETRIES, retry_backoff: float = EMAIL_RETRY_BACKOFF):
+        self.transport = transport or _default_transport()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._counters = {"enqueued": 0, "rejected": 0, "sent": 0, "failed": 0,
+                          "retries": 0, "batches": 0, "provider_calls": 0, "send_seconds": 0.0}
+        self._last_batch = None
+        self._workers = [threading.Thread(target=self._run, name=f"email-dispatch-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+
+    def enqueue(self, message: EmailMessage, timeout: float | None = 1.0) -> Future:
+        """Queues a message. The Future resolves to False at once if the queue stays full."""
+        future = Future()
+        try:
+            self._queue.put((message, future), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._counters["rejected"] += 1
+            print(f"Warning: Email queue is full; dropping email to {message.recipient_email}.")
+            future.set_result(False)
+            return future
+        with self._lock:
+            self._counters["enqueued"] += 1
+        return future
+
+    def flush(self, timeout: float | None = None):
+        """Blocks until every queued message has been handled."""
+        if timeout is None:
+            self._queue.join()
+            return True
+        # Queue.join() has no timeout; wait on the condition it uses instead.
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
         return True
-    except ApiException as e:
-        print(f"Exception when calling Brevo API: {e}\n")
-        return False
\ No newline at end of file
+
+    def _next_batch(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._send_batch(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _send_batch(self, batch: list):
+        started = time.monotonic()
+        groups = {}
+        for message, future in batch:
+            groups.setdefault(message.template_key, []).append((message, future))
+
+        calls, retries, sent, failed = 0, 0, 0, 0
+        for items in groups.values():
+            results, group_calls, group_retries = self._deliver([message for message, _ in items])
+            for (_, future), ok in zip(items, results):
+                future.set_result(ok)
+            calls += group_calls
+            retries += group_retries
+            sent += sum(results)
+            failed += len(results) - sum(results)
+
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self._counters["batches"] += 1
+            self._counters["provider_calls"] += calls
+            self._counters["retries"] += retries
+            self._counters["sent"] += sent
+            self._counters["failed"] += failed
+            self._counters["send_seconds"] += elapsed
+            self._last_batch = {"messages": len(batch), "templates": len(groups), "provider_calls": calls,
+                                "retries": retries, "sent": sent, "failed": failed, "seconds": round(elapsed, 3)}
+
+    def _deliver(self, messages: list) -> tuple[list[bool], int, int]:
+        """
+        Sends messages sharing one template, with retries. Returns whether each
+        was accepted, plus the provider calls and retries spent. A permanent
+        error on several messages (one bad recipient rejects the whole call) is
+        bisected, so only the offending recipients fail.
+        """
+        calls, retries = 0, 0
+        for attempt in range(self.max_retries + 1):
+            try:
+                calls += self.transport.send(messages)
+                return [True] * len(messages), calls, retries
+            except PermanentEmailError as e:
+                if len(messages) == 1:
+                    print(f"Exception when calling Brevo API for {messages[0].recipient_email}: {e}\n")
+                    return [False], calls, retries
+                middle = len(messages) // 2
+                results = []
+                for half in (messages[:middle], messages[middle:]):
+                    half_results, half_calls, half_retries = self._deliver(half)
+                    results += half_results
+                    calls += half_calls
+                    retries += half_retries
+                return results, calls, retries
+            except Exception as e:
+                if attempt == self.max_retries:
+                    print(f"Exception when calling Brevo API (giving up after {attempt + 1} attempts): {e}\n")
+                    break
+                retries += 1
+                # Exponential backoff with jitter, so workers don't retry in lockstep.
+                time.sleep(self.retry_backoff * (2 ** attempt) * (0.5 + random.random()))
+        return [False] * len(messages), calls, retries
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["last_batch"] = self._last_batch
+        stats["queued"] = self._queue.qsize()
+        stats["avg_batch_seconds"] = stats["send_seconds"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_email_dispatcher() -> EmailDispatcher:
+    """The process-wide dispatcher, started on first use."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = EmailDispatcher()
+    return _dispatcher
+
+
+# --- 4. PUBLIC API ---
+def queue_verification_email(recipient_email: str, verification_code: str) -> Future:
+    """Queues a verification email; the request handler doesn't wait for the provider."""
+    return get_email_dispatcher().enqueue(verification_message(recipient_email, verification_code))
+
+
+def queue_recommendations_email(recipient_email: str, user_name: str, jobs: list[dict]) -> Future:
+    """Queues a curated list of job recommendations for a user."""
+    return get_email_dispatcher().enqueue(recommendations_message(recipient_email, user_name, jobs))
+
+
+def send_verification_email(recipient_email: str, verification_code: str) -> bool:
+    """
+    Sends a verification email using the Brevo API, now with a Persian template.
+
+    Returns:
+        bool: True if the email was sent successfully, False otherwise.
+    """
+    return queue_verification_email(recipient_email, verification_code).result()
+
+
+def send_recommendations_email(recipient_email: str, user_name: str, jobs: list[dict]) -> bool:
+    """
+    Sends a curated list of job recommendations to a user.
+    """
+    success = queue_recommendations_email(recipient_email, user_name, jobs).result()
+    if success:
+        print(f"Recommendations email sent successfully to {recipient_email}.")
+    return success
@@ -0,0 +1,96 @@
+# services/embedding_pool.py
+"""
+Multi-process embedding for offline indexing (embed_jobs.py --workers N).
+
+A single process leaves most cores of a build machine idle: PyTorch's
+intra-op parallelism stops scaling long before 32 threads on a model this
+small. `EmbeddingPool` starts N worker processes, each loading its own
+model with its thread count pinned to its share of the cores, and fans
+chunks of texts out to them through `embed_texts`. Results are gathered in
+submission order, so row i of the output is always the embedding of text i
+and the job-ID map stays aligned.
+
+Workers are started with "spawn": forking a process that has already
+initialized torch's thread pools can deadlock.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Worker processes used by embed_jobs.py (1 = embed in the calling process).
+EMBED_WORKERS = int(os.getenv('EMBED_WORKERS', 1))
+# Threads per worker; 0 splits the machine's cores evenly between the workers.
+EMBED_THREADS_PER_WORKER = int(os.getenv('EMBED_THREADS_PER_WORKER', 0))
+# Texts per task sent to a worker.
+EMBED_POOL_CHUNK_SIZE = int(os.getenv('EMBED_POOL_CHUNK_SIZE', 256))
+
+_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'ONNX_NUM_THREADS')
+
+
+def _init_worker(threads: int):
+    """Pins the worker's thread pools and loads its model before the first task arrives."""
+    # The thread pools read these when torch / onnxruntime are first imported.
+    for name in _THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    # Each worker holds its own model; it must not forward to a shared embedding server.
+    # (An empty value rather than none, so load_dotenv doesn't fill it back in.)
+    os.environ['EMBEDDING_SERVER_ADDRESS'] = ''
+
+    # Spawned workers re-import the parent's __main__ (embed_jobs.py) before this runs, so
+    # the modules below may already have read the environment; override their settings too.
+    from services import embedding_service, onnx_backend
+    onnx_backend.ONNX_NUM_THREADS = threads
+    embedding_service._client = None
+
+    from services.embedding_service import EMBEDDING_BACKEND, get_model
+    if EMBEDDING_BACKEND == 'torch':
+        import torch
+        torch.set_num_threads(threads)
+        torch.set_num_interop_threads(1)
+    get_model()
+
+
+def _embed_chunk(texts: list[str]) -> np.ndarray:
+    from services.embedding_service import embed_texts
+    return np.ascontiguousarray(embed_texts(texts), dtype=np.float32)
+
+
+class EmbeddingPool:
+    """A pool of embedding worker processes; use it as a context manager or call close()."""
+
+    def __init__(self, workers: int = EMBED_WORKERS, threads_per_worker: int = EMBED_THREADS_PER_WORKER,
+                 chunk_size: int = EMBED_POOL_CHUNK_SIZE):
+        self.workers = max(1, workers)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.chunk_size = chunk_size
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'),
+                                             initializer=_init_worker, initargs=(self.threads_per_worker,))
+        print(f"Embedding pool: {self.workers} worker processes x {self.threads_per_worker} threads.")
+
+    def warm_up(self):
+        """Waits until every worker has started and loaded its model."""
+        list(self._executor.map(_embed_chunk, [["warm-up"]] * self.workers))
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """Same result as embed_texts(texts), computed across the worker processes."""
+        if not texts:
+            from services.embedding_service import embed_texts
+            return embed_texts(texts)
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+        # Executor.map yields results in the order of `chunks`, whichever worker finishes first.
+        return np.vstack(list(self._executor.map(_embed_chunk, chunks)))
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,296 @@
+# services/embedding_server.py
+"""
+A shared embedding server for every API worker on a machine.
+
+Without it each worker process loads its own copy of the SentenceTransformer
+(hundreds of MB each) and runs `encode` on batches of one. The server loads
+the model once and listens on a Unix socket or a localhost TCP port.
+Requests that arrive while the model is busy, or within
+EMBEDDING_SERVER_MAX_WAIT_MS of each other, are encoded together as one
+micro-batch (up to EMBEDDING_SERVER_MAX_BATCH texts). The client sends at
+most EMBEDDING_SERVER_MAX_BATCH texts per request, so the socket timeout
+bounds one micro-batch rather than a whole bulk call; the server splits any
+larger request itself and encodes its pieces only when no request of the
+normal size is waiting, so a bulk caller never holds up the API workers.
+Offline jobs (embed_jobs.py) don't use the server at all.
+
+`embed_texts` in services/embedding_service.py uses the server when
+EMBEDDING_SERVER_ADDRESS is set and falls back to in-process inference when
+the server is unreachable or serves a different model version.
+
+Run it from the backend directory:
+    python -m services.embedding_server
+
+Wire format (both directions): a 4-byte big-endian length, then the payload.
+A request is JSON {"texts": [...], "model_version": "..."}; a response is
+JSON {"shape": [n, dim]} followed by a second frame with the float32 matrix,
+or JSON {"error": "..."}.
+"""
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# "unix:/path/to.sock" or "host:port". Unset means in-process inference.
+EMBEDDING_SERVER_ADDRESS = os.getenv('EMBEDDING_SERVER_ADDRESS')
+EMBEDDING_SERVER_MAX_BATCH = int(os.getenv('EMBEDDING_SERVER_MAX_BATCH', 64))
+EMBEDDING_SERVER_MAX_WAIT_MS = float(os.getenv('EMBEDDING_SERVER_MAX_WAIT_MS', 5))
+EMBEDDING_SERVER_TIMEOUT = float(os.getenv('EMBEDDING_SERVER_TIMEOUT', 10))
+
+_LENGTH = struct.Struct('>I')
+
+
+# --- 1. FRAMING ---
+def _send_frame(sock, payload: bytes):
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+def _recv_exact(sock, n: int) -> bytes:
+    chunks = []
+    while n:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("embedding server connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_frame(sock) -> bytes:
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    return _recv_exact(sock, length)
+
+
+def _parse_address(address: str):
+    """Returns (socket family, address) for "unix:/path" or "host:port"."""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+
+# --- 2. SERVER ---
+class MicroBatcher:
+    """
+    Collects texts from concurrent requests and encodes them together.
+    A batch is closed when it holds `max_batch` texts or `max_wait_ms` have
+    passed since its first request arrived, whichever comes first.
+    """
+
+    def __init__(self, encode, max_batch: int = EMBEDDING_SERVER_MAX_BATCH,
+                 max_wait_ms: float = EMBEDDING_SERVER_MAX_WAIT_MS):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        # (priority, sequence, texts, future): pieces of oversized requests yield to normal ones.
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "texts": 0, "batches": 0, "encode_seconds": 0.0}
+        threading.Thread(target=self._run, name="embedding-batcher", daemon=True).start()
+
+    def submit(self, texts: list[str]) -> Future:
+        if len(texts) <= self.max_batch:
+            future = Future()
+            self._queue.put((0, next(self._sequence), texts, future))
+            return future
+        pieces = []
+        for start in range(0, len(texts), self.max_batch):
+            pieces.append(Future())
+            self._queue.put((1, next(self._sequence), texts[start:start + self.max_batch], pieces[-1]))
+        future = Future()
+
+        def gather(_):
+            if future.done() or not all(piece.done() for piece in pieces):
+                return
+            errors = [piece.exception() for piece in pieces if piece.exception() is not None]
+            if errors:
+                future.set_exception(errors[0])
+            else:
+                future.set_result(np.vstack([piece.result() for piece in pieces]))
+
+        for piece in pieces:
+            piece.add_done_callback(gather)
+        return future
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()[2:]]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)[2:]
+                except queue.Empty:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            started = time.perf_counter()
+            try:
+                vectors = np.asarray(self.encode(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - started
+
+            offset = 0
+            for request_texts, future in pending:
+                future.set_result(vectors[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+            with self._stats_lock:
+                self._stats["requests"] += len(pending)
+                self._stats["texts"] += len(texts)
+                self._stats["batches"] += 1
+                self._stats["encode_seconds"] += elapsed
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["avg_batch_texts"] = stats["texts"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    """One client connection; serves requests until the client disconnects."""
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                request = json.loads(_recv_frame(self.request))
+            except (ConnectionError, OSError):
+                return
+            try:
+                if request.get("op") == "stats":
+                    _send_frame(self.request, json.dumps(server.batcher.stats()).encode())
+                    continue
+                if request.get("model_version") != server.model_version:
+                    raise ValueError(f"server runs {server.model_version}, client expects {request.get('model_version')}")
+                vectors = server.batcher.submit(request["texts"]).result()
+            except Exception as e:
+                _send_frame(self.request, json.dumps({"error": str(e)}).encode())
+                continue
+            _send_frame(self.request, json.dumps({"shape": list(vectors.shape)}).encode())
+            _send_frame(self.request, np.ascontiguousarray(vectors).tobytes())
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    # Every API worker thread holds a connection; the default backlog of 5 refuses bursts.
+    request_queue_size = 128
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def make_server(address: str, encode, model_version: str, max_batch: int = EMBEDDING_SERVER_MAX_BATCH,
+                max_wait_ms: float = EMBEDDING_SERVER_MAX_WAIT_MS):
+    """Builds (but doesn't start) a server that embeds with `encode`."""
+    family, bind_address = _parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(bind_address):
+            os.remove(bind_address)
+        server = _UnixServer(bind_address, _Handler)
+    else:
+        server = _TCPServer(bind_address, _Handler)
+    server.batcher = MicroBatcher(encode, max_batch, max_wait_ms)
+    server.model_version = model_version
+    return server
+
+
+# --- 3. CLIENT ---
+class EmbeddingClient:
+    """A connection per thread to the embedding server; reconnects after errors."""
+
+    def __init__(self, address: str, model_version: str, timeout: float = EMBEDDING_SERVER_TIMEOUT,
+                 max_batch: int = EMBEDDING_SERVER_MAX_BATCH):
+        self.family, self.address = _parse_address(address)
+        self.model_version = model_version
+        self.timeout = timeout
+        self.max_batch = max_batch
+        self._local = threading.local()
+
+    def _socket(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(self.family, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            self._local.sock = sock
+        return sock
+
+    def _close(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+    def _request(self, payload: dict) -> tuple[dict, socket.socket]:
+        try:
+            sock = self._socket()
+            _send_frame(sock, json.dumps(payload).encode())
+            header = json.loads(_recv_frame(sock))
+        except (OSError, ConnectionError, ValueError):
+            self._close()
+            raise
+        if "error" in header:
+            raise RuntimeError(f"embedding server: {header['error']}")
+        return header, sock
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        # One request per micro-batch, so `timeout` never has to cover a whole bulk call.
+        if len(texts) > self.max_batch:
+            return np.vstack([self._embed(texts[start:start + self.max_batch])
+                              for start in range(0, len(texts), self.max_batch)])
+        return self._embed(texts)
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        header, sock = self._request({"texts": texts, "model_version": self.model_version})
+        try:
+            data = _recv_frame(sock)
+        except (OSError, ConnectionError):
+            self._close()
+            raise
+        return np.frombuffer(data, dtype=np.float32).reshape(header["shape"])
+
+    def stats(self) -> dict:
+        header, _ = self._request({"op": "stats"})
+        return header
+
+
+if __name__ == "__main__":
+    from services.embedding_service import EMBEDDING_MODEL_VERSION, get_model
+
+    if not EMBEDDING_SERVER_ADDRESS:
+        raise SystemExit("Set EMBEDDING_SERVER_ADDRESS (e.g. unix:/tmp/karbin-embeddings.sock or 127.0.0.1:8765).")
+    model = get_model()
+    server = make_server(EMBEDDING_SERVER_ADDRESS, lambda texts: model.encode(texts, convert_to_numpy=True),
+                         EMBEDDING_MODEL_VERSION)
+    print(f"Embedding server ({EMBEDDING_MODEL_VERSION}) listening on {EMBEDDING_SERVER_ADDRESS}, "
+          f"micro-batches of up to {EMBEDDING_SERVER_MAX_BATCH} texts / {EMBEDDING_SERVER_MAX_WAIT_MS}ms.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
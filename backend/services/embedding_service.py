@@ -1,21 +1,79 @@
 
 # services/embedding_service.py
 import re
+import threading
+import time
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+from services.onnx_backend import BACKEND_TAG, use_onnx, load_sentence_encoder
+from services.embedding_server import EMBEDDING_SERVER_ADDRESS, EmbeddingClient
+from services.startup import timed
 
 # --- 1. MODEL INITIALIZATION ---
-# This is the multilingual model you chose. It's loaded only ONCE when the module
-# is first imported, making subsequent calls very fast.
-# The 'mps' device is for Apple Silicon (M1/M2) Macs. If you're on Windows/Linux,
-# it will automatically fall back to 'cuda' (if you have a GPU) or 'cpu'.
-try:
-    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2', device='mps')
-except Exception:
-    model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+# This is the multilingual model you chose. It's loaded only ONCE per process,
+# on first use (or by the API's background warm-up), so importing this module
+# is cheap and endpoints that never embed anything don't wait for it.
+# SentenceTransformer picks 'cuda' when a GPU is present and 'cpu' otherwise.
+# With INFERENCE_BACKEND=onnx the int8-quantized ONNX export is served instead
+# (services/onnx_backend.py), falling back to PyTorch if it isn't available.
+EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+EMBEDDING_BACKEND = BACKEND_TAG if use_onnx(EMBEDDING_MODEL_NAME) else 'torch'
+# Stored embeddings (the user-embedding cache, the job index) are versioned
+# against this, so vectors from different backends are never mixed.
+EMBEDDING_MODEL_VERSION = EMBEDDING_MODEL_NAME if EMBEDDING_BACKEND == 'torch' else f"{EMBEDDING_MODEL_NAME}@{EMBEDDING_BACKEND}"
 
-print("Embedding model loaded successfully.")
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    """The embedding model, loaded on first call."""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                with timed("embedding_model"):
+                    if EMBEDDING_BACKEND == BACKEND_TAG:
+                        _model = load_sentence_encoder(EMBEDDING_MODEL_NAME)
+                    else:
+                        from sentence_transformers import SentenceTransformer
+                        _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+                print(f"Embedding model loaded successfully ({EMBEDDING_BACKEND}).")
+    return _model
+
+# With EMBEDDING_SERVER_ADDRESS set, texts are embedded by the shared embedding
+# server (services/embedding_server.py) and this process never loads the model
+# unless the server is unreachable. After a failure the server is skipped for
+# EMBEDDING_SERVER_RETRY_SECONDS before it is tried again. Offline jobs call
+# disable_embedding_server() and always embed in their own process.
+EMBEDDING_SERVER_RETRY_SECONDS = 30
+_client = EmbeddingClient(EMBEDDING_SERVER_ADDRESS, EMBEDDING_MODEL_VERSION) if EMBEDDING_SERVER_ADDRESS else None
+_server_retry_at = 0.0
+
+def _embed_remotely(texts: list[str]) -> np.ndarray | None:
+    global _server_retry_at
+    if _client is None or time.monotonic() < _server_retry_at:
+        return None
+    try:
+        return _client.embed(texts)
+    except Exception as e:
+        _server_retry_at = time.monotonic() + EMBEDDING_SERVER_RETRY_SECONDS
+        print(f"WARNING (embeddings): Embedding server unavailable, using the in-process model: {e}")
+        return None
+
+def disable_embedding_server():
+    """Embeds in this process from now on; for offline jobs, which would monopolize the shared server."""
+    global _client
+    _client = None
+
+def prepare_embeddings():
+    """Makes sure embed_texts can run: pings the server if configured, else loads the model."""
+    if _client is not None:
+        try:
+            _client.stats()
+            print(f"Using the embedding server at {EMBEDDING_SERVER_ADDRESS}.")
+            return
+        except Exception as e:
+            print(f"WARNING (embeddings): Embedding server unavailable, loading the model in-process: {e}")
+    get_model()
 
 # --- 2. PERSIAN TEXT NORMALIZATION ---
 # This function is crucial for cleaning Persian text before embedding.
@@ -50,12 +108,33 @@ def embed_texts(texts: list[str]) -> np.ndarray:
     # Normalize all texts in the list
     normalized_texts = [normalize_persian_text(text) for text in texts]
     
+    if normalized_texts:
+        embeddings = _embed_remotely(normalized_texts)
+        if embeddings is not None:
+            return embeddings
+
     # Generate embeddings. The model handles batching efficiently.
-    embeddings = model.encode(normalized_texts, convert_to_numpy=True)
+    embeddings = get_model().encode(normalized_texts, convert_to_numpy=True)
     return embeddings
 
+def dedupe_texts(texts: list[str]) -> tuple[list[str], np.ndarray]:
+    """
+    Collapses texts that are identical after normalization, so each is embedded once.
+
+    Returns:
+        (distinct normalized texts in first-seen order, an array mapping every
+        input text to its distinct text); `embed_texts(distinct)[inverse]`
+        equals `embed_texts(texts)`.
+    """
+    position = {}
+    inverse = np.fromiter((position.setdefault(normalize_persian_text(text), len(position)) for text in texts),
+                          dtype=np.int64, count=len(texts))
+    return list(position), inverse
+
 # --- 4. DELIVERABLE VERIFICATION (TESTING BLOCK) ---
 if __name__ == "__main__":
+    from sklearn.metrics.pairwise import cosine_similarity
+
     print("\n--- Running Verification for Day 1 Deliverables ---")
 
     # Sample CVs (as planned for Day 3)
@@ -0,0 +1,109 @@
+# services/index_io.py
+"""
+Reading and writing FAISS index files without holding every vector in memory.
+
+`read_index_mmap` memory-maps the vectors of a flat index when the FAISS
+build supports it, so loading a bundle costs page cache instead of heap.
+
+`mmap_flat_id_index` maps the vectors and IDs of such a file as numpy
+arrays without going through FAISS, which compact-storage bundles use for
+exact re-scoring (services/ann_index.py).
+
+`write_flat_id_index` produces the same file `faiss.write_index` writes for
+an `IndexIDMap2(IndexFlatIP)`, but streams the vectors from a raw float32
+file on disk. A streaming build (embed_jobs.py --stream) appends each
+encoded chunk to that file, so its memory stays flat however many jobs
+there are. The written file is read back through FAISS and checked before
+it is used; `write_flat_id_index` raises if this FAISS build lays the file
+out differently.
+"""
+import os
+import shutil
+import struct
+
+import faiss
+import numpy as np
+
+_FOURCC_ID_MAP2 = b'IxM2'
+_FOURCC_FLAT_IP = b'IxFI'
+# The legacy header fields FAISS still writes after d and ntotal.
+_DUMMY = 1 << 20
+_HEADER = struct.Struct('<iqqq?i')
+
+
+def read_index_mmap(path: str):
+    """Reads a FAISS index, memory-mapping its vectors when this FAISS build supports it."""
+    flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', None) or getattr(faiss, 'IO_FLAG_MMAP', None)
+    if flag is not None:
+        try:
+            return faiss.read_index(path, flag)
+        except Exception:
+            pass
+    return faiss.read_index(path)
+
+
+def _header(fourcc: bytes, dimension: int, ntotal: int) -> bytes:
+    return fourcc + _HEADER.pack(dimension, ntotal, _DUMMY, _DUMMY, True, faiss.METRIC_INNER_PRODUCT)
+
+
+def mmap_flat_id_index(path: str) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Read-only (vectors, job_ids) memory maps of an IndexIDMap2(IndexFlatIP)
+    file. Raises ValueError if the file holds any other index type.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(2 * (4 + _HEADER.size) + 8)
+    if len(head) < 2 * (4 + _HEADER.size) + 8 or head[:4] != _FOURCC_ID_MAP2 or \
+            head[4 + _HEADER.size:8 + _HEADER.size] != _FOURCC_FLAT_IP:
+        raise ValueError(f"{path} is not an ID-mapped flat inner-product index")
+    dimension, ntotal = _HEADER.unpack_from(head, 4)[:2]
+    (n_floats,) = struct.unpack_from('<Q', head, 2 * (4 + _HEADER.size))
+    if n_floats != ntotal * dimension:
+        raise ValueError(f"{path}: {n_floats} stored floats for {ntotal}x{dimension} vectors")
+    offset = len(head)
+    vectors = np.memmap(path, dtype=np.float32, mode='r', offset=offset, shape=(ntotal, dimension))
+    offset += n_floats * 4
+    (n_ids,) = struct.unpack('<Q', np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(8,)).tobytes())
+    if n_ids != ntotal:
+        raise ValueError(f"{path}: {n_ids} IDs for {ntotal} vectors")
+    job_ids = np.memmap(path, dtype=np.int64, mode='r', offset=offset + 8, shape=(ntotal,))
+    return vectors, job_ids
+
+
+def write_flat_id_index(path: str, vectors_path: str, job_ids: np.ndarray, dimension: int,
+                        copy_chunk_bytes: int = 64 << 20):
+    """
+    Writes an IndexIDMap2(IndexFlatIP) file whose row i is row i of the raw
+    float32 file `vectors_path` (already L2-normalized) with ID job_ids[i].
+    """
+    job_ids = np.ascontiguousarray(job_ids, dtype=np.int64)
+    ntotal = int(job_ids.size)
+    expected_bytes = ntotal * dimension * 4
+    if os.path.getsize(vectors_path) != expected_bytes:
+        raise ValueError(f"{vectors_path} holds {os.path.getsize(vectors_path)} bytes, expected {expected_bytes}")
+
+    with open(path, 'wb') as out:
+        out.write(_header(_FOURCC_ID_MAP2, dimension, ntotal))
+        out.write(_header(_FOURCC_FLAT_IP, dimension, ntotal))
+        out.write(struct.pack('<Q', ntotal * dimension))
+        with open(vectors_path, 'rb') as vectors:
+            shutil.copyfileobj(vectors, out, copy_chunk_bytes)
+        out.write(struct.pack('<Q', ntotal))
+        out.write(job_ids.tobytes())
+
+    _check_flat_id_index(path, vectors_path, job_ids, dimension)
+
+
+def _check_flat_id_index(path: str, vectors_path: str, job_ids: np.ndarray, dimension: int):
+    """Reads the file back through FAISS and compares IDs and a sample of vectors."""
+    index = read_index_mmap(path)
+    if index.ntotal != job_ids.size or index.d != dimension:
+        raise ValueError(f"{path}: FAISS reads {index.ntotal}x{index.d}, expected {job_ids.size}x{dimension}")
+    if not np.array_equal(faiss.vector_to_array(index.id_map), job_ids):
+        raise ValueError(f"{path}: the ID map FAISS reads back differs from the one written")
+    if job_ids.size:
+        source = np.memmap(vectors_path, dtype=np.float32, mode='r', shape=(job_ids.size, dimension))
+        sample = np.unique(np.linspace(0, job_ids.size - 1, num=min(16, job_ids.size)).astype(np.int64))
+        stored = np.stack([faiss.downcast_index(index.index).reconstruct(int(row)) for row in sample])
+        if not np.array_equal(stored, source[sample]):
+            raise ValueError(f"{path}: the vectors FAISS reads back differ from the ones written")
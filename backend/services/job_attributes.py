@@ -0,0 +1,140 @@
+# services/job_attributes.py
+"""
+Column store of the job attributes used by the Stage-1 sieve.
+
+`get_filtered_job_ids` used to run a CTE with province, category, experience,
+remote and full-time predicates against Postgres on every request. The same
+attributes are small and change only when new jobs are indexed, so they are
+snapshotted into NumPy arrays aligned with the FAISS row order whenever the
+index is rebuilt. Filtering a user then becomes a handful of vectorized
+comparisons producing a boolean mask over index rows, which feeds straight
+into `VectorSearchEngine.search`.
+
+NULL handling mirrors SQL: a predicate on a NULL column is never true.
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# Tri-state encoding for nullable booleans.
+_TRUE, _FALSE, _NULL = 1, 0, -1
+
+
+def _tri_state(values) -> np.ndarray:
+    return np.array([_NULL if v is None else (_TRUE if v else _FALSE) for v in values], dtype=np.int8)
+
+
+class JobAttributeIndex:
+    """
+    Per-row job attributes, aligned with the job ID map of the vector index.
+    Build it with `build()` (from the database) or `load()` (from disk).
+    """
+
+    def __init__(self, job_ids, province_codes, provinces, category_ids, minimum_experience,
+                 is_remote, is_full_time, is_part_time, scraped_at, is_active):
+        self.job_ids = np.asarray(job_ids, dtype=np.int64)
+        self.province_codes = np.asarray(province_codes, dtype=np.int32)   # -1 = NULL
+        self.provinces = [str(p) for p in provinces]                       # code -> province name
+        self.category_ids = np.asarray(category_ids, dtype=np.int64)       # -1 = NULL
+        self.minimum_experience = np.asarray(minimum_experience, dtype=np.float64)  # NaN = NULL
+        self.is_remote = np.asarray(is_remote, dtype=np.int8)
+        self.is_full_time = np.asarray(is_full_time, dtype=np.int8)
+        self.is_part_time = np.asarray(is_part_time, dtype=np.int8)
+        self.scraped_at = np.asarray(scraped_at, dtype=np.float64)         # POSIX seconds, NaN = NULL
+        self.is_active = np.asarray(is_active, dtype=np.int8)
+        self._province_lookup = {name: code for code, name in enumerate(self.provinces)}
+
+    @property
+    def size(self) -> int:
+        return int(self.job_ids.size)
+
+    # --- BUILD / PERSIST ---
+    @classmethod
+    def build(cls, job_ids, conn) -> "JobAttributeIndex":
+        """Snapshots the attributes of `job_ids` (in that order) from the database."""
+        job_ids = np.asarray(job_ids, dtype=np.int64)
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT id, province, category_id, minimum_experience,
+                       is_remote, is_full_time, is_part_time, scraped_at, is_active
+                FROM job_postings WHERE id = ANY(%s)
+            """, (job_ids.tolist(),))
+            rows = {row[0]: row[1:] for row in cur.fetchall()}
+
+        # Jobs deleted since embedding keep all-NULL attributes and never pass the sieve.
+        empty = (None,) * 8
+        columns = list(zip(*(rows.get(int(job_id), empty) for job_id in job_ids))) or [()] * 8
+        provinces, categories, min_exp, remote, full_time, part_time, scraped_at, active = columns
+
+        vocabulary = sorted({p for p in provinces if p is not None})
+        lookup = {name: code for code, name in enumerate(vocabulary)}
+        return cls(
+            job_ids=job_ids,
+            province_codes=[lookup[p] if p is not None else -1 for p in provinces],
+            provinces=vocabulary,
+            category_ids=[c if c is not None else -1 for c in categories],
+            minimum_experience=[float(e) if e is not None else np.nan for e in min_exp],
+            is_remote=_tri_state(remote),
+            is_full_time=_tri_state(full_time),
+            is_part_time=_tri_state(part_time),
+            scraped_at=[s.timestamp() if s is not None else np.nan for s in scraped_at],
+            is_active=_tri_state(active),
+        )
+
+    _COLUMNS = ('province_codes', 'category_ids', 'minimum_experience', 'is_remote',
+                'is_full_time', 'is_part_time', 'scraped_at', 'is_active')
+
+    def save(self, directory: str) -> list[str]:
+        """
+        Writes one raw .npy file per column into `directory` so they can be
+        memory-mapped. The job IDs are stored once by the artifact bundle.
+        Returns the written paths relative to the directory's parent.
+        """
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, 'provinces.npy'), np.array(self.provinces, dtype=str))
+        for name in self._COLUMNS:
+            np.save(os.path.join(directory, f'{name}.npy'), getattr(self, name))
+        base = os.path.basename(directory)
+        return [f'{base}/provinces.npy'] + [f'{base}/{name}.npy' for name in self._COLUMNS]
+
+    @classmethod
+    def load(cls, directory: str, job_ids, mmap_mode: str | None = 'r') -> "JobAttributeIndex":
+        columns = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+                   for name in cls._COLUMNS}
+        provinces = np.load(os.path.join(directory, 'provinces.npy'))
+        return cls(job_ids=job_ids, provinces=provinces, **columns)
+
+    # --- FILTERING ---
+    def mask(self, context, max_age_days: int = 45, now: datetime | None = None) -> np.ndarray:
+        """
+        Applies the user's hard filters (everything in the SQL sieve except
+        skill overlap) and returns a boolean mask over index rows.
+        """
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(days=max_age_days)).timestamp()
+
+        mask = (self.is_active == _TRUE) & (self.scraped_at >= cutoff)
+
+        if context.preferred_category_id:
+            mask &= self.category_ids == context.preferred_category_id
+        provinces = context.province_list
+        if provinces:
+            codes = [self._province_lookup[p] for p in provinces if p in self._province_lookup]
+            mask &= np.isin(self.province_codes, codes)
+        if context.experience_level is not None:
+            mask &= self.minimum_experience <= context.experience_level
+
+        # Time commitment filtering (wanting both means no filter)
+        if context.wants_full_time and not context.wants_part_time:
+            mask &= self.is_full_time == _TRUE
+        elif context.wants_part_time and not context.wants_full_time:
+            mask &= self.is_part_time == _TRUE
+
+        # Location type filtering (wanting both means no filter)
+        if context.wants_remote and not context.wants_onsite:
+            mask &= self.is_remote == _TRUE
+        elif context.wants_onsite and not context.wants_remote:
+            mask &= self.is_remote == _FALSE
+
+        return mask
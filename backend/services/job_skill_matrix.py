@@ -0,0 +1,112 @@
+# services/job_skill_matrix.py
+"""
+Sparse job x skill incidence matrix, aligned with the FAISS row order.
+
+Skill overlap used to be computed twice per request: once by the
+`job_skill_counts` CTE of the sieve, and again in the weighted scoring stage
+by pulling every (job, skill) row of the candidates and intersecting Python
+sets. With the incidence matrix in memory, the overlap of *every* job with a
+user is a single sparse matrix-vector product against the user's skill
+indicator vector, and the per-job skill counts needed for
+`skill_overlap_score` are precomputed from the row lengths.
+"""
+import os
+
+import numpy as np
+from scipy import sparse
+
+
+class JobSkillMatrix:
+    """
+    CSR matrix with one row per index row (job) and one column per skill.
+
+    Args:
+        job_ids: Job ID of every row, in FAISS row order.
+        skill_ids: Skill ID of every column, sorted ascending.
+        indptr, indices: CSR structure; all stored values are 1.
+    """
+
+    def __init__(self, job_ids, skill_ids, indptr, indices):
+        self.job_ids = np.asarray(job_ids, dtype=np.int64)
+        self.skill_ids = np.asarray(skill_ids, dtype=np.int64)
+        indices = np.asarray(indices, dtype=np.int32)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(indices.size, dtype=np.float32), indices, np.asarray(indptr, dtype=np.int64)),
+            shape=(self.job_ids.size, self.skill_ids.size),
+        )
+        # Number of skills each job asks for (the denominator of skill_overlap_score).
+        self.skill_counts = np.diff(self.matrix.indptr).astype(np.int32)
+
+    @property
+    def size(self) -> int:
+        return int(self.job_ids.size)
+
+    # --- BUILD / PERSIST ---
+    @classmethod
+    def build(cls, job_ids, conn) -> "JobSkillMatrix":
+        """Loads the job_skill rows of `job_ids` and lays them out in that order."""
+        job_ids = np.asarray(job_ids, dtype=np.int64)
+        with conn.cursor() as cur:
+            cur.execute("SELECT job_id, skill_id FROM job_skill WHERE job_id = ANY(%s)", (job_ids.tolist(),))
+            pairs = np.array(cur.fetchall(), dtype=np.int64).reshape(-1, 2)
+
+        skill_ids = np.unique(pairs[:, 1])
+        # Translate job IDs to row positions and skill IDs to column positions.
+        order = np.argsort(job_ids, kind='stable')
+        rows = order[np.searchsorted(job_ids[order], pairs[:, 0])]
+        cols = np.searchsorted(skill_ids, pairs[:, 1])
+        coo = sparse.coo_matrix(
+            (np.ones(len(pairs), dtype=np.float32), (rows, cols)),
+            shape=(job_ids.size, skill_ids.size),
+        )
+        csr = coo.tocsr()
+        csr.sum_duplicates()
+        csr.sort_indices()
+        return cls(job_ids, skill_ids, csr.indptr, csr.indices)
+
+    def save(self, directory: str) -> list[str]:
+        """
+        Writes the CSR structure as raw .npy files into `directory` so they can be
+        memory-mapped. The job IDs are stored once by the artifact bundle.
+        Returns the written paths relative to the directory's parent.
+        """
+        os.makedirs(directory, exist_ok=True)
+        arrays = {'skill_ids': self.skill_ids, 'indptr': self.matrix.indptr, 'indices': self.matrix.indices}
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, f'{name}.npy'), array)
+        base = os.path.basename(directory)
+        return [f'{base}/{name}.npy' for name in arrays]
+
+    @classmethod
+    def load(cls, directory: str, job_ids, mmap_mode: str | None = 'r') -> "JobSkillMatrix":
+        arrays = {name: np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+                  for name in ('skill_ids', 'indptr', 'indices')}
+        return cls(job_ids, **arrays)
+
+    # --- SCORING ---
+    def user_indicator(self, user_skill_ids) -> np.ndarray:
+        """0/1 vector over the matrix columns marking the user's skills."""
+        indicator = np.zeros(self.skill_ids.size, dtype=np.float32)
+        ids = np.asarray(list(user_skill_ids), dtype=np.int64)
+        if ids.size and self.skill_ids.size:
+            pos = np.searchsorted(self.skill_ids, ids)
+            pos[pos >= self.skill_ids.size] = 0
+            indicator[pos[self.skill_ids[pos] == ids]] = 1.0
+        return indicator
+
+    def overlap_counts(self, user_skill_ids, rows: np.ndarray | None = None) -> np.ndarray:
+        """Number of the user's skills each job (or each of `rows`) asks for."""
+        indicator = self.user_indicator(user_skill_ids)
+        if rows is None:
+            return (self.matrix @ indicator).astype(np.int32)
+
+        # For a handful of rows, gathering their column indices straight from
+        # the CSR arrays is much cheaper than slicing a sparse sub-matrix.
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.matrix.indptr[rows]
+        lengths = self.matrix.indptr[rows + 1] - starts
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        positions = np.arange(int(lengths.sum())) + offsets
+        hits = indicator[self.matrix.indices[positions]]
+        return np.bincount(np.repeat(np.arange(rows.size), lengths), weights=hits,
+                           minlength=rows.size).astype(np.int32)
@@ -0,0 +1,268 @@
+# services/onnx_backend.py
+"""
+Optional ONNX Runtime backend for the two transformer models: the
+SentenceTransformer used for embeddings and the CrossEncoder used for
+re-ranking.
+
+Each model is exported once to ONNX and quantized with dynamic int8
+quantization, which is what CPU-only servers run fastest. At runtime the
+exported model is served by onnxruntime behind the same methods the
+services already call (`encode` for embeddings, `predict` and `tokenizer`
+for the cross-encoder), so nothing else changes when INFERENCE_BACKEND=onnx.
+
+Export and check the models from the backend directory:
+    python -m services.onnx_backend export
+    python -m services.onnx_backend check
+
+`export` needs torch, sentence-transformers and onnxruntime. Serving only
+needs onnxruntime and transformers (for the tokenizers).
+"""
+import importlib.util
+import json
+import os
+
+import numpy as np
+
+# "torch" (default) or "onnx". Switching changes the stored model versions, so
+# user embeddings, the job index and cached re-ranking scores are recomputed.
+INFERENCE_BACKEND = os.getenv('INFERENCE_BACKEND', 'torch').lower()
+ONNX_MODELS_DIR = os.getenv('ONNX_MODELS_DIR', os.path.join('data', 'onnx'))
+# onnxruntime intra-op threads; 0 lets onnxruntime use every core.
+ONNX_NUM_THREADS = int(os.getenv('ONNX_NUM_THREADS', 0))
+
+BACKEND_TAG = "onnx-int8"
+_MODEL_FILE = "model.int8.onnx"
+_CONFIG_FILE = "export.json"
+
+
+def model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODELS_DIR, model_name.replace('/', '__'))
+
+
+def use_onnx(model_name: str) -> bool:
+    """
+    Whether `model_name` will be served by ONNX Runtime: the backend is
+    configured and its export and onnxruntime are present. Decided without
+    loading anything, so callers can version their data before the model loads.
+    """
+    if INFERENCE_BACKEND != 'onnx':
+        return False
+    if importlib.util.find_spec('onnxruntime') is None or not os.path.exists(os.path.join(model_dir(model_name), _MODEL_FILE)):
+        print(f"CRITICAL WARNING: No usable ONNX export of {model_name}; falling back to PyTorch. "
+              "Run `python -m services.onnx_backend export`.")
+        return False
+    return True
+
+
+# --- 1. EXPORT ---
+def _export(hf_model, head, tokenizer, output_dir: str, output_axes: dict, config: dict) -> str:
+    """
+    Exports a Hugging Face model, followed by `head` on its outputs, to ONNX,
+    quantizes the weights to int8 and saves the tokenizer beside it.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(output_dir, exist_ok=True)
+    dummy = tokenizer(["نمونه متن برای خروجی گرفتن", "a sample sentence"],
+                      ["توضیحات شغل", "job description"] if config["kind"] == "cross_encoder" else None,
+                      padding=True, return_tensors='pt')
+    input_names = [name for name in tokenizer.model_input_names if name in dummy]
+
+    class _Exportable(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = hf_model
+
+        def forward(self, *inputs):
+            return head(self.model(**dict(zip(input_names, inputs))))
+
+    fp32_path = os.path.join(output_dir, "model.fp32.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            _Exportable(), tuple(dummy[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=["output"],
+            dynamic_axes={**{name: {0: "batch", 1: "sequence"} for name in input_names}, "output": output_axes},
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, os.path.join(output_dir, _MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, _CONFIG_FILE), 'w') as f:
+        json.dump({**config, "input_names": input_names}, f, indent=2)
+    return output_dir
+
+
+def export_sentence_encoder(model_name: str, output_dir: str | None = None) -> str:
+    """Exports the transformer of a SentenceTransformer; pooling and normalization run in NumPy."""
+    from sentence_transformers import SentenceTransformer
+
+    st = SentenceTransformer(model_name, device='cpu')
+    transformer, pooling = st[0], st[1]
+    hf_model = transformer.auto_model.eval()
+    config = {
+        "kind": "sentence_encoder",
+        "model_name": model_name,
+        "max_length": st.max_seq_length,
+        "pooling": "cls" if pooling.pooling_mode_cls_token else "mean",
+        "normalize": any(type(m).__name__ == 'Normalize' for m in st),
+    }
+    return _export(hf_model, lambda outputs: outputs.last_hidden_state, transformer.tokenizer,
+                   output_dir or model_dir(model_name), {0: "batch", 1: "sequence"}, config)
+
+
+def export_cross_encoder(model_name: str, output_dir: str | None = None) -> str:
+    """Exports a CrossEncoder including its activation, so scores match `CrossEncoder.predict`."""
+    import torch
+    from sentence_transformers import CrossEncoder
+
+    ce = CrossEncoder(model_name, device='cpu')
+    hf_model = ce.model.eval()
+    # The attribute was renamed between sentence-transformers releases.
+    activation = getattr(ce, 'activation_fn', None) or getattr(ce, 'activation_fct', None) or torch.nn.Identity()
+    config = {
+        "kind": "cross_encoder",
+        "model_name": model_name,
+        "max_length": ce.max_length or min(ce.tokenizer.model_max_length, 512),
+    }
+    return _export(hf_model, lambda outputs: activation(outputs.logits), ce.tokenizer,
+                   output_dir or model_dir(model_name), {0: "batch"}, config)
+
+
+# --- 2. RUNTIME ---
+class _OnnxModel:
+    def __init__(self, directory: str):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path = os.path.join(directory, _MODEL_FILE)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"{model_path} not found; run `python -m services.onnx_backend export` first.")
+        with open(os.path.join(directory, _CONFIG_FILE)) as f:
+            self.config = json.load(f)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_NUM_THREADS:
+            options.intra_op_num_threads = ONNX_NUM_THREADS
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(directory)
+        self.max_length = self.config["max_length"]
+        self._input_names = [i.name for i in self.session.get_inputs()]
+
+    def _run(self, encoded) -> np.ndarray:
+        feed = {}
+        for name in self._input_names:
+            if name in encoded:
+                feed[name] = encoded[name].astype(np.int64)
+            else:
+                feed[name] = np.zeros_like(encoded["input_ids"], dtype=np.int64)
+        return self.session.run(None, feed)[0]
+
+
+class OnnxSentenceEncoder(_OnnxModel):
+    """Drop-in for `SentenceTransformer.encode` on the exported model."""
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        # Longest first, as SentenceTransformer does, so batches pad to similar lengths.
+        order = np.argsort([-len(s) for s in sentences], kind='stable')
+        embeddings = [None] * len(sentences)
+        for start in range(0, len(sentences), batch_size):
+            idx = order[start:start + batch_size]
+            encoded = self.tokenizer([sentences[i] for i in idx], padding=True, truncation=True,
+                                     max_length=self.max_length, return_tensors='np')
+            hidden = self._run(encoded)
+            if self.config["pooling"] == "cls":
+                pooled = hidden[:, 0]
+            else:
+                mask = encoded["attention_mask"][..., None].astype(np.float32)
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.config["normalize"]:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            for i, vector in zip(idx, pooled):
+                embeddings[i] = vector
+        result = np.stack(embeddings).astype(np.float32) if embeddings else np.empty((0, 0), dtype=np.float32)
+        return result[0] if single else result
+
+
+class OnnxCrossEncoder(_OnnxModel):
+    """Drop-in for `CrossEncoder.predict` on the exported model."""
+
+    def predict(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        scores = []
+        for start in range(0, len(sentences), batch_size):
+            batch = sentences[start:start + batch_size]
+            encoded = self.tokenizer([q for q, _ in batch], [d for _, d in batch], padding=True,
+                                     truncation='longest_first', max_length=self.max_length, return_tensors='np')
+            scores.append(self._run(encoded).reshape(len(batch), -1)[:, 0])
+        return np.concatenate(scores).astype(np.float32) if scores else np.empty(0, dtype=np.float32)
+
+
+def load_sentence_encoder(model_name: str) -> OnnxSentenceEncoder:
+    return OnnxSentenceEncoder(model_dir(model_name))
+
+
+def load_cross_encoder(model_name: str) -> OnnxCrossEncoder:
+    return OnnxCrossEncoder(model_dir(model_name))
+
+
+# --- 3. EQUIVALENCE CHECK ---
+CHECK_TEXTS = [
+    "مهندس نرم افزار سنیور مسلط به پایتون و جنگو. تجربه کار با Docker و Postgres. به دنبال فرصت شغلی در تهران یا به صورت دورکاری.",
+    "کارشناس فرانت اند با سه سال سابقه کار با React و TypeScript. آشنا به طراحی UI/UX و کار با Figma. علاقمند به شرکت های استارتاپی در اصفهان.",
+    "توسعه دهنده ارشد Python شرکت دیجی کالا تهران استخدام برنامه نویس Django مسلط به REST API و Celery",
+    "استخدام کارشناس Frontend در شرکت تپسی تهران. نیازمند تسلط بر React.js و Redux. آشنایی با GraphQL مزیت محسوب میشود.",
+    "برنامه نویس Back-End در اصفهان. شرکت اسنپ. کار با Golang و میکروسرویس. شرایط دورکاری فراهم است.",
+    "طراح UI/UX در شیراز. مسلط به Figma و Adobe XD. حداقل دو سال سابقه کار مرتبط.",
+    "کارآموز پایتون در شرکت همراه اول. تهران. آشنایی با مفاهیم اولیه برنامه نویسی و پایگاه داده.",
+    "Senior data analyst, SQL and Power BI, remote",
+]
+
+
+def check_equivalence(embedding_model_name: str, cross_encoder_model_name: str,
+                      min_cosine: float = 0.98, min_rank_correlation: float = 0.95) -> bool:
+    """
+    Compares the ONNX models with their PyTorch originals on CHECK_TEXTS:
+    per-text cosine agreement of the embeddings, and rank correlation of the
+    cross-encoder scores over every (text, text) pair.
+    """
+    from sentence_transformers import CrossEncoder, SentenceTransformer
+
+    torch_vectors = SentenceTransformer(embedding_model_name, device='cpu').encode(CHECK_TEXTS)
+    onnx_vectors = load_sentence_encoder(embedding_model_name).encode(CHECK_TEXTS)
+    cosine = (torch_vectors * onnx_vectors).sum(axis=1) / (
+        np.linalg.norm(torch_vectors, axis=1) * np.linalg.norm(onnx_vectors, axis=1))
+    print(f"Embeddings: cosine agreement min={cosine.min():.4f} mean={cosine.mean():.4f} (required >= {min_cosine})")
+
+    pairs = [(a, b) for a in CHECK_TEXTS[:2] for b in CHECK_TEXTS[2:]]
+    torch_scores = np.asarray(CrossEncoder(cross_encoder_model_name, device='cpu').predict(pairs)).reshape(-1)
+    onnx_scores = load_cross_encoder(cross_encoder_model_name).predict(pairs)
+    ranks = np.corrcoef(np.argsort(np.argsort(torch_scores)), np.argsort(np.argsort(onnx_scores)))[0, 1]
+    print(f"Cross-Encoder: max |score diff|={np.abs(torch_scores - onnx_scores).max():.4f}, "
+          f"rank correlation={ranks:.4f} (required >= {min_rank_correlation})")
+
+    return bool(cosine.min() >= min_cosine and ranks >= min_rank_correlation)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from services.embedding_service import EMBEDDING_MODEL_NAME
+    from services.reranker import CROSS_ENCODER_MODEL_NAME
+
+    parser = argparse.ArgumentParser(description="Export and verify the quantized ONNX models.")
+    parser.add_argument("command", choices=["export", "check"])
+    args = parser.parse_args()
+
+    if args.command == "export":
+        print(f"Exported {export_sentence_encoder(EMBEDDING_MODEL_NAME)}")
+        print(f"Exported {export_cross_encoder(CROSS_ENCODER_MODEL_NAME)}")
+    elif not check_equivalence(EMBEDDING_MODEL_NAME, CROSS_ENCODER_MODEL_NAME):
+        raise SystemExit("FAILED: the ONNX models disagree with PyTorch beyond the tolerance.")
+    else:
+        print("Verification passed: the ONNX models match PyTorch within tolerance.")
@@ -1,154 +1,141 @@
 import os
-import psycopg2
 import numpy as np
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from services.embedding_service import embed_texts
-import faiss
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import CrossEncoder 
+from services.user_embedding_store import get_user_vectors
+from services.db import get_db_connection, release_db_connection
+from services.user_context import UserContext, load_user_context
+from services.cache import TTLCache, CACHE_REDIS_URL
+from services.artifacts import ArtifactBundle, get_artifacts
+from services.scoring import SCORING_WEIGHTS, score_and_select
+from services.vector_shards import shards_for
+from services import reranker
 
 # --- 1. CONFIGURATION & ARTIFACT LOADING ---
 load_dotenv()
 
-FAISS_INDEX_PATH = os.path.join('data', 'job_index.faiss')
-JOB_ID_MAP_PATH = os.path.join('data', 'job_id_map.npy')
-faiss_index = None
-job_id_map = None
-job_id_to_faiss_idx = {}
-
-try:
-    faiss_index = faiss.read_index(FAISS_INDEX_PATH)
-    job_id_map = np.load(JOB_ID_MAP_PATH)
-    job_id_to_faiss_idx = {job_id: i for i, job_id in enumerate(job_id_map)}
-    print("Recommendation service: FAISS index and maps loaded successfully.")
-except Exception as e:
-    print(f"CRITICAL WARNING (recommendation_service): Could not load artifacts: {e}")
-
-cross_encoder_model = None
-try:
-    print("Loading Cross-Encoder model for re-ranking...")
-    # This is a powerful, multilingual model trained for semantic relevance.
-    cross_encoder_model = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
-    print("Cross-Encoder model loaded successfully.")
-except Exception as e:
-    print(f"CRITICAL WARNING: Could not load Cross-Encoder model: {e}")
-
-
-def get_db_connection():
-    """Establishes a connection to the PostgreSQL database."""
-    try:
-        conn = psycopg2.connect(
-            host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT'),
-            dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'),
-            password=os.getenv('DB_PASSWORD')
-        )
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"Fatal: Could not connect to the database: {e}")
-        return None
+# The FAISS index, its ID map, the job attribute index and the job-skill matrix
+# all come from the published artifact bundle (services/artifacts.py), so they
+# are guaranteed to belong to the same build. Each request takes the bundle
+# once via get_artifacts() and passes it down.
+
+# Web-path results, keyed by (user_id, top_k, bundle version). Reloading the
+# recommendations page becomes a dictionary lookup instead of a full pipeline run.
+recommendation_cache = TTLCache(
+    "recommendations",
+    max_entries=int(os.getenv('RECOMMENDATION_CACHE_SIZE', 2048)),
+    ttl_seconds=float(os.getenv('RECOMMENDATION_CACHE_TTL', 600)),
+    redis_url=CACHE_REDIS_URL,
+)
+
+# The Cross-Encoder, its score cache and its batching live in services/reranker.py.
+
 
 # --- 2. USER VECTOR GENERATION (REVISED) ---
 
 def _build_user_text(user_id: int) -> str:
     """
-    Connects to the DB and constructs a descriptive text from the user's profile.
-    This is now aligned with the most important semantic fields: their professional
+    Constructs a descriptive text from the user's profile: their professional
     title, their skills, and their detailed work experience.
+    Pipeline stages should use `UserContext.text` on an already-loaded context.
     """
-    conn = get_db_connection()
-    if not conn:
-        return ""
+    context = load_user_context(user_id)
+    return context.text if context else ""
+
+def get_user_vector(context: UserContext) -> np.ndarray | None:
+    """
+    Returns the semantic vector embedding for the given user context.
+    The vector comes from the persistent user-embedding store; the model only
+    runs when the profile text (or the embedding model) changed.
+    """
+    user_vector = get_user_vectors([context]).get(context.user_id)
+    if user_vector is None:
+        print(f"Warning: No text data found for user_id {context.user_id} to generate a vector.")
+    return user_vector
+
+# --- 3. HARD FILTERING ---
+
+def _skill_overlap_rows(context: UserContext, min_skill_overlap: int, bundle: ArtifactBundle) -> np.ndarray:
+    """Index rows of the jobs sharing at least max(1, min_skill_overlap) skills with the user."""
+    if bundle.job_skill_matrix is not None:
+        # One sparse mat-vec gives the overlap of every indexed job with the user
+        counts = bundle.job_skill_matrix.overlap_counts(context.skill_ids)
+        return np.flatnonzero(counts >= max(1, min_skill_overlap))
 
-    full_text_parts = []
+    conn = get_db_connection()
+    if not conn: return np.empty(0, dtype=np.int64)
     try:
         with conn.cursor() as cur:
-            # 1. Fetch professional title from user_profiles
-            cur.execute("SELECT professional_title FROM user_profiles WHERE user_id = %s", (user_id,))
-            profile_res = cur.fetchone()
-            if profile_res and profile_res[0]:
-                full_text_parts.append(profile_res[0])
-
-            # 2. Fetch skills from user_skills
-            cur.execute("""
-                SELECT s.name FROM skills s
-                JOIN user_skills us ON s.id = us.skill_id
-                WHERE us.user_id = %s
-            """, (user_id,))
-            skills_res = cur.fetchall()
-            if skills_res:
-                skills_text = ", ".join([row[0] for row in skills_res])
-                full_text_parts.append(f"Skills include: {skills_text}")
-
-            # 3. Fetch work experience descriptions
             cur.execute("""
-                SELECT description FROM work_experiences
-                WHERE user_id = %s AND description IS NOT NULL AND description != ''
-            """, (user_id,))
-            exp_res = cur.fetchall()
-            if exp_res:
-                experience_text = " ".join([row[0] for row in exp_res])
-                full_text_parts.append(f"Past work experience: {experience_text}")
-
+                SELECT job_id FROM job_skill
+                WHERE skill_id = ANY(%s)
+                GROUP BY job_id HAVING count(skill_id) >= %s
+            """, (context.skill_ids, max(1, min_skill_overlap)))
+            return bundle.vector_search_engine.rows_for_ids([row[0] for row in cur.fetchall()])
     except Exception as e:
-        print(f"Error building user text for user_id {user_id}: {e}")
+        print(f"Error in _skill_overlap_rows: {e}")
+        return np.empty(0, dtype=np.int64)
     finally:
-        conn.close()
-
-    return ". ".join(filter(None, full_text_parts))
+        release_db_connection(conn)
 
-def get_user_vector(user_id: int) -> np.ndarray | None:
+def get_candidate_mask(context: UserContext, min_skill_overlap: int = 0,
+                       bundle: ArtifactBundle | None = None) -> np.ndarray | None:
     """
-    Generates a semantic vector embedding for a given user ID.
-    (This function's logic does not need to change.)
+    Implements Stage 1 in-process: the user's hard filters evaluated against the
+    job attribute index, as a boolean mask over FAISS rows.
+    Returns None when the attribute index isn't loaded (callers then use SQL).
     """
-    user_text = _build_user_text(user_id)
-    if not user_text:
-        print(f"Warning: No text data found for user_id {user_id} to generate a vector.")
+    bundle = bundle or get_artifacts()
+    if bundle.job_attribute_index is None or bundle.vector_search_engine is None:
         return None
-    
-    user_embedding = embed_texts([user_text])
-    return user_embedding[0]
-
-# --- 3. HARD FILTERING ---
-
-def get_filtered_job_ids(user_id: int, min_skill_overlap: int = 0) -> list[int]:
+    mask = np.zeros(bundle.job_attribute_index.size, dtype=bool)
+    if not context.has_profile or not context.skill_ids:
+        return mask
+    mask[_skill_overlap_rows(context, min_skill_overlap, bundle)] = True
+    mask &= bundle.job_attribute_index.mask(context)
+    return mask
+
+def get_filtered_job_ids(context: UserContext, min_skill_overlap: int = 0,
+                         bundle: ArtifactBundle | None = None) -> list[int]:
     """
     Implements Stage 1: Candidate Generation.
     Applies all hard filters to find a small, highly-relevant pool of job candidates.
     """
+    bundle = bundle or get_artifacts()
+    mask = get_candidate_mask(context, min_skill_overlap, bundle)
+    if mask is not None:
+        return bundle.job_attribute_index.job_ids[mask].tolist()
+    return _get_filtered_job_ids_sql(context, min_skill_overlap)
+
+def _get_filtered_job_ids_sql(context: UserContext, min_skill_overlap: int = 0) -> list[int]:
+    """
+    The database version of Stage 1, used when the job attribute index is not
+    available. `get_candidate_mask` must return the same jobs (restricted to the index).
+    """
+    # 1. User preferences come from the already-loaded context
+    if not context.has_profile or not context.skill_ids: return []
+
     conn = get_db_connection()
     if not conn: return []
 
     candidate_job_ids = []
     try:
         with conn.cursor() as cur:
-            # 1. Fetch all user preferences in one go
-            cur.execute("""
-                SELECT preferred_provinces, wants_full_time, wants_part_time,
-                       wants_remote, wants_onsite, wants_internship,
-                       experience_level, preferred_category_id
-                FROM user_profiles WHERE user_id = %s
-            """, (user_id,))
-            
-            prefs = cur.fetchone()
-            if not prefs: return []
-            
-            provinces, full_time, part_time, remote, onsite, internship, exp_level, cat_id = prefs
+            full_time, part_time = context.wants_full_time, context.wants_part_time
+            remote, onsite = context.wants_remote, context.wants_onsite
+            exp_level, cat_id = context.experience_level, context.preferred_category_id
+            provinces = context.province_list
             
             # 2. Build the powerful filtering query with a Common Table Expression (CTE) for skill overlap
             query_parts = []
-            params = {'user_id': user_id, 'min_skill_overlap': min_skill_overlap}
+            params = {'skill_ids': context.skill_ids, 'min_skill_overlap': min_skill_overlap}
 
             # --- THE CORE SKILL OVERLAP LOGIC ---
             base_query = """
-                WITH user_skill_set AS (
-                    SELECT skill_id FROM user_skills WHERE user_id = %(user_id)s
-                ),
-                job_skill_counts AS (
+                WITH job_skill_counts AS (
                     SELECT js.job_id, count(js.skill_id) as matching_skills
                     FROM job_skill js
-                    WHERE js.skill_id IN (SELECT skill_id FROM user_skill_set)
+                    WHERE js.skill_id = ANY(%(skill_ids)s)
                     GROUP BY js.job_id
                 )
                 SELECT jp.id FROM job_postings jp
@@ -163,7 +150,7 @@ def get_filtered_job_ids(user_id: int, min_skill_overlap: int = 0) -> list[int]:
                 query_parts.append("AND jp.category_id = %(cat_id)s")
                 params['cat_id'] = cat_id
             if provinces:
-                params['provinces'] = tuple([p.strip() for p in provinces.split(',')])
+                params['provinces'] = tuple(provinces)
                 query_parts.append("AND jp.province IN %(provinces)s")
             if exp_level is not None:
                 query_parts.append("AND jp.minimum_experience <= %(exp_level)s")
@@ -191,16 +178,18 @@ def get_filtered_job_ids(user_id: int, min_skill_overlap: int = 0) -> list[int]:
     except Exception as e:
         print(f"Error in get_filtered_job_ids: {e}")
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
         
     return candidate_job_ids
 
 
 # --- 3. NEW: WEIGHTED SCORING & REASONING LOGIC ---
-def _calculate_scores_for_candidates(user_id: int, candidates: list[dict]) -> list[dict]:
+def _calculate_scores_for_candidates(context: UserContext, candidates: list[dict]) -> list[dict]:
     """
     Takes a list of candidates (with job_id and semantic_score) and enriches
     it with skill overlap, recency, and a final weighted score.
+    This is the database fallback; `_score_rows` is used when the in-memory
+    job-skill matrix and attribute index are loaded.
     """
     if not candidates:
         return []
@@ -212,9 +201,8 @@ def _calculate_scores_for_candidates(user_id: int, candidates: list[dict]) -> li
     
     try:
         with conn.cursor() as cur:
-            # 1. Get user's skills
-            cur.execute("SELECT skill_id FROM user_skills WHERE user_id = %s", (user_id,))
-            user_skill_ids = {row[0] for row in cur.fetchall()}
+            # 1. The user's skills are already part of the context
+            user_skill_ids = set(context.skill_ids)
 
             # 2. Get skills and post date for all candidate jobs
             cur.execute("""
@@ -248,9 +236,9 @@ def _calculate_scores_for_candidates(user_id: int, candidates: list[dict]) -> li
                 recency_score = max(0, 1 - (days_since_posted / 45.0))
 
                 # Calculate final weighted score
-                final_score = (0.6 * candidate['semantic_score']) + \
-                              (0.3 * skill_overlap_score) + \
-                              (0.1 * recency_score)
+                final_score = (SCORING_WEIGHTS['semantic'] * candidate['semantic_score']) + \
+                              (SCORING_WEIGHTS['skill'] * skill_overlap_score) + \
+                              (SCORING_WEIGHTS['recency'] * recency_score)
                 
                 candidate['final_score'] = final_score
                 candidate['reasoning'] = {
@@ -267,72 +255,92 @@ def _calculate_scores_for_candidates(user_id: int, candidates: list[dict]) -> li
         # Fallback: return original candidates if scoring fails
         return candidates
     finally:
-        if conn: conn.close()
+        if conn: release_db_connection(conn)
 
 
-def _build_job_texts_for_reranking(job_ids: list[int]) -> dict:
+def _score_rows(context: UserContext, rows: np.ndarray, similarities: np.ndarray, top_k: int,
+                bundle: ArtifactBundle) -> list[dict]:
     """
-    Fetches and constructs the full text for a list of candidate job IDs.
+    Array version of `_calculate_scores_for_candidates` for retrieved index rows:
+    skill overlap comes from the job-skill matrix and post dates from the
+    attribute index, every score column is computed with NumPy, and only the
+    final top_k are turned into dicts.
     """
-    conn = get_db_connection()
-    if not conn: return {}
-    
-    job_texts = {}
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT jp.id, COALESCE(jp.title, '') || ' ' || COALESCE(jp.job_description, '') || ' ' || COALESCE(STRING_AGG(s.name, ' '), '') as job_text
-                FROM job_postings jp
-                LEFT JOIN job_skill js ON jp.id = js.job_id
-                LEFT JOIN skills s ON js.skill_id = s.id
-                WHERE jp.id = ANY(%s)
-                GROUP BY jp.id
-            """, (job_ids,))
-            
-            for job_id, full_text in cur.fetchall():
-                job_texts[job_id] = full_text
-    except Exception as e:
-        print(f"Error building job texts for reranking: {e}")
-    finally:
-        if conn: conn.close()
-    return job_texts
+    return score_and_select(
+        job_ids=bundle.vector_search_engine.job_ids[rows],
+        semantic=similarities,
+        matched_counts=bundle.job_skill_matrix.overlap_counts(context.skill_ids, rows),
+        required_counts=bundle.job_skill_matrix.skill_counts[rows],
+        scraped_at=bundle.job_attribute_index.scraped_at[rows],
+        top_k=top_k,
+    )
+
 
 # --- 4. REVISED: MAIN RECOMMENDATION PIPELINE ---
-def get_recommendations_for_user(user_id: int, top_k: int = 10, retrieval_k: int = 50, use_reranker: bool = False) -> list[dict]:
+def _as_candidates(rows: np.ndarray, similarities: np.ndarray, bundle: ArtifactBundle) -> list[dict]:
+    """Retrieved index rows as the candidate dicts used by the re-ranking and fallback paths."""
+    return [
+        {"job_id": int(bundle.vector_search_engine.job_ids[row]), "semantic_score": float(score)}
+        for row, score in zip(rows, similarities)
+    ]
+
+def get_recommendations_for_user(user_id: int, top_k: int = 10, retrieval_k: int = 50, use_reranker: bool = False,
+                                 context: UserContext | None = None) -> list[dict]:
     """
     The complete recommendation pipeline that NOW CORRECTLY USES the weighted scoring function.
+    The user's context is loaded once (or passed in by batch callers) and shared by every stage.
+    Web-path results are served from `recommendation_cache` when possible.
     """
-    # Stage 1: Candidate Generation (Sieve)
-    candidate_ids = get_filtered_job_ids(user_id)
-    if not candidate_ids: return []
+    user_id = int(user_id)
+    # One bundle for the whole request: every stage sees the same build.
+    bundle = get_artifacts()
+    cache_key = (top_k, bundle.version)
+    if not use_reranker:
+        cached = recommendation_cache.get(user_id, cache_key)
+        if cached is not None:
+            return cached
+
+    if context is None:
+        context = load_user_context(user_id)
+    if context is None: return []
+
+    engine = bundle.vector_search_engine
+    if engine is None: return []
+
+    # Stage 1: Candidate Generation (Sieve), as a mask over index rows
+    candidate_mask = get_candidate_mask(context, bundle=bundle)
+    if candidate_mask is None:
+        candidate_mask = np.zeros(engine.size, dtype=bool)
+        candidate_mask[engine.rows_for_ids(_get_filtered_job_ids_sql(context))] = True
+    if not candidate_mask.any(): return []
 
     # Stage 2: Initial Retrieval (Bi-Encoder)
-    user_vector = get_user_vector(user_id)
+    user_vector = get_user_vector(context)
     if user_vector is None: return []
-
-    candidate_faiss_indices = [job_id_to_faiss_idx[job_id] for job_id in candidate_ids if job_id in job_id_to_faiss_idx]
-    if not candidate_faiss_indices: return []
     
     num_to_retrieve = retrieval_k if use_reranker else (top_k * 2) # Retrieve more for better weighted scoring
     
-    candidate_vectors = faiss_index.reconstruct_batch(np.array(candidate_faiss_indices, dtype=np.int64))
-    user_vector_2d = np.array([user_vector]).astype('float32')
-    similarities = cosine_similarity(user_vector_2d, candidate_vectors)[0]
-    
-    top_indices = np.argsort(similarities)[-num_to_retrieve:][::-1]
-    retrieved_candidates = [{"job_id": candidate_ids[i], "semantic_score": float(similarities[i])} for i in top_indices]
+    # Filtered top-k search straight over the normalized index; no vectors are copied.
+    # A category filter only searches that category's shard when the bundle has shards.
+    shard_keys = shards_for(context) if bundle.vector_shards is not None else None
+    if shard_keys is not None:
+        top_rows, similarities = bundle.vector_shards.search(user_vector, num_to_retrieve, shard_keys, mask=candidate_mask)
+    else:
+        top_rows, similarities = engine.search(user_vector, num_to_retrieve, mask=candidate_mask)
     
     final_recs = []
     
     # Stage 3: Scoring & Re-ranking
-    if use_reranker and cross_encoder_model:
+    if not use_reranker and bundle.job_skill_matrix is not None and bundle.job_attribute_index is not None:
+        # --- Vectorized Weighted Scoring Path (for Web API) ---
+        final_recs = _score_rows(context, top_rows, similarities, top_k, bundle)
+
+    elif use_reranker and reranker.is_available():
         # --- Cross-Encoder Path (for Email) ---
+        retrieved_candidates = _as_candidates(top_rows, similarities, bundle)
         print(f"--- Re-ranking {len(retrieved_candidates)} candidates for user {user_id} with Cross-Encoder ---")
-        user_text = _build_user_text(user_id)
-        retrieved_job_ids = [c['job_id'] for c in retrieved_candidates]
-        job_texts_map = _build_job_texts_for_reranking(retrieved_job_ids)
-        sentence_pairs = [[user_text, job_texts_map.get(job_id, "")] for job_id in retrieved_job_ids]
-        cross_encoder_scores = cross_encoder_model.predict(sentence_pairs)
+        user_text = context.text
+        cross_encoder_scores = reranker.score_pairs([(user_text, c['job_id']) for c in retrieved_candidates])
         
         for i, candidate in enumerate(retrieved_candidates):
             candidate['final_score'] = float(cross_encoder_scores[i])
@@ -340,9 +348,9 @@ def get_recommendations_for_user(user_id: int, top_k: int = 10, retrieval_k: int
         final_recs = sorted(retrieved_candidates, key=lambda x: x['final_score'], reverse=True)[:top_k]
 
     else:
-        # --- Weighted Scoring Path (for Web API) ---
-        # *** THE CORE FIX IS HERE: WE NOW CALL THE SCORING FUNCTION ***
-        rescored_candidates = _calculate_scores_for_candidates(user_id, retrieved_candidates)
+        # --- Weighted Scoring Path (for Web API, database fallback) ---
+        retrieved_candidates = _as_candidates(top_rows, similarities, bundle)
+        rescored_candidates = _calculate_scores_for_candidates(context, retrieved_candidates)
         
         # Sort by the new final_score
         final_recs = sorted(rescored_candidates, key=lambda x: x.get('final_score', 0), reverse=True)[:top_k]
@@ -350,27 +358,30 @@ def get_recommendations_for_user(user_id: int, top_k: int = 10, retrieval_k: int
     # Stage 4: Enrich with Details (unchanged, but now uses the correct `final_recs`)
     if not final_recs: return []
 
-    final_job_ids = [rec['job_id'] for rec in final_recs]
-    scores_map = {rec['job_id']: rec for rec in final_recs}
-    
+    details = _fetch_job_details([rec['job_id'] for rec in final_recs])
+    if details is None: return []
+    results = _assemble_results(final_recs, context, *details)
+
+    if not use_reranker:
+        recommendation_cache.set(user_id, cache_key, results)
+    return results
+
+
+def _fetch_job_details(job_ids: list[int]) -> tuple[dict, dict] | None:
+    """
+    Display fields and skill names of the given jobs, as (jobs_data, job_skills_map).
+    Returns None if the database is unavailable.
+    """
     conn = get_db_connection()
-    if not conn: return []
-    
-    results = []
+    if not conn: return None
+
     try:
         with conn.cursor() as cur:
-            # Get skill names for the "reason" field
-            cur.execute("""
-                SELECT us.user_id, s.name FROM skills s
-                JOIN user_skills us ON s.id = us.skill_id WHERE us.user_id = %s
-            """, (user_id,))
-            user_skill_names = {row[1] for row in cur.fetchall()}
-
             cur.execute("""
                 SELECT js.job_id, s.name FROM skills s JOIN job_skill js ON s.id = js.skill_id
                 WHERE js.job_id = ANY(%s)
-            """, (final_job_ids,))
-            job_skills_map = {job_id: set() for job_id in final_job_ids}
+            """, (job_ids,))
+            job_skills_map = {job_id: set() for job_id in job_ids}
             for job_id, skill_name in cur.fetchall():
                 job_skills_map[job_id].add(skill_name)
             
@@ -379,51 +390,154 @@ def get_recommendations_for_user(user_id: int, top_k: int = 10, retrieval_k: int
                 SELECT jp.id, jp.title, c.name AS company_name, jp.city, jp.source_link
                 FROM job_postings jp JOIN companies c ON jp.company_id = c.id
                 WHERE jp.id = ANY(%s)
-            """, (final_job_ids,))
+            """, (job_ids,))
             jobs_data = {row[0]: dict(zip([desc[0] for desc in cur.description], row)) for row in cur.fetchall()}
-
-            # --- ENHANCED REASONING ---
-            # Assemble final response
-            for job_id in final_job_ids:
-                if job_id in jobs_data:
-                    job_info = jobs_data[job_id]
-                    job_info['score'] = scores_map[job_id].get('final_score', 0)
-                    
-                    matching_skills = user_skill_names.intersection(job_skills_map.get(job_id, set()))
-                    
-                    # Pass the full reasoning dictionary to the frontend
-                    job_info['reason'] = {
-                        "matched_skills": list(matching_skills),
-                        "details": scores_map[job_id].get('reasoning', {})
-                    }
-                    results.append(job_info)                  
+        return jobs_data, job_skills_map
     except Exception as e:
         print(f"Enrichment error: {e}")
+        return None
     finally:
-        conn.close()
+        release_db_connection(conn)
+
 
+def _assemble_results(final_recs: list[dict], context: UserContext, jobs_data: dict, job_skills_map: dict) -> list[dict]:
+    """Builds the response dicts, with the user's matched skills as the "reason"."""
+    # Skill names for the "reason" field come from the context
+    user_skill_names = set(context.skill_names)
+
+    # --- ENHANCED REASONING ---
+    results = []
+    for rec in final_recs:
+        job_id = rec['job_id']
+        if job_id in jobs_data:
+            # Copied, because batch callers share jobs_data between users
+            job_info = dict(jobs_data[job_id])
+            job_info['score'] = rec.get('final_score', 0)
+            
+            matching_skills = user_skill_names.intersection(job_skills_map.get(job_id, set()))
+            
+            # Pass the full reasoning dictionary to the frontend
+            job_info['reason'] = {
+                "matched_skills": list(matching_skills),
+                "details": rec.get('reasoning', {})
+            }
+            results.append(job_info)
     return results
 
 
-# --- 4. VERIFICATION BLOCK (UNCHANGED) ---
+def invalidate_user_recommendations(user_id: int):
+    """Drops cached results for a user, e.g. after their profile changed."""
+    recommendation_cache.invalidate_owner(int(user_id))
+
+
+# --- 5. BATCH PIPELINE (BULK ALERTS) ---
+
+def get_recommendations_for_users(contexts: list[UserContext], top_k: int = 10, retrieval_k: int = 50,
+                                  use_reranker: bool = True) -> dict[int, list[dict]]:
+    """
+    The recommendation pipeline for many users at once (bulk email alerts).
+    The stages are the same as in get_recommendations_for_user, but each runs
+    once per batch: one embedding call for the missing user vectors, one batched
+    search for retrieval (VectorSearchEngine.search_many, or the category shards
+    exactly as for a single user), one cross-encoder call for every (user, job)
+    pair and one query for job details.
+
+    Returns:
+        dict: user_id -> recommendations (empty for users without any match).
+    """
+    bundle = get_artifacts()
+    engine = bundle.vector_search_engine
+    results = {context.user_id: [] for context in contexts}
+    if engine is None or not contexts: return results
+
+    # Stage 1: Candidate Generation (Sieve), one mask per user
+    masks = {}
+    for context in contexts:
+        mask = get_candidate_mask(context, bundle=bundle)
+        if mask is None:
+            mask = np.zeros(engine.size, dtype=bool)
+            mask[engine.rows_for_ids(_get_filtered_job_ids_sql(context))] = True
+        if mask.any():
+            masks[context.user_id] = mask
+
+    # Stage 2: Initial Retrieval (Bi-Encoder) for the whole batch
+    user_vectors = get_user_vectors([c for c in contexts if c.user_id in masks])
+    users = [c for c in contexts if c.user_id in masks and c.user_id in user_vectors]
+    if not users: return results
+
+    # Same search path as a single user: category shards where the filters allow,
+    # else the engine, which batches every user it scores exactly.
+    num_to_retrieve = retrieval_k if use_reranker else (top_k * 2)
+    retrieved = {}
+    engine_users = []
+    for context in users:
+        shard_keys = shards_for(context) if bundle.vector_shards is not None else None
+        if shard_keys is not None:
+            retrieved[context.user_id] = bundle.vector_shards.search(
+                user_vectors[context.user_id], num_to_retrieve, shard_keys, mask=masks[context.user_id])
+        else:
+            engine_users.append(context)
+    if engine_users:
+        found = engine.search_many(np.stack([user_vectors[c.user_id] for c in engine_users]), num_to_retrieve,
+                                   [masks[c.user_id] for c in engine_users])
+        for context, result in zip(engine_users, found):
+            retrieved[context.user_id] = result
+
+    # Stage 3: Scoring & Re-ranking
+    final_recs = {}
+    if use_reranker and reranker.is_available():
+        candidates = {c.user_id: _as_candidates(*retrieved[c.user_id], bundle) for c in users}
+        sentence_pairs = [(context.text, cand['job_id']) for context in users for cand in candidates[context.user_id]]
+        print(f"--- Re-ranking {len(sentence_pairs)} pairs for {len(users)} users with Cross-Encoder ---")
+        cross_encoder_scores = reranker.score_pairs(sentence_pairs)
+
+        offset = 0
+        for context in users:
+            cands = candidates[context.user_id]
+            for cand, score in zip(cands, cross_encoder_scores[offset:offset + len(cands)]):
+                cand['final_score'] = float(score)
+            offset += len(cands)
+            final_recs[context.user_id] = sorted(cands, key=lambda x: x['final_score'], reverse=True)[:top_k]
+    elif bundle.job_skill_matrix is not None and bundle.job_attribute_index is not None:
+        for context in users:
+            final_recs[context.user_id] = _score_rows(context, *retrieved[context.user_id], top_k, bundle)
+    else:
+        for context in users:
+            rescored = _calculate_scores_for_candidates(context, _as_candidates(*retrieved[context.user_id], bundle))
+            final_recs[context.user_id] = sorted(rescored, key=lambda x: x.get('final_score', 0), reverse=True)[:top_k]
+
+    # Stage 4: Enrich with Details, one query for the whole batch
+    all_job_ids = sorted({rec['job_id'] for recs in final_recs.values() for rec in recs})
+    if not all_job_ids: return results
+    details = _fetch_job_details(all_job_ids)
+    if details is None: return results
+    for context in users:
+        results[context.user_id] = _assemble_results(final_recs[context.user_id], context, *details)
+    return results
+
+
+# --- 6. VERIFICATION BLOCK (UNCHANGED) ---
 if __name__ == "__main__":
     print("\n--- Running Verification for Day 3 Deliverables (Revised) ---")
     
     TEST_USER_ID = 1 # Make sure this user has a complete profile
 
     print(f"\n1. Building user text for user_id: {TEST_USER_ID}")
-    user_text_for_embedding = _build_user_text(TEST_USER_ID)
+    test_context = load_user_context(TEST_USER_ID)
+    if test_context is None:
+        raise SystemExit(f"   - FAILED: user_id {TEST_USER_ID} does not exist.")
+    user_text_for_embedding = test_context.text
     print(f"   - Generated Text: '{user_text_for_embedding[:200]}...'") # Print a snippet
 
     print(f"\n2. Generating vector for user_id: {TEST_USER_ID}")
-    user_vector = get_user_vector(TEST_USER_ID)
+    user_vector = get_user_vector(test_context)
     if user_vector is not None:
         print("   - Verification passed: Vector is valid.")
     else:
         print("   - FAILED to generate user vector.")
 
     print(f"\n3. Applying revised hard filters for user_id: {TEST_USER_ID}")
-    filtered_ids = get_filtered_job_ids(TEST_USER_ID)
+    filtered_ids = get_filtered_job_ids(test_context)
     if filtered_ids is not None:
         print(f"   - Found {len(filtered_ids)} candidate jobs matching the user's new preferences.")
         if len(filtered_ids) > 0:
@@ -432,4 +546,13 @@ if __name__ == "__main__":
     else:
         print("   - FAILED to get filtered jobs.")
 
+    job_attribute_index = get_artifacts().job_attribute_index
+    if job_attribute_index is not None:
+        print(f"\n4. Comparing the in-process sieve with the SQL sieve for user_id: {TEST_USER_ID}")
+        sql_ids = set(_get_filtered_job_ids_sql(test_context)) & set(job_attribute_index.job_ids.tolist())
+        if sql_ids == set(filtered_ids):
+            print("   - Verification passed: both sieves return the same indexed jobs.")
+        else:
+            print(f"   - MISMATCH: {len(sql_ids ^ set(filtered_ids))} jobs differ between the two sieves.")
+
     print("\n--- Day 3 Deliverables Complete and Verified! ---")
\ No newline at end of file
@@ -0,0 +1,108 @@
+# services/relevance_service.py
+"""
+TF-IDF relevance sorting for the job hub (`/api/jobs?sortBy=relevance`).
+
+The old code path scanned the whole TF-IDF job ID list in Python to find the
+filtered rows, ran sklearn's cosine similarity, fully argsorted every match
+and then threw all but 12 rows away, repeating everything on every page.
+This engine instead:
+
+- maps job IDs to matrix rows through a precomputed sorted array,
+- scores with one sparse dot product against L2-normalized rows,
+- partially sorts only as deep as the requested page, and
+- returns a `Ranking` that callers cache per (user, filters), so later pages
+  are served from memory.
+"""
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.cache import TTLCache
+from services.vector_search import top_k_indices
+
+load_dotenv()
+
+
+class Ranking:
+    """
+    The relevance order of one filtered job set for one user.
+    Only a prefix is actually sorted; it is extended when a deeper page is asked for.
+    """
+
+    def __init__(self, job_ids: np.ndarray, scores: np.ndarray):
+        self.job_ids = job_ids
+        self.scores = scores
+        self._ranked = np.empty(0, dtype=np.int64)
+        self._lock = threading.Lock()
+
+    @property
+    def total(self) -> int:
+        return int(self.job_ids.size)
+
+    def page(self, offset: int, limit: int) -> list[int]:
+        """Job IDs at positions [offset, offset + limit) of the ranking."""
+        needed = min(offset + limit, self.total)
+        if needed > self._ranked.size:
+            with self._lock:
+                if needed > self._ranked.size:
+                    # Sort a few pages ahead so paging forward stays a slice.
+                    depth = min(self.total, max(needed, 2 * self._ranked.size, 5 * limit))
+                    self._ranked = top_k_indices(self.scores, depth)
+        return self.job_ids[self._ranked[offset:needed]].tolist()
+
+
+class RelevanceEngine:
+    """
+    Args:
+        vectorizer: The fitted TfidfVectorizer.
+        matrix: TF-IDF matrix with one row per job.
+        job_ids: Job ID of every matrix row.
+        normalized: The rows are known to be L2-normalized already (e.g. a
+            memory-mapped matrix from the artifact bundle), so no copy is made.
+    """
+
+    def __init__(self, vectorizer, matrix, job_ids, normalized: bool = False):
+        from sklearn.preprocessing import normalize
+
+        self.vectorizer = vectorizer
+        # Normalizing once here guarantees that a dot product is a cosine similarity.
+        self.matrix = matrix.tocsr() if normalized else normalize(matrix.tocsr(), norm='l2', copy=True)
+        self.job_ids = np.asarray(job_ids, dtype=np.int64)
+        self._order = np.argsort(self.job_ids, kind='stable')
+        self._sorted_ids = self.job_ids[self._order]
+
+    def rows_for_ids(self, job_ids) -> np.ndarray:
+        """Matrix rows of the given job IDs, skipping jobs without a TF-IDF row."""
+        ids = np.asarray(list(job_ids), dtype=np.int64)
+        if ids.size == 0 or self._sorted_ids.size == 0:
+            return np.empty(0, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos[pos >= self._sorted_ids.size] = 0
+        found = self._sorted_ids[pos] == ids
+        return self._order[pos[found]]
+
+    def rank(self, user_text: str, candidate_job_ids) -> Ranking | None:
+        """
+        Scores the candidate jobs against the user's text.
+        Returns None if none of the candidates has a TF-IDF row.
+        """
+        from sklearn.preprocessing import normalize
+
+        rows = np.sort(self.rows_for_ids(candidate_job_ids))
+        if rows.size == 0:
+            return None
+        user_vector = normalize(self.vectorizer.transform([user_text]), norm='l2')
+        # Sparse (n_candidates x vocab) @ (vocab x 1): only the candidate rows are scored.
+        scores = (self.matrix[rows] @ user_vector.T).toarray().ravel()
+        return Ranking(self.job_ids[rows], scores)
+
+
+# Ranked job lists per user, keyed by (search, province, category_id, tfidf_version).
+# Rankings hold NumPy arrays and a lock, so they stay in-process (no Redis).
+relevance_cache = TTLCache(
+    "relevance",
+    max_entries=int(os.getenv('RELEVANCE_CACHE_SIZE', 1024)),
+    ttl_seconds=float(os.getenv('RELEVANCE_CACHE_TTL', 300)),
+)
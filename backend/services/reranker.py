@@ -0,0 +1,245 @@
+# services/reranker.py
+"""
+Cross-encoder re-ranking of (user text, job) pairs.
+
+Three things keep the cross-encoder cheap:
+
+1. Score cache. Scores are stored in Postgres keyed by (user-text hash,
+   job ID, model version), so re-running alerts or evaluation only scores
+   pairs it has never seen. Postings are never rewritten once scraped, so
+   the job ID identifies the job text; the model version includes the token
+   budgets below, because truncation changes the score.
+2. Token budget. Each side of a pair is cut to a fixed number of tokens
+   before scoring, instead of feeding full job descriptions to the model.
+3. Length bucketing. Pairs are sorted by token length before batching, so
+   each forward pass pads to a similar length instead of the longest pair
+   in a random batch.
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from services.db import get_db_connection, release_db_connection
+from services.onnx_backend import BACKEND_TAG, use_onnx, load_cross_encoder
+from services.startup import timed
+
+# --- 1. CONFIGURATION & MODEL LOADING ---
+CROSS_ENCODER_MODEL_NAME = 'cross-encoder/ms-marco-MiniLM-L-6-v2'
+# Pairs per cross-encoder forward pass.
+CROSS_ENCODER_BATCH_SIZE = int(os.getenv('CROSS_ENCODER_BATCH_SIZE', 128))
+# Token budget per side of a pair (user text, job text).
+RERANKER_MAX_QUERY_TOKENS = int(os.getenv('RERANKER_MAX_QUERY_TOKENS', 128))
+RERANKER_MAX_JOB_TOKENS = int(os.getenv('RERANKER_MAX_JOB_TOKENS', 256))
+# Set to False to always score with the model (e.g. when comparing models).
+RERANKER_SCORE_CACHE = os.getenv('RERANKER_SCORE_CACHE', 'True').lower() in ('true', '1', 'yes')
+
+CROSS_ENCODER_BACKEND = BACKEND_TAG if use_onnx(CROSS_ENCODER_MODEL_NAME) else 'torch'
+# Cached scores are only reused for the same model, backend and token budgets.
+MODEL_VERSION = (f"{CROSS_ENCODER_MODEL_NAME}@{CROSS_ENCODER_BACKEND}"
+                 f"|q{RERANKER_MAX_QUERY_TOKENS}|d{RERANKER_MAX_JOB_TOKENS}")
+
+# Only the email path re-ranks, so the model is loaded on first use, never at import.
+_cross_encoder_model = None
+_load_failed = False
+_model_lock = threading.Lock()
+
+
+def get_cross_encoder():
+    """The Cross-Encoder, loaded on first call. None if it could not be loaded."""
+    global _cross_encoder_model, _load_failed
+    if _cross_encoder_model is None and not _load_failed:
+        with _model_lock:
+            if _cross_encoder_model is None and not _load_failed:
+                try:
+                    print("Loading Cross-Encoder model for re-ranking...")
+                    with timed("cross_encoder"):
+                        if CROSS_ENCODER_BACKEND == BACKEND_TAG:
+                            _cross_encoder_model = load_cross_encoder(CROSS_ENCODER_MODEL_NAME)
+                        else:
+                            from sentence_transformers import CrossEncoder
+                            # This is a powerful, multilingual model trained for semantic relevance.
+                            _cross_encoder_model = CrossEncoder(CROSS_ENCODER_MODEL_NAME)
+                    print(f"Cross-Encoder model loaded successfully ({CROSS_ENCODER_BACKEND}).")
+                except Exception as e:
+                    _load_failed = True
+                    print(f"CRITICAL WARNING: Could not load Cross-Encoder model: {e}")
+    return _cross_encoder_model
+
+
+def is_available() -> bool:
+    return get_cross_encoder() is not None
+
+
+# --- 2. SCORE CACHE ---
+_CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS cross_encoder_scores (
+        text_hash TEXT NOT NULL,
+        job_id INTEGER NOT NULL,
+        model_version TEXT NOT NULL,
+        score REAL NOT NULL,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+        PRIMARY KEY (text_hash, job_id, model_version)
+    )
+"""
+
+_table_ready = False
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _ensure_table(conn):
+    """Creates the `cross_encoder_scores` table the first time this process needs it."""
+    global _table_ready
+    if _table_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(_CREATE_TABLE_SQL)
+    conn.commit()
+    _table_ready = True
+
+
+def _load_cached_scores(conn, keys: set[tuple[str, int]]) -> dict[tuple[str, int], float]:
+    hashes = sorted({text_hash for text_hash, _ in keys})
+    job_ids = sorted({job_id for _, job_id in keys})
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT text_hash, job_id, score FROM cross_encoder_scores
+            WHERE model_version = %s AND text_hash = ANY(%s) AND job_id = ANY(%s)
+        """, (MODEL_VERSION, hashes, job_ids))
+        return {(text_hash, job_id): score for text_hash, job_id, score in cur.fetchall()
+                if (text_hash, job_id) in keys}
+
+
+def _save_scores(conn, scores: dict[tuple[str, int], float]):
+    if not scores:
+        return
+    with conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO cross_encoder_scores (text_hash, job_id, model_version, score)
+            VALUES %s
+            ON CONFLICT (text_hash, job_id, model_version) DO NOTHING
+        """, [(text_hash, job_id, MODEL_VERSION, float(score)) for (text_hash, job_id), score in scores.items()])
+    conn.commit()
+
+
+def _fetch_job_texts(conn, job_ids: list[int]) -> dict[int, str]:
+    """The title, description and skill names of each job, as one text."""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT jp.id, COALESCE(jp.title, '') || ' ' || COALESCE(jp.job_description, '') || ' ' || COALESCE(STRING_AGG(s.name, ' '), '') as job_text
+            FROM job_postings jp
+            LEFT JOIN job_skill js ON jp.id = js.job_id
+            LEFT JOIN skills s ON js.skill_id = s.id
+            WHERE jp.id = ANY(%s)
+            GROUP BY jp.id
+        """, (job_ids,))
+        return dict(cur.fetchall())
+
+
+# --- 3. TRUNCATION & BUCKETED INFERENCE ---
+def truncate_texts(texts: list[str], max_tokens: int) -> tuple[list[str], list[int]]:
+    """
+    Cuts each text to at most `max_tokens` model tokens, at a token boundary
+    of the original string. Returns the cut texts and their token counts.
+    """
+    tokenizer = get_cross_encoder().tokenizer
+    encoded = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+    cut, lengths = [], []
+    for text, offsets in zip(texts, encoded['offset_mapping']):
+        if len(offsets) > max_tokens:
+            text = text[:offsets[max_tokens - 1][1]]
+        cut.append(text)
+        lengths.append(min(len(offsets), max_tokens))
+    return cut, lengths
+
+
+def predict_bucketed(pairs: list[tuple[str, str]], lengths: np.ndarray,
+                     batch_size: int = CROSS_ENCODER_BATCH_SIZE) -> np.ndarray:
+    """
+    Scores pairs in order of their token length, so every batch holds pairs
+    of similar length, and returns the scores in the original order.
+    """
+    if not pairs:
+        return np.empty(0, dtype=np.float32)
+    order = np.argsort(lengths, kind='stable')
+    sorted_scores = get_cross_encoder().predict([pairs[i] for i in order], batch_size=batch_size,
+                                                show_progress_bar=False)
+    scores = np.empty(len(pairs), dtype=np.float32)
+    scores[order] = np.asarray(sorted_scores, dtype=np.float32).reshape(len(pairs))
+    return scores
+
+
+def score_texts(pairs: list[tuple[str, str]], batch_size: int = CROSS_ENCODER_BATCH_SIZE) -> np.ndarray:
+    """Scores raw (user text, job text) pairs with truncation and length bucketing, without the cache."""
+    # Each user text recurs across many pairs, so every distinct text is tokenized once.
+    queries = sorted({q for q, _ in pairs})
+    documents = sorted({d for _, d in pairs})
+    cut_q, len_q = truncate_texts(queries, RERANKER_MAX_QUERY_TOKENS)
+    cut_d, len_d = truncate_texts(documents, RERANKER_MAX_JOB_TOKENS)
+    q_map = dict(zip(queries, zip(cut_q, len_q)))
+    d_map = dict(zip(documents, zip(cut_d, len_d)))
+
+    truncated = [(q_map[q][0], d_map[d][0]) for q, d in pairs]
+    lengths = np.array([q_map[q][1] + d_map[d][1] for q, d in pairs])
+    return predict_bucketed(truncated, lengths, batch_size)
+
+
+# --- 4. PUBLIC API ---
+def score_pairs(pairs: list[tuple[str, int]], batch_size: int = CROSS_ENCODER_BATCH_SIZE) -> np.ndarray:
+    """
+    Cross-encoder scores for (user text, job ID) pairs, in input order.
+    Cached scores are reused; only the remaining pairs have their job text
+    fetched and go through the model, and their scores are stored.
+    """
+    if not pairs:
+        return np.empty(0, dtype=np.float32)
+    if get_cross_encoder() is None:
+        raise RuntimeError("Cross-Encoder model is not loaded.")
+
+    keys = [(_text_hash(text), int(job_id)) for text, job_id in pairs]
+    conn = get_db_connection()
+    try:
+        cached = {}
+        if conn and RERANKER_SCORE_CACHE:
+            try:
+                _ensure_table(conn)
+                cached = _load_cached_scores(conn, set(keys))
+            except Exception as e:
+                conn.rollback()
+                print(f"Warning: cross-encoder score cache lookup failed, scoring every pair: {e}")
+
+        hits = sum(key in cached for key in keys)
+        # Distinct uncached pairs; the same pair can appear for several users with one text.
+        pending = {}
+        for (text, job_id), key in zip(pairs, keys):
+            if key not in cached:
+                pending.setdefault(key, text)
+
+        if pending:
+            job_texts = {}
+            if conn:
+                try:
+                    job_texts = _fetch_job_texts(conn, sorted({job_id for _, job_id in pending}))
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Error building job texts for reranking: {e}")
+            pending_keys = list(pending)
+            new_scores = score_texts([(pending[key], job_texts.get(key[1], "")) for key in pending_keys], batch_size)
+            fresh = dict(zip(pending_keys, new_scores.tolist()))
+            cached.update(fresh)
+            if conn and RERANKER_SCORE_CACHE:
+                try:
+                    _save_scores(conn, fresh)
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Warning: could not store cross-encoder scores: {e}")
+
+        print(f"Cross-Encoder: {len(pairs)} pairs, {hits} from cache, {len(pending)} scored.")
+        return np.array([cached[key] for key in keys], dtype=np.float32)
+    finally:
+        if conn: release_db_connection(conn)
@@ -0,0 +1,79 @@
+# services/scoring.py
+"""
+Array-based weighted scoring for the web recommendation path.
+
+    final = w_semantic * semantic + w_skill * skill_overlap + w_recency * recency
+
+Every term is computed for all candidates at once with NumPy, so the cost per
+candidate is a few vectorized operations instead of a Python loop iteration
+with its own `datetime.now()` and dict. Only the final top_k get a reasoning
+dict. The weights are configurable through the environment.
+"""
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+from dotenv import load_dotenv
+
+from services.vector_search import top_k_indices
+
+load_dotenv()
+
+SCORING_WEIGHTS = {
+    "semantic": float(os.getenv('SCORE_WEIGHT_SEMANTIC', 0.6)),
+    "skill": float(os.getenv('SCORE_WEIGHT_SKILL', 0.3)),
+    "recency": float(os.getenv('SCORE_WEIGHT_RECENCY', 0.1)),
+}
+# A posting's recency score decays linearly to zero over this many days.
+RECENCY_WINDOW_DAYS = 45.0
+
+
+def recency_scores(scraped_at: np.ndarray, now: datetime | None = None) -> np.ndarray:
+    """max(0, 1 - whole_days_since_posted / 45) per job; 0 for unknown post dates."""
+    now_ts = (now or datetime.now(timezone.utc)).timestamp()
+    days_since_posted = np.floor((now_ts - scraped_at) / 86400.0)
+    scores = np.maximum(0.0, 1.0 - days_since_posted / RECENCY_WINDOW_DAYS)
+    return np.nan_to_num(scores, nan=0.0)
+
+
+def score_and_select(job_ids: np.ndarray, semantic: np.ndarray, matched_counts: np.ndarray,
+                     required_counts: np.ndarray, scraped_at: np.ndarray, top_k: int,
+                     weights: dict | None = None, now: datetime | None = None) -> list[dict]:
+    """
+    Scores all candidates column-wise and returns the best top_k as dicts.
+
+    Args:
+        job_ids, semantic, matched_counts, required_counts, scraped_at:
+            Parallel arrays, one entry per candidate.
+        top_k: How many recommendations to return.
+        weights: Overrides for SCORING_WEIGHTS.
+
+    Returns:
+        list[dict]: {job_id, semantic_score, final_score, reasoning}, best first.
+        Jobs that list no skills are skipped, as before.
+    """
+    weights = {**SCORING_WEIGHTS, **(weights or {})}
+    semantic = np.asarray(semantic, dtype=np.float64)
+
+    skill = np.divide(matched_counts, required_counts, out=np.zeros(semantic.shape, dtype=np.float64),
+                      where=required_counts > 0)
+    recency = recency_scores(scraped_at, now)
+    final = weights["semantic"] * semantic + weights["skill"] * skill + weights["recency"] * recency
+
+    # Jobs without any listed skills can't be explained and are dropped.
+    final = np.where(required_counts > 0, final, -np.inf)
+    top = top_k_indices(final, min(top_k, int(np.count_nonzero(required_counts > 0))))
+
+    return [
+        {
+            "job_id": int(job_ids[i]),
+            "semantic_score": float(semantic[i]),
+            "final_score": float(final[i]),
+            "reasoning": {
+                "matched_skills_count": int(matched_counts[i]),
+                "skill_score": float(skill[i]),
+                "recency_score": float(recency[i]),
+            },
+        }
+        for i in top
+    ]
@@ -0,0 +1,105 @@
+# services/startup.py
+"""
+Startup timing and readiness of the API process.
+
+Models and artifacts are loaded lazily by their own modules (the
+embedding model by services.embedding_service, the cross-encoder by
+services.reranker, the bundle by services.artifacts), so the process can
+accept requests such as login or categories right away. `warm_up` loads
+them in a background thread so the first recommendation request doesn't
+pay for it. Until it finishes, the readiness check reports "not ready"
+while the liveness check already passes.
+
+Every load is timed with `timed(...)`, and `startup_report()` lists those
+timings next to the import time of the API module.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Warm the models and artifacts in the background as soon as the API starts.
+WARMUP_ON_START = os.getenv('WARMUP_ON_START', 'True').lower() in ('true', '1', 'yes')
+# The web path never re-ranks, so the cross-encoder is only warmed when asked for.
+WARMUP_RERANKER = os.getenv('WARMUP_RERANKER', 'False').lower() in ('true', '1', 'yes')
+
+_process_started = time.time()
+_timings = {}
+_timings_lock = threading.Lock()
+_warmup = {"started": False, "done": threading.Event(), "errors": {}}
+
+
+def record(name: str, seconds: float):
+    with _timings_lock:
+        _timings[name] = round(seconds, 3)
+
+
+@contextmanager
+def timed(name: str):
+    """Records how long the block took under `name` and prints it."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        record(name, elapsed)
+        print(f"Startup: {name} took {elapsed:.2f}s")
+
+
+def _run_warm_up(steps: list):
+    for name, fn in steps:
+        try:
+            fn()
+        except Exception as e:
+            _warmup["errors"][name] = str(e)
+            print(f"CRITICAL WARNING (startup): warm-up step '{name}' failed: {e}")
+    record("warm_up_total", time.time() - _warmup["started_at"])
+    with _timings_lock:
+        summary = ", ".join(f"{name}={seconds:.2f}s" for name, seconds in _timings.items())
+    print(f"Startup report: {summary}")
+    _warmup["done"].set()
+
+
+def warm_up(background: bool = True):
+    """
+    Loads the artifact bundle and the embedding model, or checks the shared
+    embedding server if one is configured (and loads the cross-encoder if
+    WARMUP_RERANKER is set). Runs once per process.
+    """
+    from services.artifacts import get_artifacts
+    from services.embedding_service import prepare_embeddings
+
+    if _warmup["started"]:
+        return
+    _warmup["started"] = True
+    _warmup["started_at"] = time.time()
+
+    steps = [("artifacts", get_artifacts), ("embeddings", prepare_embeddings)]
+    if WARMUP_RERANKER:
+        from services.reranker import get_cross_encoder
+        steps.append(("cross_encoder", get_cross_encoder))
+
+    if background:
+        threading.Thread(target=_run_warm_up, args=(steps,), name="warm-up", daemon=True).start()
+    else:
+        _run_warm_up(steps)
+
+
+def is_warm() -> bool:
+    return _warmup["done"].is_set()
+
+
+def startup_report() -> dict:
+    """Import and load timings so far, in seconds."""
+    with _timings_lock:
+        timings = dict(_timings)
+    return {
+        "uptime_seconds": round(time.time() - _process_started, 1),
+        "warm_up": "done" if is_warm() else ("running" if _warmup["started"] else "not started"),
+        "warm_up_errors": dict(_warmup["errors"]),
+        "timings_seconds": timings,
+    }
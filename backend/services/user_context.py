@@ -0,0 +1,138 @@
+# services/user_context.py
+"""
+Everything the recommendation pipeline needs to know about a user, loaded in
+a single round trip.
+
+The pipeline stages (sieve, bi-encoder, weighted scoring, re-ranking and
+enrichment) used to query the same profile, skills and experiences again and
+again. A `UserContext` is loaded once per request and passed through every
+stage instead; `load_user_contexts` does the same for many users at once for
+the alert and evaluation jobs.
+"""
+from dataclasses import dataclass, field
+
+from services.db import get_db_connection, release_db_connection
+
+# One row per user. Skills and experiences are folded into JSON arrays so the
+# whole context arrives in one query; psycopg2 decodes them into Python lists.
+_USER_CONTEXT_QUERY = """
+    SELECT
+        u.id, u.email,
+        up.user_id IS NOT NULL AS has_profile,
+        up.first_name, up.last_name, up.professional_title,
+        up.preferred_provinces, up.wants_full_time, up.wants_part_time,
+        up.wants_remote, up.wants_onsite, up.wants_internship,
+        up.experience_level, up.preferred_category_id,
+        COALESCE((
+            SELECT json_agg(json_build_object('id', s.id, 'name', s.name) ORDER BY s.id)
+            FROM user_skills us JOIN skills s ON s.id = us.skill_id
+            WHERE us.user_id = u.id
+        ), '[]'::json) AS skills,
+        COALESCE((
+            SELECT json_agg(we.description ORDER BY we.id)
+            FROM work_experiences we
+            WHERE we.user_id = u.id AND we.description IS NOT NULL AND we.description != ''
+        ), '[]'::json) AS experiences
+    FROM users u
+    LEFT JOIN user_profiles up ON up.user_id = u.id
+    WHERE u.id = ANY(%s)
+"""
+
+
+@dataclass
+class UserContext:
+    """A read-only snapshot of one user's profile, preferences and skills."""
+    user_id: int
+    email: str | None = None
+    has_profile: bool = False
+    first_name: str | None = None
+    last_name: str | None = None
+    professional_title: str | None = None
+    preferred_provinces: str | None = None
+    wants_full_time: bool = False
+    wants_part_time: bool = False
+    wants_remote: bool = False
+    wants_onsite: bool = False
+    wants_internship: bool = False
+    experience_level: int | None = None
+    preferred_category_id: int | None = None
+    skill_ids: list[int] = field(default_factory=list)
+    skill_names: list[str] = field(default_factory=list)
+    experience_descriptions: list[str] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        """
+        The descriptive text used for embedding and re-ranking: the user's
+        professional title, their skills, and their detailed work experience.
+        """
+        full_text_parts = []
+        if self.professional_title:
+            full_text_parts.append(self.professional_title)
+        if self.skill_names:
+            full_text_parts.append(f"Skills include: {', '.join(self.skill_names)}")
+        if self.experience_descriptions:
+            full_text_parts.append(f"Past work experience: {' '.join(self.experience_descriptions)}")
+        return ". ".join(filter(None, full_text_parts))
+
+    @property
+    def province_list(self) -> list[str]:
+        """The comma-separated `preferred_provinces` column as a clean list."""
+        if not self.preferred_provinces:
+            return []
+        return [p.strip() for p in self.preferred_provinces.split(',') if p.strip()]
+
+
+def _row_to_context(row) -> UserContext:
+    (user_id, email, has_profile, first_name, last_name, title,
+     provinces, full_time, part_time, remote, onsite, internship,
+     exp_level, cat_id, skills, experiences) = row
+    return UserContext(
+        user_id=user_id, email=email, has_profile=has_profile,
+        first_name=first_name, last_name=last_name, professional_title=title,
+        preferred_provinces=provinces,
+        wants_full_time=bool(full_time), wants_part_time=bool(part_time),
+        wants_remote=bool(remote), wants_onsite=bool(onsite), wants_internship=bool(internship),
+        experience_level=exp_level, preferred_category_id=cat_id,
+        skill_ids=[s['id'] for s in skills],
+        skill_names=[s['name'] for s in skills],
+        experience_descriptions=list(experiences),
+    )
+
+
+def load_user_contexts(user_ids: list[int], conn=None) -> dict[int, UserContext]:
+    """
+    Loads the contexts of many users with a single query.
+
+    Args:
+        user_ids: The users to load. Unknown IDs are simply absent from the result.
+        conn: An optional connection to reuse; otherwise one is checked out of the pool.
+
+    Returns:
+        dict: user_id -> UserContext
+    """
+    if not user_ids:
+        return {}
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if not conn: return {}
+
+    contexts = {}
+    try:
+        with conn.cursor() as cur:
+            cur.execute(_USER_CONTEXT_QUERY, (list(user_ids),))
+            for row in cur.fetchall():
+                context = _row_to_context(row)
+                contexts[context.user_id] = context
+    except Exception as e:
+        print(f"Error loading user contexts: {e}")
+    finally:
+        if own_conn: release_db_connection(conn)
+    return contexts
+
+
+def load_user_context(user_id: int, conn=None) -> UserContext | None:
+    """Loads one user's context, or returns None if the user does not exist."""
+    return load_user_contexts([user_id], conn=conn).get(int(user_id))
@@ -0,0 +1,140 @@
+# services/user_embedding_store.py
+"""
+Persistent cache of user embeddings.
+
+Running the SentenceTransformer dominated the latency of every recommendation
+request, even though most profiles change rarely. Each user's vector is
+stored in Postgres together with a hash of the text it was computed from and
+the embedding model's name. A request only runs the model when the profile
+text or the model changed since the vector was stored; `update_profile`
+refreshes the row right after the profile is saved, so in the common case a
+recommendation request does no model inference at all.
+"""
+import hashlib
+
+import numpy as np
+from psycopg2.extras import execute_values
+
+from services.db import get_db_connection, release_db_connection
+from services.embedding_service import embed_texts, EMBEDDING_MODEL_VERSION
+from services.user_context import UserContext, load_user_context
+
+_CREATE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS user_embeddings (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        text_hash TEXT NOT NULL,
+        model_name TEXT NOT NULL,
+        embedding BYTEA NOT NULL,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+    )
+"""
+
+_table_ready = False
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _ensure_table(conn):
+    """Creates the `user_embeddings` table the first time this process needs it."""
+    global _table_ready
+    if _table_ready:
+        return
+    with conn.cursor() as cur:
+        cur.execute(_CREATE_TABLE_SQL)
+    conn.commit()
+    _table_ready = True
+
+
+def _save_user_vectors(conn, rows: list[tuple]):
+    """Upserts (user_id, text_hash, vector) rows for the current model."""
+    if not rows:
+        return
+    with conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO user_embeddings (user_id, text_hash, model_name, embedding)
+            VALUES %s
+            ON CONFLICT (user_id) DO UPDATE SET
+                text_hash = EXCLUDED.text_hash,
+                model_name = EXCLUDED.model_name,
+                embedding = EXCLUDED.embedding,
+                updated_at = NOW()
+        """, [
+            (user_id, text_hash, EMBEDDING_MODEL_VERSION, np.asarray(vector, dtype=np.float32).tobytes())
+            for user_id, text_hash, vector in rows
+        ])
+    conn.commit()
+
+
+def get_user_vectors(contexts: list[UserContext], conn=None) -> dict[int, np.ndarray]:
+    """
+    Returns the embedding of every context that has profile text, computing
+    (in one `embed_texts` call) and storing only those that are missing or stale.
+
+    Returns:
+        dict: user_id -> float32 vector. Users without any profile text are absent.
+    """
+    hashes = {c.user_id: _text_hash(c.text) for c in contexts if c.text}
+    if not hashes:
+        return {}
+
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+
+    vectors = {}
+    try:
+        # 1. Look up stored vectors whose text hash and model still match
+        if conn:
+            try:
+                _ensure_table(conn)
+                with conn.cursor() as cur:
+                    cur.execute("""
+                        SELECT user_id, text_hash, embedding FROM user_embeddings
+                        WHERE user_id = ANY(%s) AND model_name = %s
+                    """, (list(hashes), EMBEDDING_MODEL_VERSION))
+                    for user_id, text_hash, embedding in cur.fetchall():
+                        if hashes.get(user_id) == text_hash:
+                            vectors[user_id] = np.frombuffer(bytes(embedding), dtype=np.float32)
+            except Exception as e:
+                conn.rollback()
+                print(f"Warning: user embedding lookup failed, falling back to the model: {e}")
+
+        # 2. Embed the misses in a single batch and store them for next time
+        missing = [c for c in contexts if c.user_id in hashes and c.user_id not in vectors]
+        if missing:
+            embeddings = embed_texts([c.text for c in missing])
+            for context, embedding in zip(missing, embeddings):
+                vectors[context.user_id] = embedding
+            if conn:
+                try:
+                    _save_user_vectors(conn, [(c.user_id, hashes[c.user_id], vectors[c.user_id]) for c in missing])
+                except Exception as e:
+                    conn.rollback()
+                    print(f"Warning: could not store user embeddings: {e}")
+    finally:
+        if own_conn: release_db_connection(conn)
+    return vectors
+
+
+def refresh_user_embedding(user_id: int, conn=None) -> bool:
+    """
+    Recomputes and stores a user's embedding if their profile text changed.
+    Called after a profile update is committed so the next recommendation
+    request finds a fresh vector.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = get_db_connection()
+        if not conn: return False
+    try:
+        context = load_user_context(user_id, conn=conn)
+        if context is None:
+            return False
+        return context.user_id in get_user_vectors([context], conn=conn)
+    except Exception as e:
+        print(f"Error refreshing embedding for user_id {user_id}: {e}")
+        return False
+    finally:
+        if own_conn: release_db_connection(conn)
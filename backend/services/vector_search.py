@@ -0,0 +1,263 @@
+# services/vector_search.py
+"""
+Filtered semantic retrieval over the job index.
+
+Stage 2 of the recommendation pipeline used to copy every candidate vector out
+of FAISS (`reconstruct_batch`), re-normalize them with sklearn's
+`cosine_similarity` and fully `argsort` the result. The job vectors are
+already L2-normalized by `embed_jobs.py`, so cosine similarity is a plain
+inner product. This engine searches the index directly with the candidate set
+as a filter:
+
+- With FAISS >= 1.7.3 the candidates become an `IDSelectorBitmap` and FAISS
+  computes inner products only for the selected rows, keeping the top-k in a
+  heap. Nothing is copied.
+- Otherwise it falls back to a masked dot product against the contiguous
+  vector matrix followed by an `argpartition` top-k.
+
+Indexes wrapped in an `IndexIDMap2` (incremental builds) are searched through
+their storage index, so results are always row positions.
+
+A bundle built with an approximate index (HNSW or IVF, services/ann_index.py)
+hands it in as `ann_index`. Broad filters are searched there; filters that
+allow fewer than ANN_MIN_ALLOWED_FRACTION of the rows, and approximate
+searches that come back with fewer than k rows, use the exact path above.
+
+With compact (float16 / int8) storage the `ann_index` holds quantized codes
+and `rescore` is set: it returns RESCORE_FACTOR times k candidates, which are
+re-scored exactly against `vectors`, the memory-mapped float32 rows. Such
+bundles pass no FAISS `index` at all, so the exact path is the masked dot
+product, which only reads the allowed rows.
+"""
+import numpy as np
+import faiss
+
+from services.ann_index import ANN_MIN_ALLOWED_FRACTION, RESCORE_FACTOR, search_parameters
+from services.index_io import mmap_flat_id_index, read_index_mmap
+
+_HAS_SEARCH_PARAMS = hasattr(faiss, 'SearchParameters') and hasattr(faiss, 'IDSelectorBitmap')
+# Rows scored per step by `search_many`'s exact path; bounds its temporary memory.
+_SCORE_BLOCK_ROWS = 16384
+
+
+def _index_vectors(index) -> np.ndarray:
+    """
+    Returns the index's vectors as an (ntotal, d) float32 matrix, sharing
+    memory with a flat index where possible instead of copying it.
+    """
+    if index.ntotal and hasattr(index, 'get_xb'):
+        try:
+            return faiss.rev_swig_ptr(index.get_xb(), index.ntotal * index.d).reshape(index.ntotal, index.d)
+        except Exception:
+            pass
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of the k largest scores, best first, via a partial sort.
+    Equal scores are ordered by position, lowest first, like a stable full
+    sort would, including which of them make the cut at the k-th place.
+    """
+    if k <= 0 or scores.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.size:
+        # argpartition picks arbitrarily among scores tied with the k-th largest,
+        # so take every one of them and let the sort below choose.
+        kth = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        top = np.flatnonzero(scores >= kth)
+    else:
+        top = np.arange(scores.size)
+    return top[np.lexsort((top, -scores[top]))][:k]
+
+
+class VectorSearchEngine:
+    """
+    Maps job IDs to index rows and runs filtered top-k inner-product searches.
+
+    Args:
+        index: A FAISS inner-product index whose row i holds the vector of job_ids[i].
+            It may be ID-mapped, in which case its ID map must equal job_ids.
+            May be None if `vectors` is given.
+        job_ids: Job ID of every index row.
+        ann_index: Optional approximate or compact index over the same rows (row i labelled i).
+        vectors: The exact (ntotal, d) float32 vectors, if `index` is not given.
+        rescore: Whether `ann_index` results are re-scored exactly against the vectors.
+    """
+
+    def __init__(self, index, job_ids: np.ndarray, ann_index=None, vectors: np.ndarray | None = None,
+                 rescore: bool = False):
+        # An ID-mapped index labels results with job IDs (and applies selectors to
+        # them); its storage index works on row positions like the rest of the pipeline.
+        self.index = faiss.downcast_index(index.index) if hasattr(index, 'id_map') else index
+        # The ID-mapped wrapper owns the storage index; freeing it would free the vectors.
+        self._owner = index
+        self.job_ids = np.asarray(job_ids, dtype=np.int64)
+        self.vectors = vectors if vectors is not None else _index_vectors(self.index)
+        self.ann_index = ann_index
+        self.rescore = rescore and ann_index is not None
+        # Sorted view of the ID map: job ID -> row lookups become a binary search
+        # instead of a Python dict with one entry per job.
+        self._order = np.argsort(self.job_ids, kind='stable')
+        self._sorted_ids = self.job_ids[self._order]
+
+    @classmethod
+    def from_files(cls, flat_path: str, job_ids: np.ndarray, ann_path: str | None = None,
+                   compact: bool = False) -> "VectorSearchEngine":
+        """
+        Opens an ID-mapped flat index file (and the approximate or compact
+        index built from it), checking both against `job_ids`. With `compact`
+        the flat file's vectors are only memory-mapped for re-scoring.
+        """
+        if compact:
+            index = None
+            vectors, index_ids = mmap_flat_id_index(flat_path)
+        else:
+            index = read_index_mmap(flat_path)
+            vectors = None
+            index_ids = faiss.vector_to_array(index.id_map) if hasattr(index, 'id_map') else None
+        # Both files come from the same build by construction; refuse to serve
+        # them at all if they were tampered with.
+        ntotal = index.ntotal if index is not None else vectors.shape[0]
+        if ntotal != job_ids.size:
+            raise ValueError(f"{flat_path} has {ntotal} vectors but the ID map has {job_ids.size} entries")
+        if index_ids is not None and not np.array_equal(index_ids, job_ids):
+            raise ValueError(f"the internal ID map of {flat_path} doesn't match the job IDs")
+        ann_index = None
+        if ann_path is not None:
+            ann_index = read_index_mmap(ann_path)
+            if ann_index.ntotal != job_ids.size:
+                raise ValueError(f"{ann_path} has {ann_index.ntotal} vectors but the ID map has {job_ids.size} entries")
+        return cls(index, job_ids, ann_index=ann_index, vectors=vectors, rescore=compact)
+
+    @property
+    def size(self) -> int:
+        return int(self.job_ids.size)
+
+    def rows_for_ids(self, job_ids) -> np.ndarray:
+        """Returns the index rows of the given job IDs, skipping IDs that aren't indexed."""
+        ids = np.asarray(job_ids, dtype=np.int64)
+        if ids.size == 0 or self._sorted_ids.size == 0:
+            return np.empty(0, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_ids, ids)
+        pos[pos >= self._sorted_ids.size] = 0
+        found = self._sorted_ids[pos] == ids
+        return self._order[pos[found]]
+
+    def search(self, query: np.ndarray, k: int, rows: np.ndarray | None = None,
+               mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Finds the k rows most similar to `query` among the allowed rows.
+
+        Args:
+            query: A single embedding; it is L2-normalized here so scores are cosine similarities.
+            k: Number of results.
+            rows: Allowed row positions, or
+            mask: a boolean array over all rows. If neither is given every row is allowed.
+
+        Returns:
+            (rows, scores), best match first.
+        """
+        q = np.asarray(query, dtype=np.float32).reshape(1, -1).copy()
+        faiss.normalize_L2(q)
+
+        if mask is None:
+            if rows is None:
+                mask = np.ones(self.size, dtype=bool)
+            else:
+                mask = np.zeros(self.size, dtype=bool)
+                mask[rows] = True
+        n_allowed = int(np.count_nonzero(mask))
+        k = min(k, n_allowed)
+        if k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if self.ann_index is not None and _HAS_SEARCH_PARAMS and n_allowed >= ANN_MIN_ALLOWED_FRACTION * self.size:
+            found_rows, scores = self._search_ann(q, k, mask, n_allowed)
+            if found_rows.size >= k:
+                return found_rows, scores
+        if _HAS_SEARCH_PARAMS and self.index is not None:
+            return self._search_faiss(q, k, mask)
+        return self._search_numpy(q[0], k, mask)
+
+    def search_many(self, queries: np.ndarray, k: int, masks: list[np.ndarray]) -> list[tuple[np.ndarray, np.ndarray]]:
+        """
+        `search` for a batch of queries, each with its own mask; returns one
+        (rows, scores) per query. Queries that `search` would answer from the
+        approximate index go there one by one. The rest are scored exactly
+        together, one block of rows at a time, so the matrix (memory-mapped
+        or not) is read once per batch and never copied whole.
+        """
+        results = [None] * len(masks)
+        exact = []
+        for i, mask in enumerate(masks):
+            if self.ann_index is not None and _HAS_SEARCH_PARAMS and \
+                    np.count_nonzero(mask) >= ANN_MIN_ALLOWED_FRACTION * self.size:
+                results[i] = self.search(queries[i], k, mask=mask)
+            else:
+                exact.append(i)
+        if not exact:
+            return results
+
+        q = np.ascontiguousarray(np.asarray(queries, dtype=np.float32)[exact])
+        faiss.normalize_L2(q)
+        allowed = np.stack([masks[i] for i in exact])
+        limits = np.minimum(k, allowed.sum(axis=1))
+        found = [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in exact]
+        union = np.flatnonzero(allowed.any(axis=0))
+        # As in _search_numpy: gather a selective union's rows, stream every row for a broad one.
+        gather = union.size * 4 < self.size
+        for start in range(0, union.size if gather else self.size, _SCORE_BLOCK_ROWS):
+            if gather:
+                rows = union[start:start + _SCORE_BLOCK_ROWS]
+                block = self.vectors[rows]
+            else:
+                rows = np.arange(start, min(start + _SCORE_BLOCK_ROWS, self.size))
+                block = self.vectors[start:start + _SCORE_BLOCK_ROWS]
+            scores = block @ q.T
+            for j in range(len(exact)):
+                keep = allowed[j, rows]
+                if not keep.any():
+                    continue
+                candidate_rows = np.concatenate([found[j][0], rows[keep]])
+                candidate_scores = np.concatenate([found[j][1], scores[keep, j]])
+                top = top_k_indices(candidate_scores, int(limits[j]))
+                found[j] = candidate_rows[top], candidate_scores[top]
+        for i, result in zip(exact, found):
+            results[i] = result
+        return results
+
+    def _search_ann(self, q: np.ndarray, k: int, mask: np.ndarray, n_allowed: int):
+        bitmap = None if n_allowed == self.size else np.packbits(mask, bitorder='little')
+        selector = None if bitmap is None else faiss.IDSelectorBitmap(self.size, faiss.swig_ptr(bitmap))
+        fetch = min(n_allowed, k * RESCORE_FACTOR) if self.rescore else k
+        params = search_parameters(self.ann_index, fetch, selector, n_allowed / self.size)
+        scores, labels = self.ann_index.search(q, fetch, params=params)
+        keep = labels[0] >= 0
+        found_rows, scores = labels[0][keep].astype(np.int64), scores[0][keep]
+        if self.rescore:
+            # Sorted rows read the memory-mapped vectors front to back.
+            found_rows = np.sort(found_rows)
+            scores = self.vectors[found_rows] @ q[0]
+            top = top_k_indices(scores, k)
+            found_rows, scores = found_rows[top], scores[top]
+        return found_rows, scores
+
+    def _search_faiss(self, q: np.ndarray, k: int, mask: np.ndarray):
+        # Bit i of the bitmap enables row i; FAISS skips every other row.
+        bitmap = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(self.size, faiss.swig_ptr(bitmap))
+        scores, labels = self.index.search(q, k, params=faiss.SearchParameters(sel=selector))
+        keep = labels[0] >= 0
+        return labels[0][keep].astype(np.int64), scores[0][keep]
+
+    def _search_numpy(self, q: np.ndarray, k: int, mask: np.ndarray):
+        allowed = np.flatnonzero(mask)
+        # A selective filter only touches its own rows; a broad one is cheaper
+        # as a single matrix-vector product over the whole contiguous matrix.
+        if allowed.size * 4 < self.size:
+            scores = self.vectors[allowed] @ q
+        else:
+            scores = (self.vectors @ q)[allowed]
+        top = top_k_indices(scores, k)
+        return allowed[top], scores[top]
@@ -0,0 +1,178 @@
+# services/vector_shards.py
+"""
+Per-category shards of the job vector index.
+
+Most users set a preferred category, and the sieve then drops every job of
+the other categories, yet the vector search still walked one index over the
+whole corpus. With sharding enabled (VECTOR_SHARDS=category or
+embed_jobs.py --shards category) the bundle also carries one index per
+category, plus one for uncategorized jobs:
+
+    shards/
+        <category_id>/ or uncategorized/
+            job_index.faiss       <- ID-mapped flat index: the shard's own ID map
+            job_index_ann.faiss   <- HNSW / IVF / compact index, as for the global one
+            rows.npy              <- global row of every shard row
+
+A request whose filters pin a category searches only that shard, with the
+user's candidate mask cut down to the shard's rows, so the work scales with
+the shard instead of the corpus. Results from several shards are merged by
+score into one top-k. Requests without a category filter keep using the
+global index, which already covers every shard in a single search.
+
+Shards are built from the global flat index after it is finished, one
+shard's vectors in memory at a time; nothing is re-embedded. A publish
+reuses the live bundle's shards: untouched categories are hard-linked
+forward, and touched ones get their approximate index updated in place
+where services/ann_index.py can, so an incremental run only pays for the
+categories it changed.
+"""
+import os
+import shutil
+
+import faiss
+import numpy as np
+from dotenv import load_dotenv
+
+from services.ann_index import build_ann_index, unchanged_rows, update_ann_index
+from services.vector_search import VectorSearchEngine, top_k_indices
+
+load_dotenv()
+
+SHARD_MODES = ('none', 'category')
+VECTOR_SHARDS = os.getenv('VECTOR_SHARDS', 'none').lower()
+UNCATEGORIZED = 'uncategorized'
+
+
+def shard_key(category_id) -> str:
+    """Shard name of a category ID (-1 or None = uncategorized)."""
+    return UNCATEGORIZED if category_id is None or int(category_id) < 0 else str(int(category_id))
+
+
+def shards_for(context) -> list[str] | None:
+    """The shards a user's filters allow, or None if every shard is allowed."""
+    if context.preferred_category_id:
+        return [shard_key(context.preferred_category_id)]
+    return None
+
+
+def _link_or_copy(src: str, dst: str):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def build_shards(flat_index, job_ids: np.ndarray, category_ids: np.ndarray, directory: str,
+                 index_type: str, storage: str, content_hashes: np.ndarray | None = None,
+                 live: dict | None = None) -> tuple[list[str], dict]:
+    """
+    Writes one shard per distinct category into `directory`. Returns the
+    written paths relative to the directory's parent and the manifest entry.
+
+    `live` (the live "vectors" component, see BundleWriter) lets unchanged
+    work be reused: a shard whose jobs and content hashes are exactly the live
+    shard's is hard-linked forward, and a changed one has its live approximate
+    index updated (`update_ann_index`) instead of rebuilt.
+    """
+    flat = faiss.downcast_index(flat_index.index) if hasattr(flat_index, 'id_map') else flat_index
+    keys = np.array([shard_key(c) for c in np.asarray(category_ids).tolist()])
+    base = os.path.basename(directory)
+    live_shards = ((live["meta"].get("shards") or {}).get("shards") or {}) if live is not None else {}
+    files, shards = [], {}
+    counts = {"carried": 0, "updated": 0, "built": 0}
+    for key in sorted(set(keys.tolist())):
+        rows = np.flatnonzero(keys == key).astype(np.int64)
+        shard_dir = os.path.join(directory, key)
+        os.makedirs(shard_dir, exist_ok=True)
+        np.save(os.path.join(shard_dir, 'rows.npy'), rows)
+        shard_files = [f'{base}/{key}/job_index.faiss', f'{base}/{key}/rows.npy']
+
+        # Shard-local rows of the live shard holding each job's vector unchanged.
+        source_rows, live_dir = None, None
+        live_shard = live_shards.get(key)
+        if live_shard is not None and "ann_index" in live_shard and content_hashes is not None:
+            live_dir = os.path.join(live["path"], base, key)
+            live_rows = np.load(os.path.join(live_dir, 'rows.npy'))
+            source_rows = unchanged_rows(np.asarray(live["job_ids"])[live_rows],
+                                         np.asarray(live["content_hashes"])[live_rows],
+                                         job_ids[rows], np.asarray(content_hashes)[rows])
+            if live_rows.size == rows.size and np.array_equal(source_rows, np.arange(rows.size)):
+                for name in ('job_index.faiss', 'job_index_ann.faiss'):
+                    if os.path.exists(os.path.join(live_dir, name)):
+                        _link_or_copy(os.path.join(live_dir, name), os.path.join(shard_dir, name))
+                if os.path.exists(os.path.join(shard_dir, 'job_index_ann.faiss')):
+                    shard_files.append(f'{base}/{key}/job_index_ann.faiss')
+                files += shard_files
+                shards[key] = {"count": int(rows.size), "ann_index": live_shard["ann_index"]}
+                counts["carried"] += 1
+                continue
+
+        shard = faiss.IndexIDMap2(faiss.IndexFlatIP(flat.d))
+        shard.add_with_ids(np.ascontiguousarray(flat.reconstruct_batch(rows), dtype=np.float32), job_ids[rows])
+        faiss.write_index(shard, os.path.join(shard_dir, 'job_index.faiss'))
+        updated = None
+        if source_rows is not None and os.path.exists(os.path.join(live_dir, 'job_index_ann.faiss')):
+            try:
+                updated = update_ann_index(faiss.read_index(os.path.join(live_dir, 'job_index_ann.faiss')),
+                                           live_shard["ann_index"], source_rows, shard)
+            except Exception as e:
+                print(f"WARNING (shards): Could not update the live index of shard {key}, rebuilding it: {e}")
+        ann_index, ann_meta = updated or build_ann_index(shard, index_type, storage)
+        counts["updated" if updated else "built"] += 1
+        if ann_index is not None:
+            faiss.write_index(ann_index, os.path.join(shard_dir, 'job_index_ann.faiss'))
+            shard_files.append(f'{base}/{key}/job_index_ann.faiss')
+        files += shard_files
+        shards[key] = {"count": int(rows.size), "ann_index": ann_meta}
+    print(f"Built {len(shards)} category shards ({counts['carried']} carried over unchanged, "
+          f"{counts['updated']} updated, {counts['built']} built).")
+    return files, {"by": "category", "shards": shards}
+
+
+class ShardedSearch:
+    """The shards of a bundle, each with its own VectorSearchEngine over its rows."""
+
+    def __init__(self, engines: dict, rows: dict):
+        self.engines = engines
+        self.rows = rows
+
+    @classmethod
+    def load(cls, directory: str, meta: dict, job_ids: np.ndarray, has_ann: bool, compact: bool) -> "ShardedSearch":
+        engines, rows = {}, {}
+        for key, shard_meta in meta["shards"].items():
+            shard_dir = os.path.join(directory, key)
+            shard_rows = np.load(os.path.join(shard_dir, 'rows.npy'))
+            if shard_rows.size != shard_meta["count"]:
+                raise ValueError(f"shard {key} lists {shard_meta['count']} rows but rows.npy has {shard_rows.size}")
+            engines[key] = VectorSearchEngine.from_files(
+                os.path.join(shard_dir, 'job_index.faiss'), np.asarray(job_ids[shard_rows]),
+                os.path.join(shard_dir, 'job_index_ann.faiss') if has_ann else None, compact)
+            rows[key] = shard_rows
+        return cls(engines, rows)
+
+    def search(self, query: np.ndarray, k: int, keys: list[str],
+               mask: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k over the given shards. `mask` is over global rows; results are
+        global rows and scores, best first, like VectorSearchEngine.search.
+        """
+        found_rows, found_scores = [], []
+        for key in keys:
+            engine = self.engines.get(key)
+            if engine is None:
+                continue
+            shard_rows = self.rows[key]
+            shard_mask = mask[shard_rows] if mask is not None else None
+            if shard_mask is not None and not shard_mask.any():
+                continue
+            local, scores = engine.search(query, k, mask=shard_mask)
+            found_rows.append(shard_rows[local])
+            found_scores.append(scores)
+        if not found_rows:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        if len(found_rows) == 1:
+            return found_rows[0], found_scores[0]
+        rows, scores = np.concatenate(found_rows), np.concatenate(found_scores)
+        top = top_k_indices(scores, k)
+        return rows[top], scores[top]